@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+import logging
+import numpy as np
+import pandas as pd
+from fakes import FakeGeminiModel, FakeSheetsClient, FakeSMTP
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STAGES = ['load', 'validate', 'analyze', 'narrate', 'render', 'deliver']
+
+# Cumulative `python -X importtime` budgets. pandas accounts for most of
+# main's budget; Gemini, gspread, ReportLab, qrcode and APScheduler are
+# imported on first use and must not show up here.
+IMPORT_BUDGETS_MS = {
+    'main': 800,
+    'pdf_engine': 100,
+    'render_pool': 100,
+}
+
+def synthetic_cohort(students, subjects=('Math', 'Science', 'English', 'History'),
+                     languages=('en', 'hi', 'es', 'fr', 'ar'),
+                     acc_prefs=('standard', 'dyslexic', 'adhd', 'low-vision'),
+                     missing_rate=0.05, seed=0):
+    """Sheet-shaped DataFrame with plausible scores, answers and preferences"""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(100000, 100000 + students)
+    data = {
+        'StudentID': ids,
+        'StudentName': [f"Student {i}" for i in ids],
+    }
+    for subject in subjects:
+        base = rng.integers(40, 95, students)
+        for period, drift in (('P2', 0), ('P1', 4), ('C', 8)):
+            scores = np.clip(base + drift + rng.integers(-20, 20, students), 0, 100).astype(float)
+            if period != 'C':
+                scores[rng.random(students) < missing_rate] = np.nan
+            data[f"{subject}_{period}"] = scores
+    for i in range(1, 5):
+        data[f"VARK_Q{i}"] = rng.choice(list('ABCD'), students)
+    data['LangPref'] = rng.choice(list(languages), students)
+    data['AccPref'] = rng.choice(list(acc_prefs), students)
+    data['ContactEmail'] = [f"guardian{i}@example.com" for i in ids]
+    return pd.DataFrame(data)
+
+def _git_version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+def measure_import_time(module):
+    """Cumulative import time of `module` in a fresh interpreter, in ms"""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    for line in reversed(proc.stderr.splitlines()):
+        parts = [p.strip() for p in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000.0
+    raise RuntimeError(f"Could not import {module}: {proc.stderr.strip()[-500:]}")
+
+def check_import_budgets(budgets=IMPORT_BUDGETS_MS):
+    """Measure each module against its budget"""
+    results = {}
+    for module, budget in budgets.items():
+        # Best of three to smooth out a cold disk cache
+        ms = min(measure_import_time(module) for _ in range(3))
+        results[module] = {'ms': round(ms, 1), 'budget_ms': budget, 'ok': ms <= budget}
+    return results
+
+def _stage_timings(snapshot):
+    """Per-stage totals from the pipeline_stage_seconds histograms.
+
+    Stages overlap in the pipeline, so `seconds` is the time spent inside
+    a stage summed over its workers, not wall-clock time. Cohort-wide
+    local analysis (analyze_cohort) is counted under analyze.
+    """
+    totals = {stage: {'seconds': 0.0, 'items': 0} for stage in STAGES}
+    for h in snapshot['histograms']:
+        if h['name'] != 'pipeline_stage_seconds':
+            continue
+        stage = h['labels'].get('stage')
+        stage = 'analyze' if stage == 'analyze_cohort' else stage
+        if stage in totals:
+            totals[stage]['seconds'] += h['sum']
+            totals[stage]['items'] += h['count']
+    return {
+        stage: {
+            'seconds': round(t['seconds'], 4),
+            'items': t['items'],
+            'per_item_ms': round(t['seconds'] * 1000 / t['items'], 4) if t['items'] else None,
+        }
+        for stage, t in totals.items()
+    }
+
+def _counter(snapshot, name, **labels):
+    return sum(c['value'] for c in snapshot['counters']
+               if c['name'] == name and all(c['labels'].get(k) == v for k, v in labels.items()))
+
+def run_benchmark(students, args):
+    """Run generate_reports(dry_run=True) over a synthetic cohort with fake backends"""
+    # Imported here so the benchmark module itself loads without the pipeline
+    import main as pipeline_main
+    from data_processor import DataProcessor
+    from report_generator import ReportGenerator
+    from pdf_engine import PDFEngine
+    from response_cache import ResponseCache
+    from rate_limiter import AdaptiveRateLimiter
+    from smtp_pool import SMTPPool
+    from metrics import metrics
+
+    cohort = synthetic_cohort(students, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix='saarai-bench-')
+    cwd = os.getcwd()
+    enabled = metrics.enabled
+    try:
+        os.environ.setdefault('GOOGLE_SHEETS_ID', 'benchmark')
+        processor = DataProcessor(
+            client=FakeSheetsClient(cohort, latency=args.sheets_latency, seed=args.seed),
+            sync_mode='full'
+        )
+        report_gen = ReportGenerator(
+            cache=ResponseCache(mode='off'),
+            analysis_mode=args.analysis_mode,
+            model=FakeGeminiModel(
+                latency=args.gemini_latency,
+                jitter=args.gemini_latency / 2,
+                failure_rate=args.gemini_failure_rate,
+                retry_after=0.05,
+                seed=args.seed,
+                spike_rate=args.gemini_spike_rate,
+                spike_seconds=args.gemini_spike_seconds
+            ),
+            limiter=AdaptiveRateLimiter(rpm=args.gemini_rpm, max_concurrency=args.workers)
+        )
+        smtp_pool = SMTPPool(
+            connection_factory=lambda: FakeSMTP(latency=args.smtp_latency, failure_rate=args.smtp_failure_rate),
+            size=args.smtp_pool_size
+        )
+        pdf_engine = PDFEngine(smtp_pool=smtp_pool)
+
+        # Reports, temp files and metrics output land in the scratch directory
+        os.chdir(workdir)
+        metrics.enabled = True
+        metrics.reset()
+        started = time.perf_counter()
+        results = pipeline_main.generate_reports(
+            max_workers=args.workers, dry_run=True,
+            processor=processor, report_gen=report_gen, pdf_engine=pdf_engine
+        )
+        elapsed = time.perf_counter() - started
+        snapshot = metrics.snapshot()
+    finally:
+        metrics.enabled = enabled
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'students': students,
+        'total_seconds': round(elapsed, 4),
+        'students_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+        'failed': sum(1 for r in results if r['status'] != 'ok'),
+        'stages': _stage_timings(snapshot),
+        'gemini_calls': report_gen.model.calls,
+        'gemini_limiter': report_gen.limiter.stats(),
+        'gemini_tokens': report_gen.tokens.summary(),
+        'gemini_hedging': report_gen.hedger.stats(),
+        'emails_sent': int(_counter(snapshot, 'emails_total', status='sent')),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with fake Gemini, Sheets and SMTP")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--analysis-mode', choices=['local', 'llm'], default='local')
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help="Mean seconds per fake Gemini call")
+    parser.add_argument('--gemini-failure-rate', type=float, default=0.0, help="Share of calls answered with 429")
+    parser.add_argument('--gemini-spike-rate', type=float, default=0.0,
+                        help="Share of fake Gemini calls that hang for --gemini-spike-seconds")
+    parser.add_argument('--gemini-spike-seconds', type=float, default=30.0)
+    parser.add_argument('--gemini-rpm', type=float, default=1000000)
+    parser.add_argument('--sheets-latency', type=float, default=0.2)
+    parser.add_argument('--smtp-latency', type=float, default=0.01)
+    parser.add_argument('--smtp-failure-rate', type=float, default=0.0)
+    parser.add_argument('--smtp-pool-size', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--check-imports', action='store_true',
+                        help="Only check import-time budgets; exit 1 if any is exceeded")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    imports = check_import_budgets()
+    for module, result in imports.items():
+        status = 'ok' if result['ok'] else 'OVER BUDGET'
+        print(f"import {module}: {result['ms']:.0f} ms (budget {result['budget_ms']} ms) {status}")
+    if args.check_imports:
+        sys.exit(0 if all(r['ok'] for r in imports.values()) else 1)
+
+    results = {
+        'version': _git_version(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'import_times': imports,
+        'runs': []
+    }
+    for size in args.sizes:
+        run = run_benchmark(size, args)
+        results['runs'].append(run)
+        stages = ', '.join(f"{s} {run['stages'][s]['seconds']:.2f}s" for s in STAGES)
+        print(f"{size} students: {run['total_seconds']:.2f}s (time in stage: {stages})")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -1,127 +1,194 @@
-import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
-import os
-import json
-from dotenv import load_dotenv
-import logging
-
-# Set up logging
-logger = logging.getLogger(__name__)
-
-load_dotenv()
-
-class DataProcessor:
-    def __init__(self):
-        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        self.creds = self._get_credentials()
-    
-    def _get_credentials(self):
-        """Handle credentials from file or JSON (Windows-safe)"""
-        service_account_file = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-        service_account_json = os.getenv('GOOGLE_APPLICATION_CREDENTIALS_JSON')
-
-        # If full JSON is provided in .env
-        if service_account_json:
-            try:
-                creds_data = json.loads(service_account_json)
-                logger.info("Using credentials from JSON string in environment.")
-                return Credentials.from_service_account_info(creds_data, scopes=self.scopes)
-            except Exception as e:
-                logger.error(f"Failed to load credentials from JSON: {e}")
-
-        # If a file path is provided
-        if service_account_file:
-            service_account_file = service_account_file.strip('"')  # Remove quotes
-            logger.info(f"Using credentials file: {service_account_file}")
-            if os.path.exists(service_account_file):
-                return Credentials.from_service_account_file(service_account_file, scopes=self.scopes)
-            else:
-                logger.error(f"Credentials file not found at: {service_account_file}")
-
-        # Try application default credentials
-        try:
-            from google.auth import default
-            creds, _ = default(scopes=self.scopes)
-            logger.info("Using application default credentials")
-            return creds
-        except Exception as e:
-            logger.error(f"Failed to get application default credentials: {e}")
-
-        # Fallback to sample data
-        logger.warning("Using sample data mode without Google credentials")
-        return None
-    
-    def load_data(self):
-        """Load data from Google Sheets or use sample data"""
-        try:
-            if self.creds:
-                gc = gspread.authorize(self.creds)
-                sheet_id = os.getenv('GOOGLE_SHEETS_ID')
-                if not sheet_id:
-                    raise ValueError("Google Sheets ID not configured")
-                
-                sheet = gc.open_by_key(sheet_id).sheet1
-                data = sheet.get_all_records()
-                logger.info(f"Loaded {len(data)} records from Google Sheets")
-                return pd.DataFrame(data)
-        except Exception as e:
-            logger.error(f"Error loading data from Google Sheets: {e}")
-        
-        # Fallback to sample data
-        logger.info("Using sample data for testing")
-        return pd.DataFrame({
-            'StudentID': [101, 102],
-            'StudentName': ['John Doe', 'Jane Smith'],
-            'Math_C': [85, 75],
-            'Math_P1': [72, 68],
-            'Math_P2': [68, 65],
-            'Science_C': [92, 85],
-            'Science_P1': [88, 82],
-            'VARK_Q1': ['A', 'B'],
-            'VARK_Q2': ['A', 'B'],
-            'VARK_Q3': ['B', 'A'],
-            'VARK_Q4': ['A', 'B'],
-            'LangPref': ['en', 'hi'],
-            'AccPref': ['standard', 'dyslexic'],
-            'ContactEmail': ['test1@example.com', 'test2@example.com']
-        })
-    
-    def validate_data(self, df):
-        """Validate and clean input data"""
-        critical_cols = ['StudentID', 'Math_C', 'Science_C', 'LangPref']
-        
-        # Check for missing critical columns
-        missing_cols = [col for col in critical_cols if col not in df.columns]
-        if missing_cols:
-            logger.warning(f"Missing critical columns: {', '.join(missing_cols)}")
-            for col in missing_cols:
-                df[col] = None
-        
-        # Drop rows missing critical values
-        df = df.dropna(subset=critical_cols, how='any')
-        
-        # Fill defaults
-        df['AccPref'] = df['AccPref'].fillna('standard')
-        df['ContactEmail'] = df['ContactEmail'].fillna('')
-        df['LangPref'] = df['LangPref'].fillna('en')
-        
-        # Fill VARK questions safely
-        for i in range(1, 5):
-            col = f'VARK_Q{i}'
-            if col in df.columns:
-                df[col] = df[col].fillna('A')
-            else:
-                df[col] = 'A'
-        
-        return df
-    
-    def get_teacher_quote(self, student_id):
-        """Get teacher quote (stub)"""
-        quotes = [
-            "Shows excellent problem-solving skills",
-            "Very engaged during class discussions",
-            "Needs to work on completing assignments on time",
-            "Demonstrates strong analytical thinking"
-        ]
-        return quotes[hash(student_id) % len(quotes)]
+import pandas as pd
+import numpy as np
+import os
+import json
+import zlib
+from dotenv import load_dotenv
+import logging
+from sheet_sync import SheetSync
+from schema import SchemaIndex
+from metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+class DataProcessor:
+    def __init__(self, client=None, sync_mode=None, offline=False):
+        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
+        # An injected gspread-like client skips credential discovery;
+        # offline mode skips it too and always uses the sample data
+        self.client = client
+        self.creds = None if (client or offline) else self._get_credentials()
+        # 'full' reloads the whole sheet; 'incremental' yields only new/changed rows
+        self.sync_mode = (sync_mode or os.getenv('SHEETS_SYNC_MODE', 'full')).lower()
+        self.pending_sync = None
+        self.schema = None
+        # Set to a started transcription.Transcriber to quote teacher recordings
+        self.transcriber = None
+    
+    def _get_credentials(self):
+        """Handle credentials from file or JSON (Windows-safe)"""
+        # google-auth is only imported when credentials are actually needed
+        from google.oauth2.service_account import Credentials
+        
+        service_account_file = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+        service_account_json = os.getenv('GOOGLE_APPLICATION_CREDENTIALS_JSON')
+
+        # If full JSON is provided in .env
+        if service_account_json:
+            try:
+                creds_data = json.loads(service_account_json)
+                logger.info("Using credentials from JSON string in environment.")
+                return Credentials.from_service_account_info(creds_data, scopes=self.scopes)
+            except Exception as e:
+                logger.error(f"Failed to load credentials from JSON: {e}")
+
+        # If a file path is provided
+        if service_account_file:
+            service_account_file = service_account_file.strip('"')  # Remove quotes
+            logger.info(f"Using credentials file: {service_account_file}")
+            if os.path.exists(service_account_file):
+                return Credentials.from_service_account_file(service_account_file, scopes=self.scopes)
+            else:
+                logger.error(f"Credentials file not found at: {service_account_file}")
+
+        # Try application default credentials
+        try:
+            from google.auth import default
+            creds, _ = default(scopes=self.scopes)
+            logger.info("Using application default credentials")
+            return creds
+        except Exception as e:
+            logger.error(f"Failed to get application default credentials: {e}")
+
+        # Fallback to sample data
+        logger.warning("Using sample data mode without Google credentials")
+        return None
+    
+    def load_data(self, fallback=True):
+        """Load data from Google Sheets or use sample data.
+
+        Without `fallback` a failing sheet raises instead of returning the
+        sample rows; sample data is still used when no sheet is configured.
+        """
+        try:
+            if self.client or self.creds:
+                if self.client is None:
+                    import gspread
+                    self.client = gspread.authorize(self.creds)
+                gc = self.client
+                sheet_id = os.getenv('GOOGLE_SHEETS_ID')
+                if not sheet_id:
+                    raise ValueError("Google Sheets ID not configured")
+                
+                sheet = gc.open_by_key(sheet_id).sheet1
+                if self.sync_mode == 'incremental':
+                    return self._load_changes(sheet)
+                with metrics.timer('sheets_fetch_seconds'):
+                    data = sheet.get_all_records()
+                metrics.inc('rows_loaded_total', len(data), source='sheets')
+                logger.info(f"Loaded {len(data)} records from Google Sheets")
+                return pd.DataFrame(data)
+        except Exception as e:
+            logger.error(f"Error loading data from Google Sheets: {e}")
+            if not fallback:
+                raise
+        
+        # Fallback to sample data
+        logger.info("Using sample data for testing")
+        metrics.inc('rows_loaded_total', 2, source='sample')
+        return pd.DataFrame({
+            'StudentID': [101, 102],
+            'StudentName': ['John Doe', 'Jane Smith'],
+            'Math_C': [85, 75],
+            'Math_P1': [72, 68],
+            'Math_P2': [68, 65],
+            'Science_C': [92, 85],
+            'Science_P1': [88, 82],
+            'VARK_Q1': ['A', 'B'],
+            'VARK_Q2': ['A', 'B'],
+            'VARK_Q3': ['B', 'A'],
+            'VARK_Q4': ['A', 'B'],
+            'LangPref': ['en', 'hi'],
+            'AccPref': ['standard', 'dyslexic'],
+            'ContactEmail': ['test1@example.com', 'test2@example.com']
+        })
+    
+    def _load_changes(self, sheet):
+        """Only the rows that changed since the last committed sync"""
+        self.pending_sync = SheetSync(sheet).sync()
+        return self.pending_sync.frame()
+    
+    def include_unchanged(self, student_ids):
+        """Add unchanged rows to an incremental sync's delta; returns the new frame, or None if none were added"""
+        if self.pending_sync is None or not self.pending_sync.include(student_ids):
+            return None
+        return self.pending_sync.frame()
+    
+    def student_ids(self, df):
+        """Every StudentID in the cohort, including rows an incremental sync skipped as unchanged"""
+        if self.pending_sync is not None:
+            return set(self.pending_sync.student_ids)
+        return {str(sid) for sid in df['StudentID']} if 'StudentID' in df.columns else set()
+    
+    def commit_sync(self, failed_ids=()):
+        """Record the fetched rows as processed so the next run skips them"""
+        if self.pending_sync is not None:
+            self.pending_sync.commit(skip=failed_ids)
+            self.pending_sync = None
+    
+    def validate_data(self, df):
+        """Validate and clean input data"""
+        critical_cols = ['StudentID', 'Math_C', 'Science_C', 'LangPref']
+        defaults = {'AccPref': 'standard', 'ContactEmail': '', 'LangPref': 'en'}
+        
+        # Work on a copy so the caller's frame is never mutated
+        df = df.copy()
+        
+        # Check for missing critical columns
+        missing_cols = [col for col in critical_cols if col not in df.columns]
+        if missing_cols:
+            logger.warning(f"Missing critical columns: {', '.join(missing_cols)}")
+            for col in missing_cols:
+                df[col] = None
+        
+        # Sheets returns blank cells as '' rather than NaN
+        checked = [col for col in dict.fromkeys(critical_cols + list(defaults)) if col in df.columns]
+        df[checked] = df[checked].replace(r'^\s*$', np.nan, regex=True)
+        
+        # Drop rows missing critical values
+        rows_before = len(df)
+        df = df.dropna(subset=critical_cols, how='any')
+        metrics.inc('rows_dropped_total', rows_before - len(df))
+        
+        # Fill defaults
+        fills = {col: df[col].fillna(value) if col in df.columns else value for col, value in defaults.items()}
+        
+        # Fill VARK questions safely
+        for i in range(1, 5):
+            col = f'VARK_Q{i}'
+            fills[col] = df[col].fillna('A') if col in df.columns else 'A'
+        
+        df = df.assign(**fills)
+        
+        # Index subjects and VARK columns once for the per-student stages
+        self.schema = SchemaIndex.from_columns(df.columns)
+        # float32 scores and categorical answers/preferences: several times smaller than object columns
+        return self.schema.compact(df)
+    
+    def get_teacher_quote(self, student_id):
+        """Transcribed teacher recording, or a canned quote when there is none"""
+        if self.transcriber is not None:
+            transcript = self.transcriber.quote(student_id)
+            if transcript:
+                return transcript
+        quotes = [
+            "Shows excellent problem-solving skills",
+            "Very engaged during class discussions",
+            "Needs to work on completing assignments on time",
+            "Demonstrates strong analytical thinking"
+        ]
+        # crc32 rather than hash(): the same student gets the same quote in every process
+        return quotes[zlib.crc32(str(student_id).encode()) % len(quotes)]
@@ -0,0 +1,213 @@
+import re
+import json
+import time
+import random
+import smtplib
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class _Latency:
+    """Sleep for `mean` seconds +/- `jitter`, and fail at `failure_rate`.
+
+    A `spike_rate` share of calls takes `spike_seconds` instead, like a
+    request that hangs; with a `timeout` the wait is cut short and
+    TimeoutError raised, as the real client does.
+    """
+
+    def __init__(self, mean=0.0, jitter=0.0, failure_rate=0.0, seed=None, spike_rate=0.0, spike_seconds=0.0):
+        self.mean = mean
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.spike_rate = spike_rate
+        self.spike_seconds = spike_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.spikes = 0
+
+    def wait(self, timeout=None):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.mean + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+            if self.spike_rate and self._random.random() < self.spike_rate:
+                self.spikes += 1
+                delay = self.spike_seconds
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake call timed out after {timeout:g}s")
+        if delay:
+            time.sleep(delay)
+        return fail
+
+class FakeThrottle(Exception):
+    """Looks like a 429 to rate_limiter.is_throttle"""
+    code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("429 Resource has been exhausted (fake)")
+        self.retry_after = retry_after
+
+class _UsageMetadata:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+class FakeResponse:
+    def __init__(self, text, prompt):
+        self.text = text
+        self.usage_metadata = _UsageMetadata(len(prompt) // 4, len(text) // 4)
+
+class FakeGeminiModel:
+    """Stand-in for genai.GenerativeModel with configurable latency and throttling.
+
+    Replies in the shape ReportGenerator expects: analysis JSON, structured
+    narrative JSON, batched JSON arrays keyed by StudentID, or a plain-text
+    narrative.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, retry_after=None, seed=None,
+                 spike_rate=0.0, spike_seconds=30.0):
+        self.latency = _Latency(latency, jitter, failure_rate, seed, spike_rate, spike_seconds)
+        self.retry_after = retry_after
+
+    @property
+    def calls(self):
+        return self.latency.calls
+
+    def generate_content(self, prompt, safety_settings=None, generation_config=None, request_options=None):
+        timeout = (request_options or {}).get('timeout')
+        if self.latency.wait(timeout):
+            raise FakeThrottle(self.retry_after)
+
+        if isinstance(generation_config, dict):
+            mime_type = generation_config.get('response_mime_type')
+        else:
+            mime_type = getattr(generation_config, 'response_mime_type', None)
+        wants_json = mime_type == 'application/json'
+        student_ids = re.findall(r'"StudentID":\s*"([^"]+)"', prompt)
+        structured = 'trend_highlight' in prompt
+        if wants_json and student_ids:
+            entries = [
+                dict(self._structured(), StudentID=sid) if structured
+                else dict(self._analysis(), StudentID=sid, report=self._narrative(sid))
+                for sid in student_ids
+            ]
+            return FakeResponse(json.dumps(entries), prompt)
+        if wants_json and structured:
+            return FakeResponse(json.dumps(self._structured()), prompt)
+        if wants_json:
+            return FakeResponse(json.dumps(self._analysis()), prompt)
+        return FakeResponse(self._narrative(), prompt)
+
+    @staticmethod
+    def _analysis():
+        return {
+            "strengths": [{"subject": "Math", "evidence": "Consistently high scores"}],
+            "improvements": [{"subject": "Science", "trend": 8.5}],
+            "risks": []
+        }
+
+    @staticmethod
+    def _structured():
+        return {
+            "trend_highlight": "Science is climbing steadily - keep it up!",
+            "study_tips": ["Draw mind maps", "Colour-code notes"]
+        }
+
+    @staticmethod
+    def _narrative(student_id=''):
+        return (
+            f"★ Top Strength: Math {student_id}\n\n"
+            "Learning Style: Visual\n\n"
+            "STRENGTHS:\n- Consistent effort\n\n"
+            "IMPROVEMENT AREAS:\n- Science revision\n\n"
+            "STUDY HACKS:\n1. Draw mind maps\n2. Colour-code notes"
+        )
+
+class FakeWorksheet:
+    """gspread Worksheet over a DataFrame: get_all_records plus ranged reads.
+
+    Like the Sheets API, ranged reads drop trailing blank cells and rows.
+    """
+
+    def __init__(self, df, latency=0.0, failure_rate=0.0, seed=None):
+        self.df = df
+        self.latency = _Latency(latency, 0.0, failure_rate, seed)
+
+    @property
+    def row_count(self):
+        return len(self.df) + 1
+
+    def _call(self):
+        if self.latency.wait():
+            raise ConnectionError("Sheets API unavailable (fake)")
+
+    def get_all_records(self):
+        self._call()
+        return self.df.fillna('').to_dict('records')
+
+    def row_values(self, row):
+        self._call()
+        if row == 1:
+            return [str(col) for col in self.df.columns]
+        return [str(v) for v in self.df.iloc[row - 2].fillna('')]
+
+    def get_values(self, range_name):
+        self._call()
+        first, last = range_name.split(':')
+        start = int(re.sub(r'\D', '', first))
+        end = int(re.sub(r'\D', '', last))
+        rows = self.df.iloc[start - 2:end - 1].fillna('')
+        values = [['' if v == '' else str(v) for v in row] for row in rows.itertuples(index=False)]
+        for row in values:
+            while row and row[-1] == '':
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+class FakeSheetsClient:
+    """Enough of gspread.Client for DataProcessor(client=...)"""
+
+    def __init__(self, df, latency=0.0, failure_rate=0.0, seed=None):
+        self.worksheet = FakeWorksheet(df, latency, failure_rate, seed)
+
+    def open_by_key(self, key):
+        client = self
+
+        class _Spreadsheet:
+            sheet1 = client.worksheet
+
+        return _Spreadsheet()
+
+class FakeSMTP:
+    """smtplib.SMTP stand-in; use via SMTPPool(connection_factory=...)"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = _Latency(latency, 0.0, failure_rate, seed)
+        self.sent = []
+
+    def starttls(self, context=None):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def send_message(self, msg):
+        if self.latency.wait():
+            raise smtplib.SMTPServerDisconnected("Connection dropped (fake)")
+        self.sent.append(msg['To'])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
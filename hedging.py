@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+import collections
+import logging
+from concurrent.futures import ThreadPoolExecutor, CancelledError, FIRST_COMPLETED, wait
+from metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class DeadlineExceeded(TimeoutError):
+    """No attempt answered before the call's deadline"""
+
+class LatencyTracker:
+    """Sliding window of recent latencies per call type (e.g. prompt template)"""
+
+    def __init__(self, window=None, min_samples=None):
+        self.window = int(window or os.getenv('GEMINI_HEDGE_WINDOW', '200'))
+        self.min_samples = int(min_samples or os.getenv('GEMINI_HEDGE_MIN_SAMPLES', '20'))
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def observe(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, key, q):
+        """q-quantile of the window, or None until min_samples calls were seen"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+class HedgeBudget:
+    """Token bucket capping hedges to a share of primary calls.
+
+    Every primary call earns `ratio` of a hedge, up to `burst` saved
+    hedges, so with ratio=0.05 at most ~5% extra requests are sent no
+    matter how slow the backend gets.
+    """
+
+    def __init__(self, ratio=None, burst=None):
+        self.ratio = float(ratio if ratio is not None else os.getenv('GEMINI_HEDGE_BUDGET', '0.05'))
+        self.burst = float(burst if burst is not None else os.getenv('GEMINI_HEDGE_BURST', '5'))
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+
+    def earn(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+class Hedger:
+    """Run calls with a deadline, hedging slow ones.
+
+    `call(key, fn)` runs `fn(deadline_at, cancelled)` on a worker thread.
+    If no answer arrives within the key's recent p95 latency (or
+    `min_delay` until enough samples exist) and the budget allows, a
+    second copy starts; the first success wins and the other copy's
+    `cancelled` event is set, so an attempt still waiting for a rate-limit
+    slot gives up without sending. If nothing succeeds by the deadline the
+    call raises DeadlineExceeded.
+
+    Hedging is opt-in (GEMINI_HEDGE=on): duplicates cost quota, and until
+    the tracker has a latency history every call slower than `min_delay`
+    would qualify. With it off, calls still get their deadline.
+    """
+
+    def __init__(self, workers=None, deadline=None, quantile=None, min_delay=None, enabled=None,
+                 tracker=None, budget=None):
+        self.deadline = float(deadline or os.getenv('GEMINI_DEADLINE_SECONDS', '60'))
+        self.quantile = float(quantile or os.getenv('GEMINI_HEDGE_QUANTILE', '0.95'))
+        self.min_delay = float(min_delay if min_delay is not None else os.getenv('GEMINI_HEDGE_MIN_DELAY', '1'))
+        if enabled is None:
+            enabled = os.getenv('GEMINI_HEDGE', 'off').lower() == 'on'
+        self.enabled = enabled
+        self.tracker = tracker or LatencyTracker()
+        self.budget = budget or HedgeBudget()
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(workers or os.getenv('GEMINI_CALL_THREADS', '32')),
+            thread_name_prefix='gemini-call'
+        )
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.deadlines = 0
+
+    def delay(self, key):
+        """How long to wait before hedging a call of this type"""
+        p = self.tracker.quantile(key, self.quantile)
+        return max(self.min_delay, p) if p is not None else self.min_delay
+
+    def _start(self, fn, deadline_at, cancelled):
+        started = time.monotonic()
+        future = self._executor.submit(fn, deadline_at, cancelled)
+        return future, started
+
+    def call(self, key, fn, deadline=None, can_hedge=None):
+        """First successful result of fn; `can_hedge()` may veto a hedge (e.g. when rate limited)"""
+        budget = deadline if deadline is not None else self.deadline
+        deadline_at = time.monotonic() + budget
+        with self._lock:
+            self.calls += 1
+        self.budget.earn()
+
+        attempts = {}
+        cancelled = {}
+        primary_event = threading.Event()
+        future, started = self._start(fn, deadline_at, primary_event)
+        attempts[future] = ('primary', started)
+        cancelled[future] = primary_event
+        hedge_at = started + self.delay(key) if self.enabled else None
+        error = None
+        try:
+            while attempts:
+                now = time.monotonic()
+                if now >= deadline_at:
+                    break
+                until = deadline_at if hedge_at is None else min(deadline_at, hedge_at)
+                done, _ = wait(list(attempts), timeout=max(0.0, until - now), return_when=FIRST_COMPLETED)
+
+                for f in done:
+                    role, began = attempts.pop(f)
+                    try:
+                        result = f.result()
+                    except CancelledError:
+                        continue
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    self.tracker.observe(key, time.monotonic() - began)
+                    if role == 'hedge':
+                        with self._lock:
+                            self.hedge_wins += 1
+                        metrics.inc('gemini_hedges_total', result='won')
+                    elif len(cancelled) > 1:
+                        metrics.inc('gemini_hedges_total', result='lost')
+                    return result
+
+                if hedge_at is not None and time.monotonic() >= hedge_at and attempts:
+                    # Primary is slower than usual: maybe send a second copy
+                    hedge_at = None
+                    if can_hedge is not None and not can_hedge():
+                        metrics.inc('gemini_hedges_total', result='skipped')
+                    elif not self.budget.try_spend():
+                        with self._lock:
+                            self.budget_denied += 1
+                        metrics.inc('gemini_hedges_total', result='budget_denied')
+                    else:
+                        with self._lock:
+                            self.hedged += 1
+                        metrics.inc('gemini_hedges_total', result='sent')
+                        event = threading.Event()
+                        hedge, began = self._start(fn, deadline_at, event)
+                        attempts[hedge] = ('hedge', began)
+                        cancelled[hedge] = event
+
+            if attempts or error is None:
+                with self._lock:
+                    self.deadlines += 1
+                metrics.inc('gemini_deadline_exceeded_total', key=key)
+                raise DeadlineExceeded(f"No Gemini response within {budget:.3g}s ({key})")
+            raise error
+        finally:
+            # Losers and timed-out attempts are abandoned; their results are ignored
+            for f in attempts:
+                cancelled[f].set()
+                f.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'hedge_rate': round(self.hedged / self.calls, 4) if self.calls else 0.0,
+                'budget_denied': self.budget_denied,
+                'deadline_exceeded': self.deadlines
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
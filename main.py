@@ -1,83 +1,305 @@
-import pandas as pd
-from data_processor import DataProcessor
-from report_generator import ReportGenerator
-from pdf_engine import PDFEngine
-from privacy_manager import PrivacyManager
-import datetime
-import os
-import logging
-from dotenv import load_dotenv
-
-
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-load_dotenv()
-
-def generate_reports():
-    # Create required directories
-    for dir_path in ['reports', 'temp', 'teacher_audio']:
-        os.makedirs(dir_path, exist_ok=True)
-        logger.info(f"Created directory: {dir_path}")
-    
-    # Load and process data
-    processor = DataProcessor()
-    try:
-        df = processor.load_data()
-        validated_df = processor.validate_data(df)
-        logger.info(f"Loaded {len(validated_df)} student records")
-    except Exception as e:
-        logger.error(f"Data loading failed: {e}")
-        return
-    
-    # Generate reports
-    report_gen = ReportGenerator()
-    pdf_engine = PDFEngine()
-    
-    for _, row in validated_df.iterrows():
-        student_id = row['StudentID']
-        logger.info(f"Processing student: {student_id}")
-        
-        try:
-            # Generate insights
-            analysis = report_gen.analyze_scores(row)
-            vark_profile = report_gen.classify_vark(row)
-            
-            # Get teacher quote
-            teacher_quote = processor.get_teacher_quote(student_id)
-            
-            # Generate report content
-            report_content = report_gen.generate_narrative(
-                row, 
-                analysis, 
-                vark_profile,
-                teacher_quote=teacher_quote
-            )
-            
-            # Create PDF
-            pdf_path = f"reports/{student_id}_report.pdf"
-            pdf_engine.create_pdf(report_content, row['AccPref'], pdf_path)
-            
-            # Deliver report
-            if row.get('ContactEmail'):
-                pdf_engine.deliver_report(
-                    pdf_path, 
-                    row['ContactEmail'], 
-                    row['LangPref']
-                )
-                logger.info(f"Report delivered for {student_id}")
-        except Exception as e:
-            logger.error(f"Error processing student {student_id}: {e}")
-    
-    # Initiate privacy cleanup
-    PrivacyManager().schedule_deletion(datetime.datetime.now() + datetime.timedelta(hours=24))
-    logger.info("Scheduled data cleanup")
-
-if __name__ == "__main__":
-    try:
-        generate_reports()
-    except Exception as e:
-
-        logger.error(f"Fatal error in generate_reports: {e}")
+from data_processor import DataProcessor
+from report_generator import ReportGenerator
+from pdf_engine import PDFEngine, ArchiveWriter, ReportBundle, storage_mode
+from privacy_manager import PrivacyManager
+from render_pool import RenderPool
+from manifest import BuildManifest
+from metrics import metrics
+from pipeline import Pipeline, Stage, in_order
+from transcription import Transcriber, TranscriptCache
+from shard import Shard
+from report_stages import ReportStages
+import time
+import argparse
+import os
+import logging
+from dotenv import load_dotenv
+
+
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+def _env_int(name, default):
+    """Read a positive integer setting from the environment"""
+    try:
+        value = int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid value for {name}, using {default}")
+        return default
+    return max(1, value)
+
+def _shard_arg(spec):
+    try:
+        return Shard.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def generate_reports(max_workers=None, llm_in_flight=None, render_in_flight=None, deliver_in_flight=None,
+                     queue_size=None, dry_run=False, shard=None, processor=None, report_gen=None, pdf_engine=None):
+    """Build and deliver every student's report.
+
+    Students stream through analyze -> narrate -> render -> deliver stages
+    joined by bounded queues, each stage with its own worker threads, so
+    memory stays flat with cohort size and a slow stage (say SMTP) holds
+    back the stages feeding it instead of queueing up finished work.
+
+    With dry_run the run is fully offline: sample data, a canned Gemini
+    stand-in, no email, no manifest, snapshot or retention updates.
+
+    With a `shard.Shard`, only the students hashed to that shard are
+    processed, and reports, temp files, metrics and every SQLite store go
+    to the shard's own directory, so shards can run on separate hosts
+    over a shared filesystem.
+
+    `processor`, `report_gen` and `pdf_engine` replace the ones built
+    here; the benchmark passes them wired to fake backends. A dry run
+    with its own `pdf_engine` still runs the deliver stage against it.
+    """
+    reports_dir, temp_dir = 'reports', 'temp'
+    if shard is not None:
+        shard.isolate()
+        reports_dir, temp_dir = shard.path('reports'), shard.path('temp')
+        logger.info(f"Running {shard.name} in {shard.directory}")
+
+    # Create required directories
+    for dir_path in [reports_dir, temp_dir, 'teacher_audio']:
+        os.makedirs(dir_path, exist_ok=True)
+        logger.info(f"Created directory: {dir_path}")
+
+    # Purge anything that expired since the last run, even if no sweeper was running
+    privacy = None
+    if not dry_run:
+        privacy = PrivacyManager()
+        privacy.discover({temp_dir: 'temp', 'teacher_audio': 'audio', reports_dir: 'report'})
+        privacy.sweep()
+
+    # Load and process data
+    run_started = time.perf_counter()
+    processor = processor or DataProcessor(offline=dry_run)
+
+    # BUILD_MANIFEST=off regenerates and resends everything
+    manifest = None
+    if not dry_run and os.getenv('BUILD_MANIFEST', 'on').lower() != 'off':
+        manifest = BuildManifest()
+
+    transcriber = None
+    if os.getenv('TRANSCRIBE', 'on').lower() != 'off':
+        if dry_run:
+            transcriber = Transcriber(backend='stub', cache=TranscriptCache(':memory:'))
+        else:
+            transcriber = Transcriber()
+
+    def _close_early():
+        if manifest:
+            manifest.close()
+        if transcriber:
+            transcriber.close()
+        if privacy:
+            privacy.close()
+
+    try:
+        with metrics.timer('pipeline_stage_seconds', stage='load'):
+            df = processor.load_data()
+        if transcriber is not None and processor.pending_sync is not None:
+            # A new teacher recording changes the report even if the student's row did not
+            recorded = transcriber.changed_recordings(skip=processor.pending_sync.changed,
+                                                      built=manifest.quote_key if manifest else None)
+            included = processor.include_unchanged(recorded)
+            if included is not None:
+                logger.info(f"Rebuilding {len(included) - len(df)} unchanged students with new teacher audio")
+                df = included
+        if df.empty:
+            logger.info("No new or changed student records")
+            processor.commit_sync()
+            _close_early()
+            return []
+        cohort = processor.student_ids(df)
+        with metrics.timer('pipeline_stage_seconds', stage='validate'):
+            validated_df = processor.validate_data(df)
+        if shard is not None:
+            total = len(validated_df)
+            validated_df = shard.select(validated_df)
+            logger.info(f"{shard.name} owns {len(validated_df)} of {total} students")
+        logger.info(f"Loaded {len(validated_df)} student records")
+    except Exception as e:
+        logger.error(f"Data loading failed: {e}")
+        _close_early()
+        return []
+
+    # Generate reports
+    if report_gen is None and dry_run:
+        from fakes import FakeGeminiModel
+        from response_cache import ResponseCache
+        report_gen = ReportGenerator(model=FakeGeminiModel(), cache=ResponseCache(mode='off'))
+    elif report_gen is None:
+        report_gen = ReportGenerator()
+    deliver = not dry_run or pdf_engine is not None
+    pdf_engine = pdf_engine or PDFEngine()
+
+    # PDF_RENDER_MODE=process builds PDFs in a pool of worker processes
+    render_pool = None
+    if os.getenv('PDF_RENDER_MODE', 'thread').lower() == 'process':
+        render_pool = RenderPool()
+        render_pool.warm()
+
+    # Stage worker counts (PIPELINE_WORKERS=1 gives one worker per stage)
+    max_workers = max_workers or _env_int('PIPELINE_WORKERS', 4)
+    default_render = render_pool.workers if render_pool else max_workers
+    llm_workers = llm_in_flight or _env_int('LLM_MAX_IN_FLIGHT', max_workers)
+    render_workers = render_in_flight or _env_int('RENDER_MAX_IN_FLIGHT', default_render)
+    deliver_workers = deliver_in_flight or _env_int('DELIVERY_MAX_IN_FLIGHT', 2)
+
+    # Transcribe teacher recordings in worker processes while the pipeline analyzes
+    if transcriber is not None:
+        with metrics.timer('pipeline_stage_seconds', stage='transcribe_start'):
+            transcriber.start(student_ids=validated_df['StudentID'].tolist())
+        processor.transcriber = transcriber
+
+    batch_size = report_gen.batch_limit()
+    if batch_size > 1:
+        logger.info(f"Batching {batch_size} students per Gemini request")
+
+    # PDF_STORAGE=memory|archive attaches PDFs straight from memory
+    storage = storage_mode()
+    archive = ArchiveWriter() if storage == 'archive' else None
+    bundle, groups = None, None
+    if storage == 'bundle':
+        bundle = ReportBundle(reports_dir)
+        # BUNDLE_GROUP_COLUMN splits the bundle into one merged PDF per class
+        group_column = os.getenv('BUNDLE_GROUP_COLUMN', 'Class')
+        if group_column in validated_df.columns:
+            groups = validated_df[group_column].fillna('unassigned').astype(str).tolist()
+    if storage != 'disk':
+        logger.info(f"PDF storage: {storage}")
+
+    stages = ReportStages(processor, report_gen, pdf_engine, renderer=render_pool, manifest=manifest,
+                          privacy=privacy, storage=storage, archive=archive, reports_dir=reports_dir,
+                          bundle=bundle, groups=groups)
+    pipeline = Pipeline(
+        [
+            Stage('analyze', stages.analyze, llm_workers),
+            Stage('narrate', stages.narrate, llm_workers, fan_out=True),
+            Stage('render', stages.render, render_workers),
+        ] + ([Stage('deliver', stages.deliver, deliver_workers)] if deliver else []),
+        queue_size=queue_size,
+        on_error=stages.fail
+    )
+    logger.info(
+        f"Pipeline workers: analyze/narrate {llm_workers}, render {render_workers}, "
+        f"deliver {deliver_workers}, queue size {pipeline.queue_size}"
+    )
+
+    results = []
+    finished = (job for jobs in pipeline.run(stages.stream(validated_df)) for job in jobs)
+    # Students finish out of order; log and summarise them in input order so output is deterministic
+    for job in in_order(finished, key=lambda job: job.index):
+        result = job.result
+        results.append(result)
+        metrics.inc('students_total', status='reused' if result['reused'] else result['status'])
+        if result['status'] == 'ok':
+            if result['reused']:
+                logger.info(f"Report up to date for student: {result['student_id']}")
+            else:
+                logger.info(f"Processed student: {result['student_id']}")
+            if result['delivered']:
+                logger.info(f"Report delivered for {result['student_id']}")
+        else:
+            logger.error(f"Error processing student {result['student_id']}: {result['error']}")
+
+    pipeline_stats = pipeline.stats()
+    logger.info(f"Pipeline stages: {pipeline_stats}")
+
+    failed = [r['student_id'] for r in results if r['status'] != 'ok']
+    reused = sum(1 for r in results if r['reused'])
+    logger.info(
+        f"Run summary: {len(results) - len(failed)} succeeded "
+        f"({reused} up to date), {len(failed)} failed"
+    )
+    if failed:
+        logger.info(f"Failed students: {', '.join(str(s) for s in failed)}")
+    if not dry_run:
+        processor.commit_sync(failed_ids=failed)
+    logger.info(f"Gemini cache: {report_gen.cache.stats()}")
+    logger.info(f"Gemini limiter: {report_gen.limiter.stats()}")
+    hedging = report_gen.hedger.stats()
+    logger.info(
+        f"Gemini hedging: {hedging['hedged']} hedges for {hedging['calls']} calls, "
+        f"{hedging['hedge_wins']} won, {hedging['budget_denied']} over budget, "
+        f"{hedging['deadline_exceeded']} past deadline"
+    )
+    report_gen.hedger.close()
+    tokens = report_gen.tokens.summary()
+    for name, totals in tokens.items():
+        logger.info(
+            f"Prompt {name}@{totals['version']}: {totals['calls']} calls ({totals['cached']} cached), "
+            f"{totals['input_tokens']} in / {totals['output_tokens']} out tokens, {totals['seconds']}s"
+        )
+    report_gen.tokens.write()
+    delivery = pdf_engine.delivery_summary()
+    if delivery:
+        logger.info(
+            f"Delivery: {delivery['sent']} sent, {delivery['failed']} failed "
+            f"over {delivery['connections_opened']} SMTP connections"
+        )
+    pdf_engine.close()
+    if archive:
+        archive.close()
+        logger.info(f"Archived {archive.written} PDFs ({archive.failed} failed)")
+    bundled = None
+    if bundle:
+        # Students deleted from the sheet are not carried into the new bundle
+        paths = bundle.close(cohort=cohort)
+        if privacy:
+            # The bundle files expire with the oldest report they hold, not a day after this run
+            for path in paths:
+                privacy.register(path, kind='bundle', created_at=bundle.oldest)
+        bundled = {'reports': bundle.written, 'carried': bundle.carried, 'kept': bundle.kept,
+                   'dropped': bundle.dropped, 'failed': bundle.failed, 'files': paths}
+    if manifest:
+        manifest.close()
+    if render_pool:
+        logger.info(f"Render pool: {render_pool.summary()}")
+        render_pool.close()
+    transcripts = None
+    if transcriber:
+        transcriber.close()
+        transcripts = transcriber.stats()
+        logger.info(f"Transcription: {transcripts}")
+
+    metrics.observe('pipeline_run_seconds', time.perf_counter() - run_started)
+    metrics.export(extra={
+        'students': {'total': len(results), 'failed': len(failed), 'reused': reused},
+        'failed_students': [str(s) for s in failed],
+        'gemini_cache': report_gen.cache.stats(),
+        'gemini_limiter': report_gen.limiter.stats(),
+        'gemini_tokens': tokens,
+        'gemini_hedging': hedging,
+        'transcription': transcripts,
+        'bundle': bundled,
+        'delivery': delivery,
+        'pipeline': pipeline_stats,
+        'shard': {'index': shard.index, 'count': shard.count} if shard else None,
+    })
+
+    if privacy:
+        logger.info(f"Retention: {privacy.stats()}")
+        privacy.close()
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and deliver student reports")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Offline run: sample data, no Gemini calls, no email")
+    parser.add_argument('--shard', metavar='K/N', type=_shard_arg, default=None,
+                        help="Process only shard K of N (1-based), partitioned by a hash of StudentID")
+    args = parser.parse_args()
+    try:
+        generate_reports(dry_run=args.dry_run, shard=args.shard)
+    except Exception as e:
+
+        logger.error(f"Fatal error in generate_reports: {e}")
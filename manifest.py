@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class BuildManifest:
+    """Per-student record of the last report built and delivered.
+
+    Stored in SQLite with a rollback journal and synchronous=FULL, so every
+    update is an atomic, durable transaction: a kill -9 mid-run leaves the
+    manifest at the last completed student, which is where a rerun resumes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('BUILD_MANIFEST_PATH', 'cache/manifest.db')
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS students ("
+            "student_id TEXT PRIMARY KEY, "
+            "fingerprint TEXT NOT NULL, "
+            "pdf_path TEXT, "
+            "rendered_at REAL, "
+            "delivered_fingerprint TEXT, "
+            "delivered_to TEXT, "
+            "delivered_at REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(students)")}
+        if 'quote_key' not in columns:
+            # Manifests written before teacher audio was tracked
+            self._conn.execute("ALTER TABLE students ADD COLUMN quote_key TEXT")
+        self._conn.commit()
+
+    @staticmethod
+    def fingerprint(row, prompt_version, model, acc_pref, quote=None):
+        """Hash of everything that determines a student's report.
+
+        `quote` is the transcript cache key of the teacher recording behind
+        the quote (None when the canned quote is used), so a new clip
+        rebuilds the report.
+        """
+        data = row.to_dict() if hasattr(row, 'to_dict') else dict(row)
+        payload = json.dumps(
+            {'row': data, 'prompt_version': prompt_version, 'model': model, 'acc_pref': acc_pref,
+             'quote': quote},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, student_id):
+        with self._lock:
+            cur = self._conn.execute(
+                "SELECT fingerprint, pdf_path, rendered_at, delivered_fingerprint, delivered_to, delivered_at, "
+                "quote_key FROM students WHERE student_id = ?",
+                (str(student_id),)
+            )
+            entry = cur.fetchone()
+        if entry is None:
+            return None
+        keys = ('fingerprint', 'pdf_path', 'rendered_at', 'delivered_fingerprint', 'delivered_to', 'delivered_at',
+                'quote_key')
+        return dict(zip(keys, entry))
+
+    def is_rendered(self, student_id, fingerprint):
+        """True when the stored PDF was built from the same inputs and still exists"""
+        entry = self.get(student_id)
+        return bool(
+            entry
+            and entry['fingerprint'] == fingerprint
+            and entry['pdf_path']
+            and os.path.exists(entry['pdf_path'])
+        )
+
+    def is_delivered(self, student_id, fingerprint, email):
+        """True when this exact report was already sent to this address"""
+        entry = self.get(student_id)
+        return bool(entry and entry['delivered_fingerprint'] == fingerprint and entry['delivered_to'] == email)
+
+    def quote_key(self, student_id):
+        """Transcript key the student's last report was built with, if any"""
+        entry = self.get(student_id)
+        return entry['quote_key'] if entry else None
+
+    def record_render(self, student_id, fingerprint, pdf_path, quote_key=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO students (student_id, fingerprint, pdf_path, rendered_at, quote_key) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(student_id) DO UPDATE SET "
+                "fingerprint = excluded.fingerprint, pdf_path = excluded.pdf_path, "
+                "rendered_at = excluded.rendered_at, quote_key = excluded.quote_key",
+                (str(student_id), fingerprint, pdf_path, time.time(), quote_key)
+            )
+
+    def record_delivery(self, student_id, fingerprint, email):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE students SET delivered_fingerprint = ?, delivered_to = ?, delivered_at = ? "
+                "WHERE student_id = ?",
+                (fingerprint, email, time.time(), str(student_id))
+            )
+
+    def close(self):
+        self._conn.close()
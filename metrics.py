@@ -0,0 +1,330 @@
+import os
+import csv
+import json
+import time
+import zlib
+import threading
+import contextlib
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit up to a slow Gemini call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NULL_TIMER = contextlib.nullcontext()
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Bucket upper bound containing the q-th observation"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class Metrics:
+    """Process-wide counters and latency histograms for the report pipeline.
+
+    Disabled with METRICS_ENABLED=false, in which case every call returns
+    immediately and `timer()` hands back a shared no-op context manager.
+    """
+
+    def __init__(self, enabled=None, buckets=DEFAULT_BUCKETS):
+        if enabled is None:
+            enabled = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        """Set a value that can go up and down, e.g. a queue depth"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram(self.buckets)
+            hist.observe(value)
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._started = time.time()
+
+    def snapshot(self):
+        """JSON-friendly view of every metric"""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            gauges = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._gauges.items())
+            ]
+            histograms = [
+                {
+                    'name': name,
+                    'labels': dict(labels),
+                    'count': h.count,
+                    'sum': round(h.sum, 6),
+                    'mean': round(h.sum / h.count, 6) if h.count else None,
+                    'p50': h.quantile(0.5),
+                    'p95': h.quantile(0.95),
+                    'max': round(h.max, 6),
+                }
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+        return {
+            'started': self._started,
+            'duration_seconds': round(time.time() - self._started, 3),
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms
+        }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        def fmt(labels, extra=None):
+            items = list(labels) + ([extra] if extra else [])
+            if not items:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} gauge")
+                    typed.add(name)
+                lines.append(f"{name}{fmt(labels)} {value}")
+            for (name, labels), h in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{fmt(labels, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_bucket{fmt(labels, ('le', '+Inf'))} {h.count}")
+                lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory=None, extra=None):
+        """Write run_summary.json and metrics.prom; returns their paths"""
+        if not self.enabled:
+            return None
+        directory = directory or os.getenv('METRICS_DIR', 'metrics')
+        os.makedirs(directory, exist_ok=True)
+        summary = self.snapshot()
+        if extra:
+            summary.update(extra)
+
+        json_path = os.path.join(directory, 'run_summary.json')
+        prom_path = os.path.join(directory, 'metrics.prom')
+        with open(json_path, 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+        # Write then rename so a node_exporter textfile collector never reads a partial file
+        with open(prom_path + '.tmp', 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(prom_path + '.tmp', prom_path)
+        logger.info(f"Metrics written to {json_path} and {prom_path}")
+        return json_path, prom_path
+
+# Shared registry used by every pipeline module
+metrics = Metrics()
+
+class StudentProfiler:
+    """cProfile a stable, sampled subset of students.
+
+    PROFILE_SAMPLE_RATE (0-1, default 0) picks students by a hash of their
+    ID, so reruns profile the same students; stats go to PROFILE_DIR.
+    """
+
+    def __init__(self, rate=None, directory=None):
+        self.rate = float(rate if rate is not None else os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        self.directory = directory or os.getenv('PROFILE_DIR', 'profiles')
+
+    def sampled(self, student_id):
+        if self.rate <= 0:
+            return False
+        return zlib.crc32(str(student_id).encode()) % 10000 < self.rate * 10000
+
+    def run(self, student_id, fn, *args, **kwargs):
+        """Call fn, profiling it when student_id is in the sample"""
+        return self.run_stage(None, student_id, fn, *args, **kwargs)
+
+    def run_stage(self, stage, student_id, fn, *args, **kwargs):
+        """Like run(), writing <student_id>.<stage>.prof for pipeline stages"""
+        if not self.sampled(student_id):
+            return fn(*args, **kwargs)
+
+        # Imported on the first sampled student; most runs never profile
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{student_id}.{stage}" if stage else str(student_id)
+            path = os.path.join(self.directory, f"{name}.prof")
+            profiler.dump_stats(path)
+            metrics.inc('profiles_written_total')
+            top = pstats.Stats(profiler).sort_stats('cumulative')
+            logger.info(f"Profile for student {student_id} written to {path} ({top.total_tt:.3f}s)")
+
+class TokenLedger:
+    """Gemini token usage per student, stage and prompt template.
+
+    A batched call's tokens and latency are split evenly across the
+    students in it. Cache hits are counted as calls with no tokens, since
+    they cost nothing. `write()` produces token_report.csv with one row
+    per (student, stage, prompt).
+    """
+
+    COLUMNS = ('student_id', 'stage', 'prompt', 'version', 'calls', 'input_tokens',
+               'output_tokens', 'seconds', 'cached')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._prompts = {}
+
+    def record(self, stage, prompt, version, student_ids, input_tokens=0, output_tokens=0,
+               seconds=0.0, cached=False):
+        student_ids = list(student_ids) or ['']
+        share = len(student_ids)
+        metrics.inc('gemini_tokens_total', input_tokens, prompt=prompt, direction='input')
+        metrics.inc('gemini_tokens_total', output_tokens, prompt=prompt, direction='output')
+        with self._lock:
+            totals = self._prompts.setdefault(prompt, {
+                'version': version, 'calls': 0, 'cached': 0, 'students': 0,
+                'input_tokens': 0, 'output_tokens': 0, 'seconds': 0.0
+            })
+            totals['calls'] += 1
+            totals['cached'] += int(cached)
+            totals['students'] += share
+            totals['input_tokens'] += input_tokens
+            totals['output_tokens'] += output_tokens
+            totals['seconds'] += seconds
+            for student_id in student_ids:
+                row = self._rows.setdefault((str(student_id), stage, prompt), {
+                    'version': version, 'calls': 0, 'input_tokens': 0.0,
+                    'output_tokens': 0.0, 'seconds': 0.0, 'cached': 0
+                })
+                row['calls'] += 1
+                row['input_tokens'] += input_tokens / share
+                row['output_tokens'] += output_tokens / share
+                row['seconds'] += seconds / share
+                row['cached'] += int(cached)
+
+    def summary(self):
+        """Per-prompt totals, most expensive (input + output tokens) first"""
+        with self._lock:
+            prompts = sorted(
+                self._prompts.items(),
+                key=lambda item: item[1]['input_tokens'] + item[1]['output_tokens'],
+                reverse=True
+            )
+            return {
+                name: dict(totals, seconds=round(totals['seconds'], 3))
+                for name, totals in prompts
+            }
+
+    def write(self, directory=None):
+        """Write token_report.csv next to the other metrics; returns its path"""
+        directory = directory or os.getenv('METRICS_DIR', 'metrics')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'token_report.csv')
+        with self._lock:
+            rows = sorted(self._rows.items())
+        with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.COLUMNS)
+            for (student_id, stage, prompt), row in rows:
+                writer.writerow([
+                    student_id, stage, prompt, row['version'], row['calls'],
+                    round(row['input_tokens']), round(row['output_tokens']),
+                    round(row['seconds'], 4), row['cached']
+                ])
+        os.replace(path + '.tmp', path)
+        logger.info(f"Token report written to {path}")
+        return path
@@ -1,173 +1,736 @@
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_LEFT
-import qrcode
-import os
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-from dotenv import load_dotenv
-import logging
-from ssl import create_default_context
-import ssl
-
-# Configure logging
-logger = logging.getLogger(__name__)
-
-load_dotenv()
-
-class PDFEngine:
-    def __init__(self):
-        self.styles = self._create_styles()
-    
-    def _create_styles(self):
-        styles = getSampleStyleSheet()
-        
-        # Base style
-        styles.add(ParagraphStyle(
-            name='BaseStyle',
-            fontName='Helvetica',
-            fontSize=10,
-            leading=15,
-            spaceAfter=10,
-            alignment=TA_LEFT
-        ))
-        
-        # ADHD style
-        styles.add(ParagraphStyle(
-            name='ADHD',
-            parent=styles['BaseStyle'],
-            fontSize=10,
-            leading=15,
-            spaceAfter=8,
-            borderPadding=5,
-            backColor=colors.HexColor('#E6F2FF')  # Light blue
-        ))
-        
-        # Low vision style
-        styles.add(ParagraphStyle(
-            name='LowVision',
-            parent=styles['BaseStyle'],
-            fontSize=14,
-            leading=20,
-            textColor=colors.black,
-            backColor=colors.white
-        ))
-        
-        return styles
-    
-    def create_pdf(self, content, acc_pref, output_path):
-        try:
-            # Create directory if needed
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            doc = SimpleDocTemplate(output_path, pagesize=letter)
-            story = []
-            
-            # Apply accessibility settings
-            style_name = self._get_style_for_preference(acc_pref)
-            
-            # Split into paragraphs
-            paragraphs = content.split('\n\n')
-            
-            for para in paragraphs:
-                if para.strip():
-                    p = Paragraph(para.strip(), self.styles[style_name])
-                    story.append(p)
-                    story.append(Spacer(1, 12))
-            
-            # Add feedback QR
-            qr_img = self._generate_qr_code(output_path)
-            story.append(Image(qr_img, width=100, height=100))
-            
-            doc.build(story)
-            logger.info(f"PDF created at {output_path}")
-            return output_path
-        except Exception as e:
-            logger.error(f"PDF creation failed: {e}")
-            raise
-    
-    def _generate_qr_code(self, report_path):
-        # Ensure directory exists
-        os.makedirs('temp', exist_ok=True)
-        
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        report_id = os.path.basename(report_path).split('_')[0]
-        qr.add_data(f"https://feedback.scoreazy.com?report={report_id}")
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        qr_path = f"temp/{report_id}_feedback.png"
-        qr_img.save(qr_path)
-        return qr_path
-    
-    def _get_style_for_preference(self, pref):
-        mapping = {
-            'dyslexic': 'BaseStyle',  # Fallback to base style
-            'adhd': 'ADHD',
-            'low-vision': 'LowVision'
-        }
-        return mapping.get(pref.lower(), 'BaseStyle')
-    
-    def deliver_report(self, pdf_path, email, lang):
-        if not email or '@' not in email:
-            logger.warning(f"Skipping delivery for invalid email: {email}")
-            return
-            
-        try:
-            # Email configuration
-            msg = MIMEMultipart()
-            msg['Subject'] = self._get_subject(lang)
-            msg['From'] = os.getenv('SMTP_USER')
-            msg['To'] = email
-            
-            # Add body
-            body = self._get_email_body(lang)
-            msg.attach(MIMEText(body, 'plain'))
-            
-            # Attach PDF
-            with open(pdf_path, "rb") as f:
-                attach = MIMEApplication(f.read(), _subtype="pdf")
-                attach.add_header('Content-Disposition', 'attachment', 
-                                filename=os.path.basename(pdf_path))
-                msg.attach(attach)
-            
-            # Send email
-            use_ssl = os.getenv('SMTP_USE_SSL', 'false').lower() == 'true'
-            if use_ssl:
-                server = smtplib.SMTP_SSL(os.getenv('SMTP_SERVER'), int(os.getenv('SMTP_PORT')))
-            else:
-                server = smtplib.SMTP(os.getenv('SMTP_SERVER'), int(os.getenv('SMTP_PORT')))
-                server.starttls(context=ssl.create_default_context())
-            server.login(os.getenv('SMTP_USER'), os.getenv('SMTP_PASS'))
-            server.send_message(msg)
-            logger.info(f"Report delivered to {email}")
-        except Exception as e:
-            logger.error(f"Email delivery failed for {email}: {e}")
-    
-    def _get_subject(self, lang):
-        subjects = {
-            'en': "Your Scoreazy Learning Report",
-            'hi': "आपकी स्कोरज़ी रिपोर्ट",
-            'es': "Su informe de aprendizaje Scoreazy",
-            'fr': "Votre rapport d'apprentissage Scoreazy",
-            'ar': "تقرير سكوريزي التعليمي الخاص بك"
-        }
-        return subjects.get(lang, subjects['en'])
-    
-    def _get_email_body(self, lang):
-        bodies = {
-            'en': "Find attached your personalized learning report from Scoreazy\n\n",
-            'hi': "स्कोरज़ी से आपकी व्यक्तिगत लर्निंग रिपोर्ट संलग्न है\n\n",
-            'es': "Adjunto encontrará su informe de aprendizaje personalizado de Scoreazy\n\n",
-            'fr': "Ci-joint votre rapport d'apprentissage personnalisé de Scoreazy\n\n",
-            'ar': "تجد في المرفق تقرير التعلم الشخصي الخاص بك من سكوريزي\n\n"
-        }
-        base = bodies.get(lang, bodies['en'])
-        return base + "Please scan the QR code to provide feedback on this report."
\ No newline at end of file
+import os
+import io
+import re
+import csv
+import queue
+import time
+import zipfile
+import datetime
+from functools import lru_cache
+from html.parser import HTMLParser
+from html import escape
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.application import MIMEApplication
+from dotenv import load_dotenv
+import logging
+import threading
+from metrics import metrics
+from template_engine import get_template, get_stylesheet
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+FEEDBACK_URL = "https://feedback.scoreazy.com?report={report_id}"
+
+# disk: write reports/<id>_report.pdf and attach from it
+# memory: render to a buffer and attach it; nothing touches the disk
+# archive: attach from memory, write the PDF once in the background
+# bundle: attach from memory, collect the run's PDFs into one zip (and merged PDFs per class)
+STORAGE_MODES = ('disk', 'memory', 'archive', 'bundle')
+
+def storage_mode():
+    mode = os.getenv('PDF_STORAGE', 'disk').lower()
+    if mode not in STORAGE_MODES:
+        logger.warning(f"Unknown PDF_STORAGE {mode!r}, using disk")
+        return 'disk'
+    return mode
+
+# Structured narratives (dicts) are rendered through this template
+REPORT_TEMPLATE = 'base_report.html'
+
+# Accessibility profile -> (stylesheet in templates/, root selector)
+PROFILE_STYLESHEETS = {
+    'dyslexic': ('dyslexia_template.css', '.dyslexic-report'),
+}
+
+def _css_color(value):
+    from reportlab.lib import colors
+    try:
+        return colors.HexColor(value.split()[0])
+    except Exception:
+        return None
+
+def _css_length(value, font_size):
+    """rem/em/px/pt length in points (1rem = the body font size)"""
+    value = value.strip()
+    for unit, scale in (('rem', font_size), ('em', font_size), ('px', 0.75), ('pt', 1.0)):
+        if value.endswith(unit):
+            try:
+                return float(value[:-len(unit)]) * scale
+            except ValueError:
+                return None
+    return None
+
+def _apply_css(style, declarations):
+    """Copy the CSS properties ReportLab understands onto a ParagraphStyle"""
+    from reportlab.pdfbase import pdfmetrics
+    for prop, value in declarations.items():
+        if prop == 'color':
+            style.textColor = _css_color(value) or style.textColor
+        elif prop == 'background-color':
+            style.backColor = _css_color(value) or style.backColor
+        elif prop == 'line-height':
+            try:
+                style.leading = style.fontSize * float(value)
+            except ValueError:
+                pass
+        elif prop == 'font-family':
+            family = value.split(',')[0].strip().strip('\'"')
+            # Only fonts registered with ReportLab (e.g. OpenDyslexic) can be used
+            if family in pdfmetrics.getRegisteredFontNames():
+                style.fontName = family
+        elif prop == 'font-weight' and value == 'bold' and '-Bold' not in style.fontName:
+            style.fontName = {'Helvetica': 'Helvetica-Bold', 'Times-Roman': 'Times-Bold'}.get(
+                style.fontName, style.fontName
+            )
+        elif prop in ('margin-bottom', 'padding-left'):
+            length = _css_length(value, style.fontSize)
+            if length is not None:
+                setattr(style, 'spaceAfter' if prop == 'margin-bottom' else 'leftIndent', length)
+
+# Emoji in the template headings; the built-in PDF fonts have no glyphs for them
+_EMOJI = re.compile('[\U00010000-\U0010FFFF\u2600-\u27BF\uFE0F]')
+
+class _StoryBuilder(HTMLParser):
+    """Turn the rendered report HTML into ReportLab flowables"""
+
+    BLOCKS = {'h1': 'title', 'h2': 'heading', 'li': 'item'}
+    DIV_CLASSES = {'highlight': 'highlight', 'teacher-note': 'note'}
+
+    def __init__(self, styles):
+        super().__init__(convert_charrefs=True)
+        self.styles = styles
+        self.story = []
+        self._block = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.BLOCKS:
+            self._flush()
+            self._block = self.BLOCKS[tag]
+        elif tag == 'div':
+            block = self.DIV_CLASSES.get(dict(attrs).get('class'))
+            if block:
+                self._flush()
+                self._block = block
+
+    def handle_endtag(self, tag):
+        if tag in self.BLOCKS or tag == 'div':
+            self._flush()
+
+    def handle_data(self, data):
+        if self._block:
+            self._text.append(data)
+
+    def _flush(self):
+        from reportlab.platypus import Paragraph
+        text = ' '.join(_EMOJI.sub('', ''.join(self._text)).split())
+        if self._block and text:
+            bullet = '•' if self._block == 'item' else None
+            self.story.append(Paragraph(escape(text, quote=False), self.styles[self._block], bulletText=bullet))
+        self._block = None
+        self._text = []
+
+@lru_cache(maxsize=4096)
+def _qr_matrix(report_id):
+    """Encoded QR modules (including the quiet zone) for a report ID"""
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(FEEDBACK_URL.format(report_id=report_id))
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+class PDFEngine:
+    def __init__(self, smtp_pool=None):
+        self._styles = None
+        self._template_styles = {}
+        self._smtp_pool = smtp_pool
+        self._pool_lock = threading.Lock()
+    
+    @property
+    def styles(self):
+        # ReportLab is imported and styles built on first render
+        if self._styles is None:
+            self._styles = self._create_styles()
+        return self._styles
+    
+    @property
+    def smtp_pool(self):
+        # Opened on first delivery so render-only runs never touch SMTP
+        with self._pool_lock:
+            if self._smtp_pool is None:
+                # smtplib and ssl are only imported by runs that deliver
+                from smtp_pool import SMTPPool
+                self._smtp_pool = SMTPPool()
+            return self._smtp_pool
+    
+    def delivery_summary(self):
+        return self._smtp_pool.summary() if self._smtp_pool is not None else None
+    
+    def close(self):
+        if self._smtp_pool is not None:
+            self._smtp_pool.close()
+    
+    def _create_styles(self):
+        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+        from reportlab.lib import colors
+        from reportlab.lib.enums import TA_LEFT
+        
+        styles = getSampleStyleSheet()
+        
+        # Base style
+        styles.add(ParagraphStyle(
+            name='BaseStyle',
+            fontName='Helvetica',
+            fontSize=10,
+            leading=15,
+            spaceAfter=10,
+            alignment=TA_LEFT
+        ))
+        
+        # ADHD style
+        styles.add(ParagraphStyle(
+            name='ADHD',
+            parent=styles['BaseStyle'],
+            fontSize=10,
+            leading=15,
+            spaceAfter=8,
+            borderPadding=5,
+            backColor=colors.HexColor('#E6F2FF')  # Light blue
+        ))
+        
+        # Low vision style
+        styles.add(ParagraphStyle(
+            name='LowVision',
+            parent=styles['BaseStyle'],
+            fontSize=14,
+            leading=20,
+            textColor=colors.black,
+            backColor=colors.white
+        ))
+        
+        return styles
+    
+    def create_pdf(self, content, acc_pref, output_path):
+        """Render the report and write it to output_path in one write"""
+        data = self.render_pdf(content, acc_pref, self._report_id(output_path))
+        try:
+            # Create directory if needed
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'wb') as f:
+                f.write(data)
+        except Exception as e:
+            logger.error(f"PDF creation failed: {e}")
+            raise
+        metrics.inc('pdf_bytes_written_total', len(data))
+        logger.info(f"PDF created at {output_path}")
+        return output_path
+    
+    def render_pdf(self, content, acc_pref, report_id):
+        """Render the report into memory and return the PDF bytes"""
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+        
+        try:
+            buffer = io.BytesIO()
+            doc = SimpleDocTemplate(buffer, pagesize=letter)
+            page_color = None
+            
+            if isinstance(content, dict):
+                # Structured narrative: fill the HTML template for this profile
+                styles = self._styles_for_template(acc_pref)
+                page_color = styles['page'].backColor
+                builder = _StoryBuilder(styles)
+                builder.feed(get_template(REPORT_TEMPLATE).render(content))
+                builder.close()
+                story = builder.story
+            else:
+                story = []
+                
+                # Apply accessibility settings
+                style_name = self._get_style_for_preference(acc_pref)
+                
+                # Split into paragraphs
+                paragraphs = content.split('\n\n')
+                
+                for para in paragraphs:
+                    if para.strip():
+                        p = Paragraph(para.strip(), self.styles[style_name])
+                        story.append(p)
+                        story.append(Spacer(1, 12))
+            
+            # Add feedback QR
+            story.append(Spacer(1, 12))
+            story.append(self._qr_drawing(report_id))
+            
+            def paint_page(canvas, doc):
+                if page_color is not None:
+                    canvas.saveState()
+                    canvas.setFillColor(page_color)
+                    canvas.rect(0, 0, *letter, stroke=0, fill=1)
+                    canvas.restoreState()
+            
+            with metrics.timer('pdf_render_seconds'):
+                doc.build(story, onFirstPage=paint_page, onLaterPages=paint_page)
+            metrics.inc('pdfs_rendered_total')
+            return buffer.getvalue()
+        except Exception as e:
+            logger.error(f"PDF creation failed: {e}")
+            raise
+    
+    def _styles_for_template(self, acc_pref):
+        """Title/heading/item/highlight/note styles for one accessibility profile"""
+        profile = (acc_pref or 'standard').lower()
+        if profile in self._template_styles:
+            return self._template_styles[profile]
+        
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.lib import colors
+        
+        body = ParagraphStyle(f'{profile}-body', parent=self.styles[self._get_style_for_preference(profile)])
+        # The page background comes from the stylesheet's root rule, if any
+        page = ParagraphStyle(f'{profile}-page', parent=body, backColor=None)
+        stylesheet, root = PROFILE_STYLESHEETS.get(profile, (None, None))
+        css = get_stylesheet(stylesheet) if stylesheet else {}
+        if root in css:
+            _apply_css(body, css[root])
+            page.backColor, body.backColor = body.backColor, None
+        
+        size = body.fontSize
+        styles = {
+            'page': page,
+            'title': ParagraphStyle(f'{profile}-title', parent=body, fontName='Helvetica-Bold',
+                                    fontSize=size + 8, leading=(size + 8) * 1.3, spaceAfter=size),
+            'heading': ParagraphStyle(f'{profile}-heading', parent=body, fontName='Helvetica-Bold',
+                                      fontSize=size + 3, leading=(size + 3) * 1.4, spaceBefore=size * 0.8),
+            'item': ParagraphStyle(f'{profile}-item', parent=body, leftIndent=size * 1.5,
+                                   bulletIndent=size * 0.5, spaceAfter=size * 0.4),
+            'highlight': ParagraphStyle(f'{profile}-highlight', parent=body, borderPadding=6,
+                                        backColor=colors.HexColor('#FFF4CC'), spaceAfter=size),
+            'note': ParagraphStyle(f'{profile}-note', parent=body, fontName='Helvetica-Oblique',
+                                   leftIndent=size, spaceBefore=size),
+        }
+        if root:
+            for selector, declarations in css.items():
+                parts = selector.split()
+                if len(parts) == 2 and parts[0] == root:
+                    target = {'h1': ['title'], 'h2': ['heading'], 'li': ['item']}.get(parts[1], [])
+                    for name in target:
+                        _apply_css(styles[name], declarations)
+        self._template_styles[profile] = styles
+        return styles
+    
+    def _report_id(self, report_path):
+        return os.path.basename(report_path).split('_')[0]
+    
+    def _qr_drawing(self, report_id, size=100):
+        """Draw the feedback QR code as vector rectangles (no image files)"""
+        from reportlab.graphics.shapes import Drawing, Rect
+        from reportlab.lib import colors
+        
+        matrix = _qr_matrix(report_id)
+        module = size / len(matrix)
+        drawing = Drawing(size, size)
+        
+        for r, row in enumerate(matrix):
+            y = size - (r + 1) * module
+            c = 0
+            # Merge each horizontal run of dark modules into one rectangle
+            while c < len(row):
+                if not row[c]:
+                    c += 1
+                    continue
+                start = c
+                while c < len(row) and row[c]:
+                    c += 1
+                drawing.add(Rect(
+                    start * module, y, (c - start) * module, module,
+                    fillColor=colors.black, strokeColor=None, strokeWidth=0
+                ))
+        return drawing
+    
+    def _get_style_for_preference(self, pref):
+        mapping = {
+            'dyslexic': 'BaseStyle',  # Fallback to base style
+            'adhd': 'ADHD',
+            'low-vision': 'LowVision'
+        }
+        return mapping.get(pref.lower(), 'BaseStyle')
+    
+    def deliver_report(self, pdf, email, lang, filename=None):
+        """Email a report given as a file path or as PDF bytes"""
+        if not email or '@' not in email:
+            logger.warning(f"Skipping delivery for invalid email: {email}")
+            return False
+            
+        try:
+            # Email configuration
+            msg = MIMEMultipart()
+            msg['Subject'] = self._get_subject(lang)
+            msg['From'] = os.getenv('SMTP_USER')
+            msg['To'] = email
+            
+            # Add body
+            body = self._get_email_body(lang)
+            msg.attach(MIMEText(body, 'plain'))
+            
+            # Attach PDF (bytes from an in-memory render are used as-is)
+            if isinstance(pdf, (bytes, bytearray, memoryview)):
+                data = pdf
+            else:
+                with open(pdf, "rb") as f:
+                    data = f.read()
+                filename = filename or os.path.basename(pdf)
+            attach = MIMEApplication(data, _subtype="pdf")
+            attach.add_header('Content-Disposition', 'attachment', 
+                            filename=filename or "report.pdf")
+            msg.attach(attach)
+            
+            # Send email over a pooled session
+            with metrics.timer('email_send_seconds'):
+                result = self.smtp_pool.send(msg)
+            metrics.inc('emails_total', status='sent' if result.ok else 'failed')
+            if result.ok:
+                logger.info(f"Report delivered to {email}")
+            else:
+                logger.error(f"Email delivery failed for {email}: {result.error}")
+            return result.ok
+        except Exception as e:
+            logger.error(f"Email delivery failed for {email}: {e}")
+            return False
+    
+    def _get_subject(self, lang):
+        subjects = {
+            'en': "Your Scoreazy Learning Report",
+            'hi': "आपकी स्कोरज़ी रिपोर्ट",
+            'es': "Su informe de aprendizaje Scoreazy",
+            'fr': "Votre rapport d'apprentissage Scoreazy",
+            'ar': "تقرير سكوريزي التعليمي الخاص بك"
+        }
+        return subjects.get(lang, subjects['en'])
+    
+    def _get_email_body(self, lang):
+        bodies = {
+            'en': "Find attached your personalized learning report from Scoreazy\n\n",
+            'hi': "स्कोरज़ी से आपकी व्यक्तिगत लर्निंग रिपोर्ट संलग्न है\n\n",
+            'es': "Adjunto encontrará su informe de aprendizaje personalizado de Scoreazy\n\n",
+            'fr': "Ci-joint votre rapport d'apprentissage personnalisé de Scoreazy\n\n",
+            'ar': "تجد في المرفق تقرير التعلم الشخصي الخاص بك من سكوريزي\n\n"
+        }
+        base = bodies.get(lang, bodies['en'])
+        return base + "Please scan the QR code to provide feedback on this report."
+
+class ArchiveWriter:
+    """Write rendered PDFs to disk on a background thread.
+
+    Used with PDF_STORAGE=archive so delivery never waits on the disk.
+    Each file is written once, to a temp name and then renamed, so a
+    crash never leaves a truncated report behind. The queue is bounded
+    to keep memory flat if the disk falls behind.
+    """
+
+    def __init__(self, max_pending=64):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='pdf-archive', daemon=True)
+        self._thread.start()
+        self.written = 0
+        self.failed = 0
+
+    def write(self, path, data):
+        self._queue.put((path, data))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, data = item
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                tmp = f"{path}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, path)
+                self.written += 1
+                metrics.inc('pdf_bytes_written_total', len(data))
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Archiving {path} failed: {e}")
+
+    def close(self):
+        """Flush pending writes"""
+        self._queue.put(None)
+        self._thread.join()
+
+def _safe_name(value):
+    return re.sub(r'[^\w.-]+', '_', str(value)).strip('_') or 'cohort'
+
+class ReportBundle:
+    """Collect a run's PDFs into a few large files instead of one per student.
+
+    Used with PDF_STORAGE=bundle. A background thread streams every PDF
+    into `<directory>/bundle/reports.zip` as `<group>/<id>_report.pdf`;
+    close() adds `index.csv` (student, group, member, size, pages, page
+    range in the merged PDF, the report's fingerprint and when it was
+    built) and, unless BUNDLE_MERGED_PDF=off, writes one merged
+    `<group>.pdf` per class with a bookmark per student. Reports from the
+    previous bundle that were not rewritten this run (failed, or not in an
+    incremental sync) are copied over while the student is still in the
+    cohort and the report is younger than RETENTION_HOURS, so the bundle
+    covers the current cohort without outliving the retention policy.
+    """
+
+    INDEX_COLUMNS = ('student_id', 'name', 'group', 'member', 'bytes', 'pages', 'merged_pdf',
+                     'first_page', 'last_page', 'fingerprint', 'created_at')
+
+    def __init__(self, directory='reports', merged_pdf=None, max_pending=64, retention_hours=None):
+        self.directory = os.path.join(directory, 'bundle')
+        if merged_pdf is None:
+            merged_pdf = os.getenv('BUNDLE_MERGED_PDF', 'on').lower() != 'off'
+        self.merged_pdf = merged_pdf
+        self.zip_path = os.path.join(self.directory, 'reports.zip')
+        self.retention = float(retention_hours or os.getenv('RETENTION_HOURS', '24')) * 3600
+        self.started = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        # Last run's bundle is the source for reports that were not rebuilt
+        self._previous = None
+        self._previous_index = {}
+        self._previous_created = None
+        if os.path.exists(self.zip_path):
+            try:
+                self._previous = zipfile.ZipFile(self.zip_path)
+                self._previous_index = self._read_index(self._previous)
+                # Bundles from before per-report dates count from when the zip was written
+                self._previous_created = os.path.getmtime(self.zip_path)
+            except (zipfile.BadZipFile, KeyError, csv.Error) as e:
+                logger.warning(f"Ignoring unreadable bundle {self.zip_path}: {e}")
+                self._previous = None
+                self._previous_index = {}
+        self._zip = zipfile.ZipFile(f"{self.zip_path}.tmp", 'w', compression=zipfile.ZIP_DEFLATED,
+                                    compresslevel=6)
+        self.entries = []
+        self.paths = []
+        self.written = 0
+        self.carried = 0
+        self.kept = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name='pdf-bundle', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def member(group, student_id):
+        return f"{_safe_name(group)}/{student_id}_report.pdf"
+
+    @staticmethod
+    def _read_index(bundle):
+        with bundle.open('index.csv') as f:
+            return {row['student_id']: row for row in csv.DictReader(io.TextIOWrapper(f, encoding='utf-8'))}
+
+    @staticmethod
+    def _order(entry):
+        # StudentID order (numeric IDs by value) keeps merged PDFs identical between runs
+        student_id = entry['student_id']
+        return (0, int(student_id), '') if student_id.isdigit() else (1, 0, student_id)
+
+    def _created(self, row):
+        created = row.get('created_at')
+        return datetime.datetime.fromisoformat(created).timestamp() if created else self._previous_created
+
+    def _expired(self, row):
+        return self._created(row) + self.retention <= self.started
+
+    def add(self, student_id, name, group, data, fingerprint=None, created_at=None):
+        self._queue.put((str(student_id), name, group, data, fingerprint, created_at or time.time()))
+
+    def has(self, student_id, group, fingerprint):
+        """True if the previous bundle holds this exact, unexpired report (same class and fingerprint)"""
+        row = self._previous_index.get(str(student_id))
+        return bool(row and fingerprint and row['member'] == self.member(group, student_id)
+                    and row.get('fingerprint') == fingerprint and not self._expired(row))
+
+    def carry(self, student_id, name, group, fingerprint, path=None):
+        """Copy an up-to-date PDF into the bundle, from the previous bundle or else from `path`.
+
+        Returns the PDF bytes, or None when neither has it (e.g. the file
+        at `path` was purged) and the report must be rebuilt.
+        """
+        if self.has(student_id, group, fingerprint):
+            row = self._previous_index[str(student_id)]
+            data = self._previous.read(row['member'])
+            created_at = self._created(row)
+        elif path:
+            # Built by an earlier run that wrote PDFs to disk
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                created_at = os.path.getmtime(path)
+            except OSError:
+                return None
+        else:
+            return None
+        self.add(student_id, name, group, data, fingerprint, created_at)
+        self.carried += 1
+        return data
+
+    def _pages(self, data):
+        if not self.merged_pdf:
+            return None
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            logger.warning("pypdf is not installed; merged class PDFs are disabled")
+            self.merged_pdf = False
+            return None
+        return len(PdfReader(io.BytesIO(data)).pages)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            student_id, name, group, data, fingerprint, created_at = item
+            member = self.member(group, student_id)
+            try:
+                self._zip.writestr(member, data)
+                self.entries.append({
+                    'student_id': student_id,
+                    'name': name,
+                    'group': _safe_name(group),
+                    'member': member,
+                    'bytes': len(data),
+                    'pages': self._pages(data),
+                    'fingerprint': fingerprint,
+                    'created_at': created_at,
+                })
+                self.written += 1
+                metrics.inc('pdf_bytes_written_total', len(data))
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Bundling report for {student_id} failed: {e}")
+
+    def _keep_previous(self, cohort=None):
+        """Copy reports of the previous bundle that this run did not rewrite.
+
+        Students no longer in `cohort` (a set of StudentIDs; None keeps
+        everyone) and reports older than the retention period are dropped.
+        """
+        written = {entry['student_id'] for entry in self.entries}
+        for student_id, row in self._previous_index.items():
+            if student_id in written:
+                continue
+            if (cohort is not None and student_id not in cohort) or self._expired(row):
+                self.dropped += 1
+                continue
+            try:
+                data = self._previous.read(row['member'])
+                self._zip.writestr(row['member'], data)
+            except Exception as e:
+                logger.error(f"Keeping bundled report for {student_id} failed: {e}")
+                continue
+            pages = row.get('pages')
+            self.entries.append({
+                'student_id': student_id,
+                'name': row.get('name'),
+                'group': row['group'],
+                'member': row['member'],
+                'bytes': len(data),
+                'pages': int(pages) if pages else self._pages(data),
+                'fingerprint': row.get('fingerprint') or None,
+                'created_at': self._created(row),
+            })
+            self.kept += 1
+
+    def _page_ranges(self):
+        """Fill merged_pdf/first_page/last_page (1-based) per entry, in StudentID order within each class"""
+        next_page = {}
+        for entry in self.entries:
+            if not self.merged_pdf or not entry['pages']:
+                entry.update(merged_pdf=None, first_page=None, last_page=None)
+                continue
+            first = next_page.get(entry['group'], 1)
+            entry.update(
+                merged_pdf=f"{entry['group']}.pdf",
+                first_page=first,
+                last_page=first + entry['pages'] - 1
+            )
+            next_page[entry['group']] = first + entry['pages']
+
+    def _merge(self):
+        """One PDF per class from the finished zip, with a bookmark per student"""
+        from pypdf import PdfWriter
+        groups = {}
+        for entry in self.entries:
+            if entry['merged_pdf']:
+                groups.setdefault(entry['merged_pdf'], []).append(entry)
+        with zipfile.ZipFile(self.zip_path) as bundle:
+            for filename, entries in groups.items():
+                writer = PdfWriter()
+                for entry in entries:
+                    writer.append(io.BytesIO(bundle.read(entry['member'])),
+                                  outline_item=f"{entry['name']} ({entry['student_id']})")
+                path = os.path.join(self.directory, filename)
+                with open(f"{path}.tmp", 'wb') as f:
+                    writer.write(f)
+                os.replace(f"{path}.tmp", path)
+                self.paths.append(path)
+
+    @property
+    def oldest(self):
+        """Build time of the oldest report in the bundle, which is when its files start to expire"""
+        return min((entry['created_at'] for entry in self.entries), default=None)
+
+    def close(self, cohort=None):
+        """Flush pending PDFs, write the index and merged PDFs; returns the files written.
+
+        `cohort` is the set of StudentIDs still on the sheet; reports of
+        anyone else are not carried over from the previous bundle.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._previous is not None:
+            self._keep_previous({str(sid) for sid in cohort} if cohort is not None else None)
+            self._previous.close()
+
+        self.entries.sort(key=self._order)
+        self._page_ranges()
+        index = io.StringIO()
+        writer = csv.DictWriter(index, fieldnames=self.INDEX_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(
+            dict(entry, created_at=datetime.datetime.fromtimestamp(entry['created_at']).isoformat(timespec='seconds'))
+            for entry in self.entries
+        )
+        self._zip.writestr('index.csv', index.getvalue())
+        self._zip.close()
+        os.replace(f"{self.zip_path}.tmp", self.zip_path)
+        self.paths.append(self.zip_path)
+
+        if self.merged_pdf and self.entries:
+            try:
+                self._merge()
+            except Exception as e:
+                logger.error(f"Merging class PDFs failed: {e}")
+        logger.info(
+            f"Bundled {self.written} reports ({self.carried} carried over, {self.failed} failed) "
+            f"and kept {self.kept} from the last bundle ({self.dropped} dropped) "
+            f"in {len(self.paths)} files in {self.directory}"
+        )
+        return list(self.paths)
+
+    @staticmethod
+    def extract(directory, student_id):
+        """One student's PDF bytes from a bundle, via its index (no other entry is read)"""
+        with zipfile.ZipFile(os.path.join(directory, 'bundle', 'reports.zip')) as bundle:
+            row = ReportBundle._read_index(bundle).get(str(student_id))
+            return bundle.read(row['member']) if row else None
+
@@ -0,0 +1,224 @@
+import os
+import time
+import queue
+import threading
+import logging
+from metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+def in_order(items, key, start=0):
+    """Yield `items` in order of their consecutive integer `key(item)`.
+
+    Each item is released as soon as every earlier one has been, so only
+    items that overtook a slower predecessor are held back: a consumer sees
+    input order while the pipeline keeps finishing work out of order. Items
+    still waiting on a gap when `items` runs out are yielded in key order.
+    """
+    pending = {}
+    next_key = start
+    for item in items:
+        pending[key(item)] = item
+        while next_key in pending:
+            yield pending.pop(next_key)
+            next_key += 1
+    for k in sorted(pending):
+        yield pending[k]
+
+class Stage:
+    """One step of a Pipeline: `fn(item)` run by `workers` threads.
+
+    With fan_out the return value is an iterable and each element is
+    queued separately for the next stage.
+    """
+
+    def __init__(self, name, fn, workers=1, fan_out=False):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.fan_out = fan_out
+
+        self.inbox = None
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def stats(self, elapsed):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.inbox.qsize() if self.inbox else 0,
+                'in_flight': self.in_flight,
+                'processed': self.processed,
+                'failed': self.failed,
+                'items_per_second': round(self.processed / elapsed, 2) if elapsed else None,
+                # Busy share of the worker pool; near 1.0 marks the bottleneck
+                'utilization': round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed else None,
+                # Time spent waiting on a full downstream queue (backpressure)
+                'blocked_seconds': round(self.blocked_seconds, 3),
+            }
+
+class Pipeline:
+    """Stages connected by bounded queues.
+
+    Every stage has its own worker threads and reads from a queue holding
+    at most `queue_size` items, so a slow stage fills its queue and blocks
+    the stages upstream of it instead of letting work pile up in memory.
+    The source is read lazily by a feeder thread ("ingest") under the same
+    limit. An item whose stage raises is handed to `on_error` and then
+    leaves the pipeline straight away; later stages never see it.
+    """
+
+    def __init__(self, stages, queue_size=None, on_error=None, monitor_interval=None):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size or os.getenv('PIPELINE_QUEUE_SIZE', '16')))
+        self.on_error = on_error
+        if monitor_interval is None:
+            monitor_interval = float(os.getenv('PIPELINE_MONITOR_SECONDS', '10'))
+        self.monitor_interval = monitor_interval
+        self.ingested = 0
+        self._output = None
+        self._started = None
+        self._stop = threading.Event()
+
+    def _put(self, q, item, stage=None):
+        """Blocking put that gives up once the pipeline is stopped"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        if stage is not None:
+            waited = time.perf_counter() - start
+            with stage._lock:
+                stage.blocked_seconds += waited
+
+    def _feed(self, source):
+        first = self.stages[0]
+        try:
+            for item in source:
+                if self._stop.is_set():
+                    return
+                self._put(first.inbox, item)
+                self.ingested += 1
+        except Exception as e:
+            logger.error(f"Pipeline source failed: {e}")
+            self._put(self._output, (_DONE, e))
+        finally:
+            self._put(first.inbox, _DONE)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        outbox = self.stages[index + 1].inbox if index + 1 < len(self.stages) else self._output
+        while not self._stop.is_set():
+            item = stage.inbox.get()
+            if item is _DONE:
+                break
+
+            with stage._lock:
+                stage.in_flight += 1
+            start = time.perf_counter()
+            try:
+                out = stage.fn(item)
+                ok = True
+            except Exception as e:
+                ok = False
+                if self.on_error:
+                    self.on_error(item, stage.name, e)
+                else:
+                    logger.error(f"Stage {stage.name} failed: {e}")
+            elapsed = time.perf_counter() - start
+            with stage._lock:
+                stage.in_flight -= 1
+                stage.busy_seconds += elapsed
+                if ok:
+                    stage.processed += 1
+                else:
+                    stage.failed += 1
+            metrics.inc('pipeline_items_total', stage=stage.name, status='ok' if ok else 'failed')
+
+            if not ok:
+                self._put(self._output, item)
+            elif stage.fan_out:
+                for part in out:
+                    self._put(outbox, part, stage)
+            else:
+                self._put(outbox, out, stage)
+
+        # Pass the sentinel on to a sibling worker; the last one out tells the next stage
+        with stage._lock:
+            stage._running -= 1
+            last = stage._running == 0
+        if last:
+            self._put(outbox, _DONE)
+        else:
+            stage.inbox.put(_DONE)
+
+    def stats(self):
+        """Per-stage queue depth and throughput so far"""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        stats = {
+            'ingest': {
+                'processed': self.ingested,
+                'items_per_second': round(self.ingested / elapsed, 2) if elapsed else None,
+            }
+        }
+        for stage in self.stages:
+            stats[stage.name] = stage.stats(elapsed)
+        stats['output'] = {'queue_depth': self._output.qsize() if self._output else 0}
+        return stats
+
+    def _monitor(self):
+        while not self._stop.wait(self.monitor_interval):
+            self._report()
+
+    def _report(self):
+        stats = self.stats()
+        for name, stage in stats.items():
+            if 'queue_depth' in stage:
+                metrics.gauge('pipeline_queue_depth', stage['queue_depth'], stage=name)
+        logger.info("Pipeline: " + ', '.join(
+            f"{name} {stage['processed']} done, {stage['queue_depth']} queued"
+            for name, stage in stats.items() if name not in ('ingest', 'output')
+        ))
+
+    def run(self, source):
+        """Yield items as they leave the last stage (or fail), in completion order"""
+        self._started = time.perf_counter()
+        self._stop.clear()
+        for stage in self.stages:
+            stage.inbox = queue.Queue(maxsize=self.queue_size)
+            stage._running = stage.workers
+        self._output = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._feed, args=(source,), name='pipeline-ingest', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads += [
+                threading.Thread(target=self._work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                for n in range(stage.workers)
+            ]
+        if self.monitor_interval > 0:
+            threads.append(threading.Thread(target=self._monitor, name='pipeline-monitor', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self._output.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, tuple) and item and item[0] is _DONE:
+                    raise item[1]
+                yield item
+        finally:
+            self._stop.set()
+            self._report()
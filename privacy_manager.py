@@ -1,52 +1,232 @@
-import os
-import hashlib
-import pandas as pd
-from apscheduler.schedulers.background import BackgroundScheduler
-import datetime
-import shutil
-import logging
-import time
-
-# Configure logging
-logger = logging.getLogger(__name__)
-
-class PrivacyManager:
-    def __init__(self):
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
-        logger.info("Scheduler started")
-    
-    def mask_student_id(self, student_id):
-        salt = os.getenv('FERPA_SALT', 'default_salt')
-        masked = hashlib.blake2b(
-            f"{student_id}{salt}".encode(),
-            digest_size=4
-        ).hexdigest()
-        return f"S{masked.upper()}"
-    
-    def schedule_deletion(self, delete_time):
-        self.scheduler.add_job(
-            self._cleanup_data,
-            'date',
-            run_date=delete_time
-        )
-        logger.info(f"Scheduled data deletion at {delete_time}")
-    
-    def _cleanup_data(self):
-        logger.info("Initiating data cleanup...")
-        # Delete input data
-        folders_to_clean = ['temp/', 'teacher_audio/', 'reports/']
-        for folder in folders_to_clean:
-            try:
-                if os.path.exists(folder):
-                    shutil.rmtree(folder)
-                    os.makedirs(folder, exist_ok=True)
-                    logger.info(f"Cleaned {folder}")
-            except Exception as e:
-                logger.error(f"Error cleaning {folder}: {str(e)}")
-        
-        # Log deletion
-        with open('deletion.log', 'a') as log:
-            log.write(f"Data cleaned at {datetime.datetime.now()}\n")
-        
-        logger.info("Data cleanup completed")
\ No newline at end of file
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import threading
+import logging
+import time
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Folders whose files are indexed by discover(). Reports are also registered
+# when built; discovery catches PDFs from older versions or other tools
+DISCOVER_FOLDERS = {'temp': 'temp', 'teacher_audio': 'audio', 'reports': 'report'}
+
+class PrivacyManager:
+    """Retention engine for student artifacts.
+
+    Every report, temp file and teacher recording gets a row in a SQLite
+    index holding its creation time and expiry, with an index on expiry.
+    A sweep reads only the expired rows, deletes those files and appends
+    one JSON audit record per deletion. The index lives on disk, so a
+    deletion that was due while nothing was running happens on the next
+    sweep: at the start of each run, from `python privacy_manager.py
+    --sweep` under cron/Task Scheduler, or from start_sweeper() in a
+    long-lived process.
+    """
+
+    SWEEP_BATCH = 1000
+
+    def __init__(self, index_path=None, retention_hours=None, audit_path=None):
+        self.index_path = index_path or os.getenv('RETENTION_INDEX_PATH', 'cache/retention.db')
+        self.retention = float(retention_hours or os.getenv('RETENTION_HOURS', '24')) * 3600
+        self.audit_path = audit_path or os.getenv('RETENTION_AUDIT_LOG', 'deletion.log')
+        self._scheduler = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def scheduler(self):
+        # APScheduler is imported and started on first use
+        if self._scheduler is None:
+            from apscheduler.schedulers.background import BackgroundScheduler
+            self._scheduler = BackgroundScheduler()
+            self._scheduler.start()
+            logger.info("Scheduler started")
+        return self._scheduler
+
+    @property
+    def conn(self):
+        # Opened on first use so masking IDs never touches the disk
+        if self._conn is None:
+            if os.path.dirname(self.index_path):
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "path TEXT PRIMARY KEY, "
+                "kind TEXT NOT NULL, "
+                "student TEXT, "
+                "created_at REAL NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_expiry ON artifacts (expires_at)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def mask_student_id(self, student_id):
+        salt = os.getenv('FERPA_SALT', 'default_salt')
+        masked = hashlib.blake2b(
+            f"{student_id}{salt}".encode(),
+            digest_size=4
+        ).hexdigest()
+        return f"S{masked.upper()}"
+
+    def register(self, path, kind='report', student_id=None, created_at=None, retention_hours=None):
+        """Record a file and when it expires; re-registering restarts its clock"""
+        created_at = created_at or time.time()
+        retention = retention_hours * 3600 if retention_hours is not None else self.retention
+        student = self.mask_student_id(student_id) if student_id is not None else None
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO artifacts (path, kind, student, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (os.path.normpath(path), kind, student, created_at, created_at + retention)
+            )
+            self.conn.commit()
+
+    def discover(self, folders=None):
+        """Index files dropped into `folders` by other tools.
+
+        Files are dated from when they were first indexed, not by their
+        mtime: a recording copied in with an old mtime still gets the full
+        retention period to be transcribed. A folder is only listed again
+        when its own mtime changed, i.e. when files were added or removed
+        since the last scan.
+        """
+        folders = folders or DISCOVER_FOLDERS
+        now = time.time()
+        entries = []
+        scanned = []
+        for folder, kind in folders.items():
+            if not os.path.isdir(folder):
+                continue
+            mtime = os.stat(folder).st_mtime
+            with self._lock:
+                seen = self.conn.execute("SELECT mtime FROM folders WHERE path = ?", (folder,)).fetchone()
+            if seen and seen[0] == mtime:
+                continue
+            scanned.append((folder, mtime))
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_file():
+                        entries.append((os.path.normpath(entry.path), kind, now, now + self.retention))
+        with self._lock:
+            before = self.conn.total_changes
+            # Already indexed files keep their original dates
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO artifacts (path, kind, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                entries
+            )
+            added = self.conn.total_changes - before
+            self.conn.executemany("INSERT OR REPLACE INTO folders (path, mtime) VALUES (?, ?)", scanned)
+            self.conn.commit()
+        if added:
+            logger.info(f"Indexed {added} new files for retention")
+        return added
+
+    def sweep(self, now=None):
+        """Delete every expired artifact; returns the number of files removed"""
+        now = now or time.time()
+        deleted = 0
+        while True:
+            with self._lock:
+                expired = self.conn.execute(
+                    "SELECT path, kind, student, created_at, expires_at FROM artifacts "
+                    "WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                    (now, self.SWEEP_BATCH)
+                ).fetchall()
+            if not expired:
+                break
+
+            done = []
+            records = []
+            for path, kind, student, created_at, expires_at in expired:
+                try:
+                    os.remove(path)
+                    result, error = 'deleted', None
+                    deleted += 1
+                except FileNotFoundError:
+                    result, error = 'missing', None
+                except OSError as e:
+                    result, error = 'error', str(e)
+                    logger.error(f"Could not delete {path}: {e}")
+                if result != 'error':
+                    done.append((path,))
+                records.append({
+                    'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'path': path,
+                    'kind': kind,
+                    'student': student,
+                    'created_at': datetime.datetime.fromtimestamp(created_at).isoformat(timespec='seconds'),
+                    'expired_at': datetime.datetime.fromtimestamp(expires_at).isoformat(timespec='seconds'),
+                    'result': result,
+                    'error': error
+                })
+
+            # Audit before forgetting, so a crash can repeat a deletion but never lose its record
+            with open(self.audit_path, 'a') as log:
+                log.write(''.join(json.dumps(record) + '\n' for record in records))
+            with self._lock:
+                self.conn.executemany("DELETE FROM artifacts WHERE path = ?", done)
+                self.conn.commit()
+            if len(done) < len(expired):
+                # Files we could not delete stay indexed and are retried by the next sweep
+                break
+
+        if deleted:
+            logger.info(f"Retention sweep deleted {deleted} expired files")
+        return deleted
+
+    def stats(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            total, expired = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(expires_at <= ?), 0) FROM artifacts", (now,)
+            ).fetchone()
+            nxt = self.conn.execute(
+                "SELECT MIN(expires_at) FROM artifacts WHERE expires_at > ?", (now,)
+            ).fetchone()[0]
+        return {
+            'tracked': total,
+            'expired': expired,
+            'next_expiry': datetime.datetime.fromtimestamp(nxt).isoformat(timespec='seconds') if nxt else None
+        }
+
+    def start_sweeper(self, interval_minutes=None):
+        """Sweep periodically from a long-lived process"""
+        interval = float(interval_minutes or os.getenv('RETENTION_SWEEP_MINUTES', '15'))
+        self.scheduler.add_job(self.sweep, 'interval', minutes=interval, id='retention_sweep',
+                               replace_existing=True)
+        logger.info(f"Retention sweep every {interval:g} minutes")
+
+    def close(self):
+        if self._scheduler is not None:
+            self._scheduler.shutdown(wait=False)
+            self._scheduler = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Delete expired student artifacts")
+    parser.add_argument('--sweep', action='store_true', help="Index new files and delete expired ones")
+    parser.add_argument('--stats', action='store_true', help="Show how many files are tracked and expired")
+    args = parser.parse_args()
+
+    privacy = PrivacyManager()
+    if args.sweep:
+        privacy.discover()
+        privacy.sweep()
+    elif args.stats:
+        print(privacy.stats())
+    else:
+        parser.print_help()
+    privacy.close()
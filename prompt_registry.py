@@ -0,0 +1,99 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from functools import lru_cache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PROMPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+
+# {name} or {name[key]}; any other brace (e.g. a JSON example) is literal text
+_PLACEHOLDER = re.compile(r'\{(\w+)(?:\[(\w+)\])?\}')
+
+def compact(value):
+    """Dicts and lists go into prompts as single-line JSON; everything else as str"""
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+    return '' if value is None else str(value)
+
+class PromptTemplate:
+    """A prompt file split once into literal text and placeholders.
+
+    `version` is a short hash of the source, so editing a prompt file
+    changes every cache key and manifest fingerprint built from it.
+    """
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.version = hashlib.sha256(source.encode('utf-8')).hexdigest()[:12]
+        self.parts = []
+        pos = 0
+        for match in _PLACEHOLDER.finditer(source):
+            self.parts.append(source[pos:match.start()])
+            self.parts.append((match.group(1), match.group(2)))
+            pos = match.end()
+        self.parts.append(source[pos:])
+        self.fields = sorted({part[0] for part in self.parts if isinstance(part, tuple)})
+
+    def render(self, **values):
+        out = []
+        for part in self.parts:
+            if isinstance(part, str):
+                out.append(part)
+                continue
+            name, key = part
+            if name not in values:
+                raise ValueError(f"Prompt '{self.name}' needs a value for {{{name}}}")
+            value = values[name]
+            if key is not None:
+                value = value.get(key) if isinstance(value, dict) else getattr(value, key, None)
+            out.append(compact(value))
+        return ''.join(out)
+
+class PromptRegistry:
+    """Every prompts/*.txt, read and compiled once.
+
+    Templates are named after their file without the `_prompt.txt`
+    suffix, so prompts/narrative_prompt.txt is `narrative`.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.getenv('PROMPT_DIR', PROMPT_DIR)
+        self.templates = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.txt'):
+                continue
+            name = filename[:-len('.txt')]
+            if name.endswith('_prompt'):
+                name = name[:-len('_prompt')]
+            with open(os.path.join(self.directory, filename), encoding='utf-8') as f:
+                self.templates[name] = PromptTemplate(name, f.read().replace('\r\n', '\n').strip())
+        logger.debug(f"Loaded {len(self.templates)} prompt templates from {self.directory}")
+
+    def get(self, name):
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise KeyError(f"No prompt template '{name}' in {self.directory}") from None
+
+    def render(self, name, **values):
+        return self.get(name).render(**values)
+
+    def versions(self):
+        return {name: template.version for name, template in sorted(self.templates.items())}
+
+    def version(self, names=None):
+        """One hash over the named templates (default: all), for things built from several of them"""
+        digest = hashlib.sha256()
+        for name in sorted(names if names is not None else self.templates):
+            digest.update(f"{name}@{self.get(name).version}\n".encode())
+        return digest.hexdigest()[:12]
+
+@lru_cache(maxsize=4)
+def get_registry(directory=None):
+    """Shared registry, loaded on first use"""
+    return PromptRegistry(directory)
@@ -0,0 +1,167 @@
+import os
+import time
+import random
+import threading
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# HTTP statuses that mean "slow down" rather than "this request is wrong"
+THROTTLE_STATUS = {429, 500, 502, 503, 504}
+THROTTLE_NAMES = {'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError', 'BadGateway'}
+
+def is_throttle(exc):
+    """True for quota/overload errors from google-api-core, gRPC or plain HTTP clients"""
+    code = getattr(exc, 'code', None)
+    if callable(code):
+        try:
+            code = code()
+        except Exception:
+            code = None
+    code = getattr(code, 'value', code)
+    if isinstance(code, tuple):
+        code = code[0]
+    if code in THROTTLE_STATUS or getattr(exc, 'status_code', None) in THROTTLE_STATUS:
+        return True
+    return type(exc).__name__ in THROTTLE_NAMES
+
+def retry_after(exc):
+    """Server-provided retry delay in seconds, if the error carries one"""
+    value = getattr(exc, 'retry_after', None)
+    if value is None:
+        response = getattr(exc, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    if value is None:
+        # google.rpc.RetryInfo attached to api_core errors
+        for detail in getattr(exc, 'details', None) or []:
+            delay = getattr(detail, 'retry_delay', None)
+            if delay is not None:
+                value = getattr(delay, 'seconds', 0) + getattr(delay, 'nanos', 0) / 1e9
+                break
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveRateLimiter:
+    """Shared client-side limiter for Gemini calls.
+
+    Two token buckets cap requests/minute and tokens/minute, and an AIMD
+    controller sets how many calls may be in flight: the limit grows by one
+    after a full window of successes and halves on every throttle. A
+    throttle also pauses every caller until the server's retry-after (or a
+    growing cooldown) expires, so waiting students don't stampede the API
+    the moment one of them retries.
+
+    The requests/minute bucket is off unless GEMINI_RPM (or `rpm`) is set
+    to a positive number; a fixed cap would otherwise hold a paid-tier
+    project to that rate even when the API has room for more.
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_concurrency=None, min_concurrency=1, clock=time.monotonic):
+        self.rpm = float(rpm or os.getenv('GEMINI_RPM') or 0) or None
+        self.tpm = float(tpm or os.getenv('GEMINI_TPM', '1000000'))
+        self.max_concurrency = int(max_concurrency or os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+        self.min_concurrency = max(1, min_concurrency)
+        self.limit = max(self.min_concurrency, min(4, self.max_concurrency))
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._requests = self.rpm or 0.0
+        self._tokens = self.tpm
+        self._refilled = clock()
+        self._blocked_until = 0.0
+        self._successes = 0
+        self._consecutive_throttles = 0
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttles = 0
+        self.completed = 0
+
+    def _refill(self, now):
+        elapsed = now - self._refilled
+        self._refilled = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens=1):
+        """Block until a request slot and `tokens` of TPM budget are available"""
+        tokens = min(float(tokens), self.tpm)
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    now = self._clock()
+                    self._refill(now)
+                    if now < self._blocked_until:
+                        self._cond.wait(self._blocked_until - now)
+                    elif self.in_flight >= self.limit:
+                        self._cond.wait()
+                    elif (self.rpm and self._requests < 1) or self._tokens < tokens:
+                        need_requests = max(0.0, 1 - self._requests) * 60.0 / self.rpm if self.rpm else 0.0
+                        need_tokens = max(0.0, tokens - self._tokens) * 60.0 / self.tpm
+                        self._cond.wait(max(need_requests, need_tokens, 0.01))
+                    else:
+                        if self.rpm:
+                            self._requests -= 1
+                        self._tokens -= tokens
+                        self.in_flight += 1
+                        return tokens
+            finally:
+                self.waiting -= 1
+
+    def release(self, reserved=0, used=None, outcome='success', delay=None):
+        """Return a slot and feed the outcome to the AIMD controller.
+
+        `outcome` is 'success', 'throttled' or 'error'; plain errors leave
+        the concurrency limit unchanged.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if used is not None:
+                # Refund (or charge) the difference from the estimate
+                self._tokens = min(self.tpm, self._tokens + reserved - used)
+
+            if outcome == 'throttled':
+                self.throttles += 1
+                self._consecutive_throttles += 1
+                self._successes = 0
+                self.limit = max(self.min_concurrency, self.limit // 2)
+                if delay is None:
+                    delay = min(60.0, 2.0 ** self._consecutive_throttles) * random.uniform(0.5, 1.0)
+                self._blocked_until = max(self._blocked_until, self._clock() + delay)
+                logger.warning(f"Gemini throttled: concurrency limit now {self.limit}, pausing {delay:.1f}s")
+            elif outcome == 'success':
+                self.completed += 1
+                self._consecutive_throttles = 0
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+    @property
+    def paused(self):
+        """True while every caller is held back after a throttle"""
+        with self._cond:
+            return self._clock() < self._blocked_until
+
+    def stats(self):
+        with self._cond:
+            self._refill(self._clock())
+            return {
+                'concurrency_limit': self.limit,
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'rpm_limit': self.rpm,
+                'tpm_limit': self.tpm,
+                'requests_available': round(self._requests, 2) if self.rpm else None,
+                'tokens_available': round(self._tokens),
+                'paused_for': round(max(0.0, self._blocked_until - self._clock()), 2),
+                'throttles': self.throttles,
+                'completed': self.completed
+            }
@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+import logging
+from metrics import metrics
+from concurrent.futures import ProcessPoolExecutor
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Per-worker engine, built once by the pool initializer
+_engine = None
+
+def _init_worker():
+    global _engine
+    from pdf_engine import PDFEngine
+    _engine = PDFEngine()
+    # Build styles now so the first job doesn't pay for it
+    _engine.styles
+
+def _ping():
+    return os.getpid()
+
+def _render(content, acc_pref, output_path, return_bytes, report_id=None):
+    start = time.perf_counter()
+    if output_path is None:
+        # In-memory render: the bytes come back through the result pipe
+        data = _engine.render_pdf(content, acc_pref, report_id)
+        size = len(data)
+    else:
+        _engine.create_pdf(content, acc_pref, output_path)
+        size = os.path.getsize(output_path)
+        data = None
+        if return_bytes:
+            with open(output_path, 'rb') as f:
+                data = f.read()
+    return {
+        'path': output_path,
+        'bytes': data,
+        'size': size,
+        'seconds': time.perf_counter() - start,
+        'pid': os.getpid()
+    }
+
+class RenderPool:
+    """Fan PDF builds out to worker processes with pre-built styles.
+
+    ReportLab is pure Python, so threads serialize on the GIL; each worker
+    process builds its PDFEngine (and `_create_styles()`) once and reuses
+    it for every job. Exposes `create_pdf` so it can stand in for
+    PDFEngine in the orchestrator.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = int(workers or os.getenv('PDF_WORKERS') or os.cpu_count() or 1)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        self._lock = threading.Lock()
+        self.rendered = 0
+        self.render_seconds = 0.0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def warm(self):
+        """Start every worker (and build its styles) before the first job"""
+        pids = {f.result() for f in [self._executor.submit(_ping) for _ in range(self.workers)]}
+        logger.info(f"Render pool ready with {len(pids)} worker processes")
+
+    def submit(self, content, acc_pref, output_path, return_bytes=False, report_id=None):
+        return self._executor.submit(_render, content, acc_pref, output_path, return_bytes, report_id)
+
+    def render(self, content, acc_pref, output_path, return_bytes=False, report_id=None):
+        """Render in a worker and return path, bytes, size and timing"""
+        result = self.submit(content, acc_pref, output_path, return_bytes, report_id).result()
+        # Worker processes have their own registry, so record here
+        metrics.observe('pdf_render_seconds', result['seconds'])
+        metrics.inc('pdfs_rendered_total')
+        if output_path is not None:
+            metrics.inc('pdf_bytes_written_total', result['size'])
+        with self._lock:
+            self.rendered += 1
+            self.render_seconds += result['seconds']
+            if output_path is not None:
+                self.bytes_written += result['size']
+        return result
+
+    def create_pdf(self, content, acc_pref, output_path):
+        return self.render(content, acc_pref, output_path)['path']
+
+    def render_pdf(self, content, acc_pref, report_id):
+        return self.render(content, acc_pref, None, report_id=report_id)['bytes']
+
+    def summary(self):
+        with self._lock:
+            average = self.render_seconds / self.rendered if self.rendered else 0.0
+            return {
+                'workers': self.workers,
+                'rendered': self.rendered,
+                'render_seconds': round(self.render_seconds, 3),
+                'average_seconds': round(average, 4),
+                'bytes_written': self.bytes_written
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
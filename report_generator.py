@@ -1,204 +1,542 @@
-import google.generativeai as genai
-import os
-import json
-import re
-import pandas as pd
-from dotenv import load_dotenv
-import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
-
-# Configure logging
-logger = logging.getLogger(__name__)
-
-load_dotenv()
-
-# Configure Gemini
-try:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key or not api_key.startswith("AIza"):
-        raise ValueError("Invalid or missing Gemini API key")
-    
-    genai.configure(api_key=api_key)
-    logger.info("Gemini API configured successfully")
-except Exception as e:
-    logger.error(f"Gemini configuration failed: {e}")
-    raise
-
-# Gemini safety settings for educational context
-safety_settings = [
-    {
-        "category": "HARM_CATEGORY_HARASSMENT",
-        "threshold": "BLOCK_NONE"
-    },
-    {
-        "category": "HARM_CATEGORY_HATE_SPEECH",
-        "threshold": "BLOCK_NONE"
-    },
-    {
-        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-    },
-    {
-        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-    }
-]
-
-class ReportGenerator:
-    def __init__(self):
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-    
-    def extract_subject_scores(self, row):
-        subject_scores = {}
-        for col in row.index:
-            if '_C' in col and pd.notna(row[col]):
-                subject = col.split('_')[0]
-                scores = []
-                for period in ['C', 'P1', 'P2']:
-                    score_col = f"{subject}_{period}"
-                    if score_col in row and pd.notna(row[score_col]):
-                        scores.append(row[score_col])
-                if len(scores) >= 2:  # Need at least 2 scores for comparison
-                    subject_scores[subject] = scores
-        return subject_scores
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=60))
-    def analyze_scores(self, row):
-        subject_scores = self.extract_subject_scores(row)
-        if not subject_scores:
-            return {"strengths": [], "improvements": [], "risks": []}
-        
-        # Format prompt for Gemini
-        prompt = f"""
-        ROLE: Educational Data Scientist
-        TASK: Analyze academic performance data
-        
-        RAW SCORES:
-        {json.dumps(subject_scores, indent=2)}
-        
-        INSTRUCTIONS:
-        1. Calculate improvement percentage for each subject: 
-           improvement = ((current - oldest)/oldest * 100)
-        2. Identify top strength (subject with highest consistent scores)
-        3. Flag subjects with >15% score drop as URGENT
-        4. Format output as VALID JSON with these keys:
-           - strengths: list of dictionaries with "subject" and "evidence"
-           - improvements: list of dictionaries with "subject" and "trend" (percentage)
-           - risks: list of dictionaries with "subject" and "drop" (percentage)
-        
-        OUTPUT ONLY JSON. No additional text or markdown.
-        """
-        
-        try:
-            response = self.model.generate_content(
-                prompt,
-                safety_settings=safety_settings,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.0,
-                    max_output_tokens=1000,
-                    response_mime_type="application/json"
-                )
-            )
-            
-            # Extract JSON from Gemini's response
-            json_str = response.text.strip().replace('```json', '').replace('```', '')
-            return json.loads(json_str)
-        except Exception as e:
-            logger.error(f"Score analysis failed: {e}")
-            # Fallback if analysis fails
-            return {
-                "strengths": [{"subject": "General", "evidence": "Good overall performance"}],
-                "improvements": [],
-                "risks": []
-            }
-    
-    def classify_vark(self, row):
-        responses = []
-        for i in range(1, 5):
-            col = f'VARK_Q{i}'
-            if col in row and pd.notna(row[col]):
-                responses.append(row[col])
-        
-        if not responses:
-            return 'Visual'  # Default
-        
-        vark_map = {'A': 'Visual', 'B': 'Aural', 'C': 'Read/Write', 'D': 'Kinesthetic'}
-        primary_style = max(set(responses), key=responses.count)
-        return vark_map.get(primary_style, 'Visual')
-    
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=60))
-    def generate_narrative(self, row, analysis, vark_profile, teacher_quote=""):
-        # Prepare student data
-        student_data = {
-            "name": row.get('StudentName', 'Student'),
-            "lang": row['LangPref'],
-            "accessibility": row['AccPref']
-        }
-        
-        # Format prompt for Gemini
-        prompt = f"""
-        **ROLE**: Educational Psychologist
-        **LANGUAGE**: {student_data['lang']} (B1 Level)
-        **STUDENT PROFILE**:
-        - Name: {student_data['name']}
-        - Learning Style: {vark_profile}
-        - Accessibility Needs: {student_data['accessibility']}
-        - Teacher Feedback: "{teacher_quote}"
-        
-        **PERFORMANCE ANALYSIS**:
-        {json.dumps(analysis, indent=2)}
-        
-        **REQUIREMENTS**:
-        1. Generate a 1-page student report in plain text format
-        2. Structure with these sections:
-        [Top Strength Highlight]
-        [Learning Style Identification]
-        [Strengths List]
-        [Improvement Areas]
-        [Teacher Quote]
-        [Personalized Study Hacks]
-        3. Start with ★ emoji for top strength
-        4. Include teacher quote verbatim
-        5. Suggest 2 {vark_profile}-specific study hacks
-        6. Use growth mindset language
-        7. Format for accessibility needs: {student_data['accessibility']}
-        8. Write at B1 language level
-        
-        **OUTPUT INSTRUCTIONS**:
-        - Use plain text with line breaks only
-        - Never use markdown, HTML, or special formatting
-        - Keep entire report under 1000 characters
-        - Use emojis sparingly for emphasis
-        - Include all sections from requirements
-        """
-        
-        try:
-            response = self.model.generate_content(
-                prompt,
-                safety_settings=safety_settings,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.3,
-                    max_output_tokens=1500
-                )
-            )
-            return response.text
-        except Exception as e:
-            logger.error(f"Report generation failed: {e}")
-            # Fallback content
-            return f"""
-            ★ Top Strength: General Academic Performance
-            Learning Style: {vark_profile}
-            
-            STRENGTHS:
-            - Good overall engagement
-            
-            IMPROVEMENT AREAS:
-            - Focus on consistent practice
-            
-            TEACHER FEEDBACK:
-            {teacher_quote}
-            
-            STUDY SUGGESTIONS:
-            1. Try visual diagrams for complex concepts
-            2. Review material regularly
-            """
\ No newline at end of file
+import os
+import json
+import time
+from concurrent.futures import CancelledError
+from dotenv import load_dotenv
+import logging
+from response_cache import ResponseCache
+from score_analyzer import ScoreAnalyzer
+from rate_limiter import AdaptiveRateLimiter, is_throttle, retry_after
+from hedging import Hedger
+from metrics import metrics, TokenLedger
+from prompt_registry import get_registry
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+_gemini_configured = False
+
+def configure_gemini():
+    """Configure the Gemini client once; only needed when no model is injected"""
+    global _gemini_configured
+    if _gemini_configured:
+        return
+    try:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key or not api_key.startswith("AIza"):
+            raise ValueError("Invalid or missing Gemini API key")
+        
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        _gemini_configured = True
+        logger.info("Gemini API configured successfully")
+    except Exception as e:
+        logger.error(f"Gemini configuration failed: {e}")
+        raise
+
+# Gemini safety settings for educational context
+safety_settings = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_NONE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+MODEL_NAME = 'gemini-1.5-flash'
+
+# Bump when prompt handling changes in code; edits to prompts/*.txt are
+# picked up through the registry version
+PROMPT_VERSION = '1'
+
+# Output budget for one batched request and the share each student needs
+MAX_BATCH_OUTPUT_TOKENS = int(os.getenv('GEMINI_BATCH_MAX_OUTPUT_TOKENS', '8192'))
+ANALYSIS_TOKENS_PER_STUDENT = 300
+NARRATIVE_TOKENS_PER_STUDENT = 600
+STRUCTURED_TOKENS_PER_STUDENT = 150
+
+# Used when Gemini gives no usable tips in structured mode
+DEFAULT_STUDY_TIPS = {
+    'Visual': ["Turn each topic into a mind map or diagram", "Colour-code notes by subject"],
+    'Aural': ["Explain each topic out loud to someone", "Record key points and listen back"],
+    'Read/Write': ["Rewrite class notes as short summaries", "Make lists of key terms and definitions"],
+    'Kinesthetic': ["Use real objects or experiments to practise", "Study in short sessions with movement breaks"],
+}
+
+class ReportGenerator:
+    def __init__(self, cache=None, analysis_mode=None, model=None, limiter=None, narrative_format=None,
+                 hedger=None):
+        self.model_name = MODEL_NAME
+        self.prompts = get_registry()
+        # Input/output tokens per student, stage and prompt
+        self.tokens = TokenLedger()
+        if model is None:
+            configure_gemini()
+            import google.generativeai as genai
+            model = genai.GenerativeModel(self.model_name)
+        self.model = model
+        self.cache = cache or ResponseCache()
+        # Shared by every Gemini call made through this generator
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_attempts = int(os.getenv('GEMINI_MAX_ATTEMPTS', '3'))
+        # Deadline for each call (retries included) and hedging of slow requests
+        self.hedger = hedger or Hedger()
+        # 'local' computes the analysis with ScoreAnalyzer; 'llm' asks Gemini
+        self.analysis_mode = (analysis_mode or os.getenv('ANALYSIS_MODE', 'local')).lower()
+        self.analyzer = ScoreAnalyzer()
+        # 'text' asks Gemini for the whole report; 'structured' asks only for a
+        # highlight and study tips and renders the rest through the HTML template
+        self.narrative_format = (narrative_format or os.getenv('NARRATIVE_FORMAT', 'text')).lower()
+        # Students packed into one Gemini request (1 disables batching)
+        self.batch_size = max(1, int(os.getenv('GEMINI_BATCH_SIZE', '1')))
+        # Part of every report fingerprint: only the prompts these modes use
+        self.prompt_version = f"{PROMPT_VERSION}.{self.prompts.version(self.report_templates())}"
+
+    def report_templates(self):
+        """Prompt templates that can shape a report in the current analysis/narrative/batch modes"""
+        names = ['analysis'] if self.analysis_mode == 'llm' else []
+        names.append('structured' if self.narrative_format == 'structured' else 'narrative')
+        if self.batch_limit() > 1:
+            # Students missing from a batched reply fall back to the single-student prompts
+            names += [f"{name}_batch" for name in names]
+        return names
+
+    def _generate(self, template, values, generation_config, parse=None, stage=None, student_ids=()):
+        """Render a prompt template and call Gemini through the response cache.
+
+        The template name and version are part of the cache key. Only
+        responses that `parse` accepts are stored, so a malformed reply is
+        retried on the next run instead of being served forever.
+        """
+        prompt_template = self.prompts.get(template)
+        prompt = prompt_template.render(**values)
+        stage = stage or template
+        key = self.cache.make_key(
+            f"{self.model_name}:{template}@{prompt_template.version}", generation_config, prompt
+        )
+        text = self.cache.get(key)
+        metrics.inc('gemini_cache_requests_total', result='miss' if text is None else 'hit')
+        if text is not None:
+            self.tokens.record(stage, template, prompt_template.version, student_ids, cached=True)
+            return parse(text) if parse else text
+
+        start = time.perf_counter()
+        response = self._call_model(prompt, generation_config, key=template)
+        text = response.text
+        usage = getattr(response, 'usage_metadata', None)
+        self.tokens.record(
+            stage, template, prompt_template.version, student_ids,
+            input_tokens=getattr(usage, 'prompt_token_count', None) or len(prompt) // 4,
+            output_tokens=getattr(usage, 'candidates_token_count', None) or len(text) // 4,
+            seconds=time.perf_counter() - start
+        )
+        result = parse(text) if parse else text
+        self.cache.set(key, text)
+        return result
+    
+    def _call_model(self, prompt, generation_config, key='default'):
+        """generate_content under the shared rate limiter, within one deadline.
+
+        Throttled calls are retried while time remains; slow calls may be
+        hedged with a duplicate request (see hedging.Hedger). Raises
+        hedging.DeadlineExceeded when GEMINI_DEADLINE_SECONDS runs out, so
+        callers fall back instead of stalling the student.
+        """
+        # Rough budget (~4 chars per token) until the response reports usage
+        estimate = len(prompt) // 4 + generation_config.get('max_output_tokens', 0)
+        deadline_at = time.monotonic() + self.hedger.deadline
+
+        def send(attempt_deadline, cancelled):
+            return self._send(prompt, generation_config, estimate, attempt_deadline, cancelled)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return self.hedger.call(
+                    key, send,
+                    deadline=deadline_at - time.monotonic(),
+                    # No duplicate requests while Gemini is telling us to back off
+                    can_hedge=lambda: not self.limiter.paused
+                )
+            except Exception as e:
+                if is_throttle(e) and attempt < self.max_attempts and time.monotonic() < deadline_at:
+                    metrics.inc('gemini_retries_total')
+                    continue
+                raise
+    
+    def _send(self, prompt, generation_config, estimate, deadline_at, cancelled):
+        """One generate_content attempt; gives up unsent if `cancelled` is set while queued"""
+        with metrics.timer('gemini_queue_seconds'):
+            reserved = self.limiter.acquire(estimate)
+        if cancelled.is_set():
+            self.limiter.release(reserved, used=0, outcome='cancelled')
+            metrics.inc('gemini_cancelled_total')
+            raise CancelledError()
+        try:
+            with metrics.timer('gemini_request_seconds'):
+                response = self.model.generate_content(
+                    prompt,
+                    safety_settings=safety_settings,
+                    generation_config=generation_config,
+                    # Let the client drop the connection at the deadline too
+                    request_options={"timeout": max(1.0, deadline_at - time.monotonic())}
+                )
+        except Exception as e:
+            if is_throttle(e):
+                metrics.inc('gemini_errors_total', kind='throttled')
+                self.limiter.release(reserved, outcome='throttled', delay=retry_after(e))
+            else:
+                metrics.inc('gemini_errors_total', kind='error')
+                self.limiter.release(reserved, outcome='error')
+            raise
+        
+        usage = getattr(response, 'usage_metadata', None)
+        used = getattr(usage, 'total_token_count', None) if usage is not None else None
+        self.limiter.release(reserved, used=used)
+        return response
+    
+    def extract_subject_scores(self, record):
+        return record.subject_scores
+    
+    def analyze_cohort(self, df, schema=None):
+        """Analyze every student at once (a list in frame order), or None when the LLM path is selected"""
+        if self.analysis_mode == 'llm':
+            return None
+        return self.analyzer.analyze_frame(df, schema).tolist()
+    
+    def analyze_scores(self, record):
+        if self.analysis_mode == 'llm':
+            return self._analyze_scores_llm(record)
+        return self.analyzer.analyze_record(record)
+    
+    def _analyze_scores_llm(self, record):
+        subject_scores = self.extract_subject_scores(record)
+        if not subject_scores:
+            return {"strengths": [], "improvements": [], "risks": []}
+        
+        try:
+            return self._generate(
+                'analysis',
+                {'subject_scores': subject_scores},
+                {
+                    "temperature": 0.0,
+                    "max_output_tokens": 1000,
+                    "response_mime_type": "application/json"
+                },
+                parse=self._parse_json,
+                student_ids=[record.student_id]
+            )
+        except Exception as e:
+            logger.error(f"Score analysis failed: {e}")
+            metrics.inc('gemini_fallbacks_total', kind='analysis')
+            # Fallback if analysis fails
+            return {
+                "strengths": [{"subject": "General", "evidence": "Good overall performance"}],
+                "improvements": [],
+                "risks": []
+            }
+    
+    @staticmethod
+    def _parse_json(text):
+        # Extract JSON from Gemini's response
+        json_str = text.strip().replace('```json', '').replace('```', '')
+        return json.loads(json_str)
+    
+    def classify_vark(self, record):
+        return record.vark
+    
+    def generate_narrative(self, record, analysis, vark_profile, teacher_quote=""):
+        if self.narrative_format == 'structured':
+            return self._generate_structured(record, analysis, vark_profile, teacher_quote)
+        
+        # Prepare student data
+        student_data = {
+            "name": record.name,
+            "lang": record.lang,
+            "accessibility": record.acc_pref
+        }
+        
+        try:
+            return self._generate(
+                'narrative',
+                {
+                    'student_data': student_data,
+                    'vark': vark_profile,
+                    'quote': teacher_quote,
+                    'analysis': analysis
+                },
+                {
+                    "temperature": 0.3,
+                    "max_output_tokens": 1500
+                },
+                student_ids=[record.student_id]
+            )
+        except Exception as e:
+            logger.error(f"Report generation failed: {e}")
+            metrics.inc('gemini_fallbacks_total', kind='narrative')
+            # Fallback content
+            return f"""
+            ★ Top Strength: General Academic Performance
+            Learning Style: {vark_profile}
+            
+            STRENGTHS:
+            - Good overall engagement
+            
+            IMPROVEMENT AREAS:
+            - Focus on consistent practice
+            
+            TEACHER FEEDBACK:
+            {teacher_quote}
+            
+            STUDY SUGGESTIONS:
+            1. Try visual diagrams for complex concepts
+            2. Review material regularly
+            """
+    
+    def _generate_structured(self, record, analysis, vark_profile, teacher_quote):
+        """Template context for one student; Gemini writes only the free-text fields"""
+        fields = {}
+        try:
+            fields = self._generate(
+                'structured',
+                {
+                    'student_data': {
+                        "name": record.name,
+                        "lang": record.lang,
+                        "accessibility": record.acc_pref
+                    },
+                    'vark': vark_profile,
+                    'analysis': analysis
+                },
+                {
+                    "temperature": 0.3,
+                    "max_output_tokens": STRUCTURED_TOKENS_PER_STUDENT,
+                    "response_mime_type": "application/json"
+                },
+                parse=self._parse_structured,
+                stage='narrative',
+                student_ids=[record.student_id]
+            )
+        except Exception as e:
+            logger.error(f"Report generation failed: {e}")
+            metrics.inc('gemini_fallbacks_total', kind='narrative')
+        return self.report_context(record, analysis, vark_profile, teacher_quote, fields)
+    
+    @classmethod
+    def _parse_structured(cls, text):
+        fields = cls._parse_json(text)
+        if not cls._valid_structured(fields):
+            raise ValueError("Structured narrative is missing trend_highlight or study_tips")
+        return fields
+    
+    @staticmethod
+    def _valid_structured(entry):
+        return (
+            isinstance(entry, dict)
+            and isinstance(entry.get("trend_highlight"), str)
+            and isinstance(entry.get("study_tips"), list)
+            and all(isinstance(tip, str) for tip in entry["study_tips"])
+        )
+    
+    @staticmethod
+    def report_context(record, analysis, vark_profile, teacher_quote, fields=None):
+        """Everything templates/base_report.html needs; gaps are filled deterministically"""
+        fields = fields or {}
+        highlight = fields.get("trend_highlight")
+        if not highlight:
+            improvements = analysis.get("improvements") or []
+            strengths = analysis.get("strengths") or []
+            if improvements:
+                highlight = f"{improvements[0]['subject']} is up {improvements[0]['trend']}% - great progress!"
+            elif strengths:
+                highlight = f"Top strength: {strengths[0]['subject']}"
+        return {
+            "name": record.name,
+            "trend_highlight": highlight,
+            "strengths": analysis.get("strengths") or [],
+            "improvements": analysis.get("improvements") or [],
+            "risks": analysis.get("risks") or [],
+            "vark_type": vark_profile,
+            "study_tips": (fields.get("study_tips") or DEFAULT_STUDY_TIPS.get(vark_profile, []))[:2],
+            "teacher_quote": teacher_quote,
+        }
+    
+    def batch_limit(self, tokens_per_student=None):
+        """Largest batch that fits both GEMINI_BATCH_SIZE and the output token budget"""
+        if tokens_per_student is None:
+            tokens_per_student = (
+                STRUCTURED_TOKENS_PER_STUDENT if self.narrative_format == 'structured'
+                else NARRATIVE_TOKENS_PER_STUDENT
+            )
+        return max(1, min(self.batch_size, MAX_BATCH_OUTPUT_TOKENS // tokens_per_student))
+    
+    def analyze_scores_batch(self, records):
+        """Gemini analysis for several students in one request.
+        
+        Returns a list aligned with `records`; students missing from or
+        malformed in the batched reply are analyzed one at a time.
+        """
+        if self.analysis_mode != 'llm':
+            return [self.analyzer.analyze_record(record) for record in records]
+        if len(records) == 1:
+            return [self.analyze_scores(records[0])]
+        # Pipeline batches are sized for the narrative reply; analysis replies have their own budget
+        limit = self.batch_limit(ANALYSIS_TOKENS_PER_STUDENT)
+        if len(records) > limit:
+            return [analysis for i in range(0, len(records), limit)
+                    for analysis in self.analyze_scores_batch(records[i:i + limit])]
+        
+        entries = []
+        for record in records:
+            subject_scores = self.extract_subject_scores(record)
+            if subject_scores:
+                entries.append({"StudentID": str(record.student_id), "scores": subject_scores})
+        
+        def valid(entry):
+            return all(isinstance(entry.get(key), list) for key in ("strengths", "improvements", "risks"))
+        
+        batched = self._generate_batch(
+            'analysis_batch', entries, ANALYSIS_TOKENS_PER_STUDENT, 0.0, valid, stage='analysis'
+        )
+        
+        results = []
+        for record in records:
+            entry = batched.get(str(record.student_id))
+            if entry is not None:
+                results.append({key: entry[key] for key in ("strengths", "improvements", "risks")})
+            elif not self.extract_subject_scores(record):
+                # Never sent, so not a fallback: the empty analysis needs no Gemini call
+                results.append(self.analyze_scores(record))
+            else:
+                metrics.inc('gemini_fallbacks_total', kind='batch_entry')
+                results.append(self.analyze_scores(record))
+        return results
+    
+    def generate_narratives(self, students):
+        """Narratives for several students, batched when GEMINI_BATCH_SIZE > 1.
+        
+        `students` is a list of (record, analysis, vark_profile, teacher_quote)
+        tuples; returns the report texts in the same order.
+        """
+        if len(students) == 1:
+            record, analysis, vark_profile, teacher_quote = students[0]
+            return [self.generate_narrative(record, analysis, vark_profile, teacher_quote=teacher_quote)]
+        if self.narrative_format == 'structured':
+            return self._generate_structured_batch(students)
+        
+        entries = [
+            {
+                "StudentID": str(record.student_id),
+                "name": record.name,
+                "language": record.lang,
+                "learning_style": vark_profile,
+                "accessibility": record.acc_pref,
+                "teacher_feedback": teacher_quote,
+                "analysis": analysis
+            }
+            for record, analysis, vark_profile, teacher_quote in students
+        ]
+        
+        def valid(entry):
+            return isinstance(entry.get("report"), str) and entry["report"].strip() != ""
+        
+        batched = self._generate_batch(
+            'narrative_batch', entries, NARRATIVE_TOKENS_PER_STUDENT, 0.3, valid, stage='narrative'
+        )
+        
+        reports = []
+        for record, analysis, vark_profile, teacher_quote in students:
+            entry = batched.get(str(record.student_id))
+            if entry is not None:
+                reports.append(entry["report"])
+            else:
+                logger.warning(f"Batch reply missing narrative for {record.student_id}, retrying alone")
+                metrics.inc('gemini_fallbacks_total', kind='batch_entry')
+                reports.append(self.generate_narrative(record, analysis, vark_profile, teacher_quote=teacher_quote))
+        return reports
+    
+    def _generate_structured_batch(self, students):
+        """Structured narratives for several students in one request"""
+        entries = [
+            {
+                "StudentID": str(record.student_id),
+                "name": record.name,
+                "language": record.lang,
+                "learning_style": vark_profile,
+                "accessibility": record.acc_pref,
+                "analysis": analysis
+            }
+            for record, analysis, vark_profile, teacher_quote in students
+        ]
+        
+        batched = self._generate_batch(
+            'structured_batch', entries, STRUCTURED_TOKENS_PER_STUDENT, 0.3, self._valid_structured,
+            stage='narrative'
+        )
+        
+        contexts = []
+        for record, analysis, vark_profile, teacher_quote in students:
+            entry = batched.get(str(record.student_id))
+            if entry is not None:
+                contexts.append(self.report_context(record, analysis, vark_profile, teacher_quote, entry))
+            else:
+                logger.warning(f"Batch reply missing narrative for {record.student_id}, retrying alone")
+                metrics.inc('gemini_fallbacks_total', kind='batch_entry')
+                contexts.append(self.generate_narrative(record, analysis, vark_profile, teacher_quote=teacher_quote))
+        return contexts
+    
+    def _generate_batch(self, template, entries, tokens_per_student, temperature, valid, stage=None):
+        """Send `entries` in one batched request and return {StudentID: entry} for valid entries"""
+        student_ids = [e["StudentID"] for e in entries]
+        if not student_ids:
+            return {}
+        
+        def parse(text):
+            data = self._parse_json(text)
+            if isinstance(data, dict):
+                data = data.get("students", data.get("results"))
+            if not isinstance(data, list):
+                raise ValueError("Batch response is not a JSON array")
+            return data
+        
+        try:
+            data = self._generate(
+                template,
+                {'students': entries},
+                {
+                    "temperature": temperature,
+                    "max_output_tokens": min(MAX_BATCH_OUTPUT_TOKENS, tokens_per_student * len(student_ids)),
+                    "response_mime_type": "application/json"
+                },
+                parse=parse,
+                stage=stage,
+                student_ids=student_ids
+            )
+        except Exception as e:
+            logger.error(f"Batched request for {len(student_ids)} students failed: {e}")
+            return {}
+        
+        expected = set(student_ids)
+        results = {}
+        for entry in data:
+            if not isinstance(entry, dict):
+                continue
+            student_id = str(entry.get("StudentID", ""))
+            if student_id in expected and student_id not in results and valid(entry):
+                results[student_id] = entry
+        
+        if len(results) < len(expected):
+            logger.warning(f"Batch returned {len(results)}/{len(expected)} usable entries")
+        return results
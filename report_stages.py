@@ -0,0 +1,241 @@
+import os
+import logging
+from metrics import metrics, StudentProfiler
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class StudentJob:
+    """One student's state as it moves through the pipeline"""
+    __slots__ = ('index', 'record', 'fingerprint', 'quote_key', 'analysis', 'content', 'pdf_path', 'pdf_bytes',
+                 'result')
+
+    def __init__(self, index, record, fingerprint=None, analysis=None):
+        self.index = index
+        self.record = record
+        self.fingerprint = fingerprint
+        self.quote_key = None
+        self.analysis = analysis
+        self.content = None
+        self.pdf_path = None
+        self.pdf_bytes = None
+        self.result = {
+            'student_id': record.student_id, 'status': 'ok', 'error': None, 'delivered': False, 'reused': False
+        }
+
+class ReportStages:
+    """Stage functions for the report pipeline.
+
+    Items are lists of StudentJob: whole Gemini batches for analyze and
+    narrate (one request per batch when GEMINI_BATCH_SIZE > 1), then single
+    students for render and deliver. `renderer` defaults to `pdf_engine`
+    and may be a RenderPool to build PDFs in worker processes. With a
+    `manifest`, students whose report is up to date are not regenerated
+    and reports already sent to the same address are not sent again.
+    New PDFs are registered with `privacy` for retention.
+
+    `storage` is the PDF_STORAGE mode: with 'memory' or 'archive' the PDF
+    is rendered to bytes and those bytes are attached to the email; in
+    'archive' mode `archive` writes them to disk in the background.
+    """
+
+    def __init__(self, processor, report_gen, pdf_engine, renderer=None, manifest=None, profiler=None,
+                 privacy=None, storage='disk', archive=None, reports_dir='reports', bundle=None, groups=None):
+        self.processor = processor
+        self.report_gen = report_gen
+        self.pdf_engine = pdf_engine
+        self.renderer = renderer or pdf_engine
+        self.manifest = manifest
+        self.privacy = privacy
+        self.storage = storage
+        self.archive = archive
+        self.reports_dir = reports_dir
+        self.bundle = bundle
+        self.groups = groups
+        self.profiler = profiler or StudentProfiler()
+        self.model = f"{report_gen.model_name}:{report_gen.analysis_mode}"
+        if report_gen.narrative_format != 'text':
+            self.model += f":{report_gen.narrative_format}"
+
+    def stream(self, df, chunk_rows=None):
+        """Batches for every row of `df`, building records and analyses a chunk of rows at a time.
+
+        Only PIPELINE_CHUNK_ROWS rows are turned into StudentRecords and
+        analyzed ahead of the pipeline's bounded queues, instead of the
+        whole cohort up front.
+        """
+        chunk_rows = max(1, int(chunk_rows or os.getenv('PIPELINE_CHUNK_ROWS', '1000')))
+        schema = self.processor.schema
+
+        def chunks():
+            for start in range(0, len(df), chunk_rows):
+                yield df.iloc[start:start + chunk_rows]
+
+        def analyses():
+            for chunk in chunks():
+                with metrics.timer('pipeline_stage_seconds', stage='analyze_cohort'):
+                    analyzed = self.report_gen.analyze_cohort(chunk, schema)
+                yield from analyzed
+
+        records = (record for chunk in chunks() for record in schema.records(chunk))
+        return self.batches(records, analyses() if self.report_gen.analysis_mode != 'llm' else None)
+
+    def batches(self, records, analyses=None):
+        """Lazily group StudentRecords into Gemini-sized batches of jobs.
+
+        `analyses`, if given, is an iterable of local analyses in the same
+        order as `records`.
+        """
+        size = self.report_gen.batch_limit()
+        analyses = iter(analyses) if analyses is not None else None
+        batch = []
+        for index, record in enumerate(records):
+            job = StudentJob(index, record, analysis=next(analyses) if analyses is not None else None)
+            if self.manifest is not None:
+                job.quote_key = self.quote_key(record.student_id)
+                job.fingerprint = self.manifest.fingerprint(
+                    record, self.report_gen.prompt_version, self.model, record.acc_pref, quote=job.quote_key
+                )
+                if self.manifest.is_rendered(record.student_id, job.fingerprint):
+                    job.result['reused'] = True
+                elif self.bundle is not None:
+                    # The last bundle holds this exact report
+                    job.result['reused'] = self.bundle.has(record.student_id, self.group(job), job.fingerprint)
+                elif self.storage == 'memory':
+                    # Memory-only reports leave no PDF to reuse, but a sent one needn't be rebuilt
+                    job.result['reused'] = self.manifest.is_delivered(record.student_id, job.fingerprint,
+                                                                      record.email)
+            batch.append(job)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def quote_key(self, student_id):
+        """Transcript key behind the student's quote, for the fingerprint.
+
+        A recording deleted by retention is not an input change: the key the
+        last report was built with is kept and its cached transcript served.
+        """
+        transcriber = self.processor.transcriber
+        key = transcriber.audio_key(student_id) if transcriber else None
+        if key is None:
+            key = self.manifest.quote_key(student_id)
+            if key is not None and transcriber is not None:
+                transcriber.adopt(student_id, key)
+        return key
+
+    def group(self, job):
+        """Class (or other bundle group) of a job's student"""
+        return self.groups[job.index] if self.groups is not None else 'cohort'
+
+    def _run(self, stage, jobs, fn):
+        # PROFILE_SAMPLE_RATE > 0 writes cProfile stats for a sample of students
+        with metrics.timer('pipeline_stage_seconds', stage=stage):
+            return self.profiler.run_stage(stage, jobs[0].record.student_id, fn, jobs)
+
+    def analyze(self, jobs):
+        # Generate insights (precomputed for the cohort unless ANALYSIS_MODE=llm)
+        todo = [job for job in jobs if not job.result['reused'] and job.analysis is None]
+        if todo:
+            def run(todo):
+                for job, analysis in zip(todo, self.report_gen.analyze_scores_batch([j.record for j in todo])):
+                    job.analysis = analysis
+            self._run('analyze', todo, run)
+        return jobs
+
+    def narrate(self, jobs):
+        todo = [job for job in jobs if not job.result['reused']]
+        if todo:
+            def run(todo):
+                students = [
+                    (
+                        job.record,
+                        job.analysis,
+                        self.report_gen.classify_vark(job.record),
+                        # Get teacher quote
+                        self.processor.get_teacher_quote(job.record.student_id)
+                    )
+                    for job in todo
+                ]
+                # Generate report content
+                for job, content in zip(todo, self.report_gen.generate_narratives(students)):
+                    job.content = content
+            self._run('narrate', todo, run)
+        # Render and deliver one student at a time
+        return [[job] for job in jobs]
+
+    def render(self, jobs):
+        job, = jobs
+        student_id = job.record.student_id
+        if job.content is None:
+            job.result['reused'] = True
+            entry = self.manifest.get(student_id)
+            job.pdf_path = entry['pdf_path'] if entry else None
+            if self.bundle is not None:
+                # From the last bundle, or from the PDF a disk-mode run left behind
+                job.pdf_bytes = self.bundle.carry(student_id, job.record.name, self.group(job), job.fingerprint,
+                                                  path=job.pdf_path)
+                gone = job.pdf_bytes is None
+            else:
+                gone = self.storage != 'memory' and not (job.pdf_path and os.path.exists(job.pdf_path))
+            if not gone:
+                return jobs
+            # Purged (say by the retention sweeper) since batches() found it: build it again
+            logger.info(f"Stored report for {student_id} is gone; rebuilding it")
+            job.result['reused'] = False
+            job.pdf_path = None
+            self.narrate(self.analyze(jobs))
+
+        def run(jobs):
+            # Create PDF
+            if self.storage == 'disk':
+                job.pdf_path = os.path.join(self.reports_dir, f"{student_id}_report.pdf")
+                self.renderer.create_pdf(job.content, job.record.acc_pref, job.pdf_path)
+            else:
+                job.pdf_bytes = self.renderer.render_pdf(job.content, job.record.acc_pref, str(student_id))
+                if self.storage == 'archive':
+                    job.pdf_path = os.path.join(self.reports_dir, f"{student_id}_report.pdf")
+                    self.archive.write(job.pdf_path, job.pdf_bytes)
+                elif self.storage == 'bundle':
+                    self.bundle.add(student_id, job.record.name, self.group(job), job.pdf_bytes, job.fingerprint)
+            if self.privacy is not None and job.pdf_path:
+                self.privacy.register(job.pdf_path, kind='report', student_id=student_id)
+            if self.manifest is not None:
+                self.manifest.record_render(student_id, job.fingerprint, job.pdf_path, quote_key=job.quote_key)
+        self._run('render', jobs, run)
+        # Only the PDF is needed from here on
+        job.content = None
+        return jobs
+
+    def deliver(self, jobs):
+        job, = jobs
+        student_id = job.record.student_id
+        email = job.record.email
+        if not email:
+            job.pdf_bytes = None
+            return jobs
+        if self.manifest is not None and self.manifest.is_delivered(student_id, job.fingerprint, email):
+            job.pdf_bytes = None
+            return jobs
+
+        def run(jobs):
+            # Deliver report
+            job.result['delivered'] = self.pdf_engine.deliver_report(
+                job.pdf_bytes if job.pdf_bytes is not None else job.pdf_path,
+                email,
+                job.record.lang,
+                filename=f"{student_id}_report.pdf"
+            )
+            job.pdf_bytes = None
+            if job.result['delivered'] and self.manifest is not None:
+                self.manifest.record_delivery(student_id, job.fingerprint, email)
+        self._run('deliver', jobs, run)
+        return jobs
+
+    @staticmethod
+    def fail(jobs, stage, error):
+        for job in jobs:
+            job.result['status'] = 'failed'
+            job.result['error'] = str(error)
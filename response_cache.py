@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import argparse
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Content-addressed on-disk cache for Gemini responses.
+
+    Entries are keyed by a hash of (model name, generation config, rendered
+    prompt) and stored one file per key, so concurrent writers never share a
+    file: each write goes to a temp file that is atomically renamed into place.
+
+    GEMINI_CACHE controls the mode: 'on' (default), 'off' (bypass entirely)
+    or 'refresh' (ignore existing entries but store new responses).
+
+    A file's mtime is when it was written and is the only clock for the TTL;
+    reads move its atime, which orders size-based eviction (LRU).
+    """
+
+    def __init__(self, cache_dir=None, ttl_seconds=None, max_bytes=None, mode=None):
+        self.cache_dir = cache_dir or os.getenv('GEMINI_CACHE_DIR', 'cache/gemini')
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.getenv('GEMINI_CACHE_TTL_HOURS', '168')) * 3600
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            float(os.getenv('GEMINI_CACHE_MAX_MB', '256')) * 1024 * 1024)
+        self.mode = (mode or os.getenv('GEMINI_CACHE', 'on')).lower()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._evict_every = 100
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @staticmethod
+    def make_key(model_name, generation_config, prompt):
+        """Hash the inputs that fully determine a response"""
+        payload = json.dumps(
+            {'model': model_name, 'config': generation_config, 'prompt': prompt},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """Return the cached response text or None"""
+        if self.mode != 'on':
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                written = os.fstat(f.fileno()).st_mtime
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+
+        now = time.time()
+        if now - written > self.ttl_seconds:
+            self._remove(path)
+            self._count('misses')
+            return None
+
+        # Record the read in atime only: mtime keeps the write time the TTL counts from
+        try:
+            os.utime(path, (now, written))
+        except OSError:
+            pass
+        self._count('hits')
+        return entry.get('text')
+
+    def set(self, key, text):
+        """Atomically store a response"""
+        if not self.enabled:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'created': time.time(), 'text': text}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key[:12]}: {e}")
+            return
+
+        if self._count('writes') % self._evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries (by write time), then the least recently read until under max size"""
+        entries = []
+        total = 0
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # Stale temp files left by killed writers
+                if name.endswith('.tmp') and now - st.st_mtime > 3600:
+                    self._remove(path)
+                    continue
+                if now - st.st_mtime > self.ttl_seconds:
+                    self._remove(path)
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                self._remove(path)
+                total -= size
+                removed += 1
+                if total <= self.max_bytes:
+                    break
+        if removed:
+            logger.info(f"Evicted {removed} cache entries")
+        return removed
+
+    def clear(self):
+        """Invalidate every cached response"""
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                self._remove(os.path.join(root, name))
+                removed += 1
+        logger.info(f"Cleared {removed} cache entries from {self.cache_dir}")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes, 'mode': self.mode}
+
+    def _count(self, attr):
+        with self._lock:
+            value = getattr(self, attr) + 1
+            setattr(self, attr, value)
+            return value
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage the Gemini response cache")
+    parser.add_argument('--clear', action='store_true', help="Remove all cached responses")
+    parser.add_argument('--evict', action='store_true', help="Apply TTL and size limits now")
+    args = parser.parse_args()
+
+    cache = ResponseCache()
+    if args.clear:
+        cache.clear()
+    elif args.evict:
+        cache.evict()
+    else:
+        parser.print_help()
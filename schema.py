@@ -0,0 +1,143 @@
+import re
+import dataclasses
+import numpy as np
+import pandas as pd
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Newest to oldest, matching the <Subject>_C/_P1/_P2 sheet columns
+PERIODS = ['C', 'P1', 'P2']
+SCORE_COLUMN = re.compile(r'^(?P<subject>.+)_(?P<period>C|P1|P2)$')
+VARK_COLUMN = re.compile(r'^VARK_Q(?P<number>\d+)$')
+
+VARK_STYLES = {'A': 'Visual', 'B': 'Aural', 'C': 'Read/Write', 'D': 'Kinesthetic'}
+DEFAULT_VARK = 'Visual'
+
+# Low-cardinality text columns stored as categoricals
+CATEGORY_COLUMNS = ['LangPref', 'AccPref']
+
+@dataclasses.dataclass(slots=True)
+class StudentRecord:
+    """One validated student, built once from the frame.
+
+    `scores` maps each subject to its (C, P1, P2) scores, None where
+    missing. Stages read these attributes instead of pandas Series.
+    """
+    student_id: object
+    name: str
+    lang: str
+    acc_pref: str
+    email: str
+    vark: str
+    scores: dict
+
+    @property
+    def subject_scores(self):
+        """{subject: [scores newest first]} for subjects with a current and an earlier score"""
+        return {
+            subject: [v for v in values if v is not None]
+            for subject, values in self.scores.items()
+            if values[0] is not None and sum(v is not None for v in values) >= 2
+        }
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+def _text(value, default):
+    # NaN and None both mean "blank cell"
+    return default if value is None or value != value else str(value)
+
+class SchemaIndex:
+    """One-time index of the sheet layout.
+
+    Built once per frame from its column names so per-student code never
+    rescans columns: subjects map to their period columns and VARK answers
+    are listed in question order.
+    """
+
+    def __init__(self, subjects, vark_columns):
+        self.subjects = subjects
+        self.vark_columns = vark_columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        subjects = {}
+        vark = []
+        for col in columns:
+            name = str(col)
+            match = SCORE_COLUMN.match(name)
+            if match:
+                subjects.setdefault(match.group('subject'), {})[match.group('period')] = col
+                continue
+            match = VARK_COLUMN.match(name)
+            if match:
+                vark.append((int(match.group('number')), col))
+        # Only subjects with a current score can be compared
+        subjects = {subject: cols for subject, cols in subjects.items() if 'C' in cols}
+        return cls(subjects, [col for _, col in sorted(vark)])
+
+    @property
+    def score_columns(self):
+        return [col for cols in self.subjects.values() for col in cols.values()]
+
+    def score_array(self, df):
+        """students x subjects x periods float array (NaN where missing)"""
+        names = list(self.subjects)
+        scores = np.full((len(df), len(names), len(PERIODS)), np.nan)
+        for j, subject in enumerate(names):
+            for k, period in enumerate(PERIODS):
+                col = self.subjects[subject].get(period)
+                if col is not None:
+                    values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+                    # Undo float32 storage error (72.3 -> 72.30000305) before any maths
+                    scores[:, j, k] = np.round(values, 4)
+        return names, scores
+
+    def compact(self, df):
+        """Store scores as float32 and answers/preferences as categoricals"""
+        columns = {
+            col: pd.to_numeric(df[col], errors='coerce').astype(np.float32)
+            for col in self.score_columns
+        }
+        for col in CATEGORY_COLUMNS + self.vark_columns:
+            if col in df.columns:
+                columns[col] = df[col].astype('category')
+        return df.assign(**columns)
+
+    def records(self, df):
+        """Yield a StudentRecord per row, in frame order, without building Series"""
+        names, scores = self.score_array(df)
+        vark = self.vark_profiles(df).to_numpy()
+        blank = [None] * len(df)
+
+        def column(name):
+            return df[name].tolist() if name in df.columns else blank
+
+        ids, student_names = column('StudentID'), column('StudentName')
+        langs, acc_prefs, emails = column('LangPref'), column('AccPref'), column('ContactEmail')
+        for i in range(len(df)):
+            yield StudentRecord(
+                student_id=ids[i],
+                name=_text(student_names[i], 'Student'),
+                lang=_text(langs[i], 'en'),
+                acc_pref=_text(acc_prefs[i], 'standard'),
+                email=_text(emails[i], ''),
+                vark=vark[i],
+                scores={
+                    subject: tuple(None if v != v else v for v in values)
+                    for subject, values in zip(names, scores[i].tolist())
+                }
+            )
+
+    def vark_profiles(self, df):
+        """Most frequent VARK answer per student; ties go to the earlier letter"""
+        if not self.vark_columns:
+            return pd.Series(DEFAULT_VARK, index=df.index)
+        answers = df[self.vark_columns].astype(str).apply(lambda col: col.str.strip().str.upper())
+        letters = list(VARK_STYLES)
+        counts = np.stack([(answers == letter).sum(axis=1).to_numpy() for letter in letters], axis=1)
+        styles = np.array([VARK_STYLES[letter] for letter in letters], dtype=object)
+        profile = np.where(counts.max(axis=1) > 0, styles[counts.argmax(axis=1)], DEFAULT_VARK)
+        return pd.Series(profile, index=df.index, dtype=object)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import logging
+from schema import SchemaIndex, PERIODS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ScoreAnalyzer:
+    """Deterministic strengths/improvements/risks for a whole cohort.
+
+    Produces the same JSON shape the Gemini analysis prompt asks for:
+      - strengths: [{"subject", "evidence"}] (the top subject)
+      - improvements: [{"subject", "trend"}] (positive % change)
+      - risks: [{"subject", "drop"}] (drops larger than the threshold)
+    """
+
+    def __init__(self, risk_threshold=15.0):
+        self.risk_threshold = risk_threshold
+
+    def analyze_record(self, record):
+        """Analyze a single StudentRecord with the vectorized engine"""
+        names = list(record.scores)
+        scores = np.array(
+            [[[np.nan if v is None else v for v in record.scores[name]] for name in names]],
+            dtype=float
+        ).reshape(1, len(names), len(PERIODS))
+        return self.analyze_array(names, scores)[0]
+
+    def analyze_frame(self, df, schema=None):
+        """Return a Series of analysis dicts aligned with df.index"""
+        schema = schema or SchemaIndex.from_columns(df.columns)
+        names, scores = schema.score_array(df)
+        return pd.Series(self.analyze_array(names, scores), index=df.index, dtype=object)
+
+    def analyze_array(self, names, scores):
+        """List of analysis dicts for a students x subjects x periods array"""
+        if not names:
+            return [self._empty() for _ in range(len(scores))]
+
+        present = ~np.isnan(scores)
+        current = scores[:, :, 0]
+        # Need the current score plus at least one earlier one for comparison
+        eligible = present[:, :, 0] & (present.sum(axis=2) >= 2)
+
+        # Oldest available score: P2 if present, otherwise P1
+        oldest = np.where(present[:, :, 2], scores[:, :, 2], scores[:, :, 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend = (current - oldest) / oldest * 100
+        trend = np.where(eligible & np.isfinite(trend), np.round(trend, 1), np.nan)
+
+        # Top strength: highest mean, ties broken by lower spread (more consistent)
+        counts = present.sum(axis=2)
+        safe_counts = np.maximum(counts, 1)
+        filled = np.where(present, scores, 0.0)
+        means = filled.sum(axis=2) / safe_counts
+        spread = np.sqrt((np.where(present, scores - means[:, :, None], 0.0) ** 2).sum(axis=2) / safe_counts)
+        ranking = np.where(eligible, means - spread * 1e-6, -np.inf)
+        top = np.argmax(ranking, axis=1)
+        has_any = eligible.any(axis=1)
+
+        improving = trend > 0
+        at_risk = trend < -self.risk_threshold
+
+        results = []
+        for i in range(len(scores)):
+            if not has_any[i]:
+                results.append(self._empty())
+                continue
+
+            t = top[i]
+            strengths = [{
+                "subject": names[t],
+                "evidence": f"Average score {means[i, t]:.1f} across {counts[i, t]} assessments "
+                            f"(latest {current[i, t]:g})"
+            }]
+            improvements = sorted(
+                ({"subject": names[j], "trend": float(trend[i, j])} for j in np.flatnonzero(improving[i])),
+                key=lambda item: -item['trend']
+            )
+            risks = sorted(
+                ({"subject": names[j], "drop": float(-trend[i, j])} for j in np.flatnonzero(at_risk[i])),
+                key=lambda item: -item['drop']
+            )
+            results.append({"strengths": strengths, "improvements": improvements, "risks": risks})
+
+        return results
+
+    @staticmethod
+    def _empty():
+        return {"strengths": [], "improvements": [], "risks": []}
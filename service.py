@@ -0,0 +1,320 @@
+import os
+import time
+import hmac
+import threading
+import logging
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from flask import Flask, Response, jsonify, request, send_file
+from data_processor import DataProcessor
+from report_generator import ReportGenerator
+from pdf_engine import PDFEngine
+from privacy_manager import PrivacyManager
+from manifest import BuildManifest
+from metrics import metrics
+from transcription import Transcriber
+from report_stages import ReportStages
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+class ReportService:
+    """Long-lived report generator for on-demand requests.
+
+    DataProcessor (credentials), ReportGenerator (Gemini model, prompts),
+    PDFEngine (styles, SMTP pool), the manifest and the retention sweeper
+    are built once. The validated cohort is cached and reloaded from the
+    sheet every SERVICE_DATA_TTL_SECONDS or on request; if a reload fails
+    the previous cohort is kept rather than the sample rows. A report whose
+    fingerprint is unchanged is served from the manifest without touching
+    Gemini; concurrent requests for the same student share one generation.
+    """
+
+    def __init__(self, processor=None, report_gen=None, pdf_engine=None, manifest=None, privacy=None,
+                 data_ttl=None):
+        self.processor = processor or DataProcessor(sync_mode='full')
+        self.report_gen = report_gen or ReportGenerator()
+        self.pdf_engine = pdf_engine or PDFEngine()
+        self.manifest = manifest or BuildManifest()
+        self.privacy = privacy or PrivacyManager()
+        self.data_ttl = float(data_ttl if data_ttl is not None else os.getenv('SERVICE_DATA_TTL_SECONDS', '300'))
+        self.reports_dir = os.getenv('SERVICE_REPORTS_DIR', 'reports')
+        os.makedirs(self.reports_dir, exist_ok=True)
+        self.stages = ReportStages(self.processor, self.report_gen, self.pdf_engine, manifest=self.manifest,
+                                   privacy=self.privacy, reports_dir=self.reports_dir)
+        self.records = {}
+        self.loaded_at = 0.0
+        self.checked_at = 0.0
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # student_id -> (Future, force, deliver) of the build in progress
+        self._inflight = {}
+        # Builds still using each transcriber; replaced ones are closed once theirs finish
+        self._transcriber_users = {}
+        self._retired = set()
+        self.generated = 0
+        self.reused = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.refresh_failures = 0
+
+    def warm(self):
+        """Load the cohort and build everything the first request would otherwise pay for"""
+        self.refresh()
+        self.pdf_engine.styles
+        self.privacy.start_sweeper()
+        logger.info(f"Report service ready with {len(self.records)} students")
+
+    def refresh(self, force=True):
+        """Reload and validate the sheet; without `force` only when the cached copy is stale"""
+        with self._load_lock:
+            if not force and self.records and time.time() - self.checked_at < self.data_ttl:
+                return False
+            self.checked_at = time.time()
+            try:
+                with metrics.timer('service_refresh_seconds'):
+                    df = self.processor.validate_data(self.processor.load_data(fallback=False))
+                    records = {str(record.student_id): record for record in self.processor.schema.records(df)}
+            except Exception as e:
+                if not self.records:
+                    raise
+                # Retried after another SERVICE_DATA_TTL_SECONDS; requests keep using the last good cohort
+                with self._lock:
+                    self.refresh_failures += 1
+                metrics.inc('service_refresh_failures_total')
+                logger.error(f"Sheet reload failed; keeping the {len(self.records)} students loaded earlier: {e}")
+                return False
+            # Transcripts for the new cohort; cached clips are served without re-transcribing
+            transcriber = None
+            if os.getenv('TRANSCRIBE', 'on').lower() != 'off':
+                transcriber = Transcriber()
+                transcriber.start(student_ids=list(records))
+            with self._lock:
+                previous, self.processor.transcriber = self.processor.transcriber, transcriber
+                self.records = records
+                self.loaded_at = time.time()
+                in_use = previous is not None and self._transcriber_users.get(previous, 0) > 0
+                if in_use:
+                    self._retired.add(previous)
+            if previous is not None and not in_use:
+                previous.close()
+            logger.info(f"Loaded {len(records)} students for the report service")
+            return True
+
+    def report(self, student_id, force=False, deliver=False):
+        """Bring one student's report up to date; returns its result dict.
+
+        A request that arrives while the same student is being generated
+        waits for that generation instead of starting another. If the
+        running build did less than it asked for (no `force` or no
+        `deliver`), it then runs its own build, which reuses the fresh report.
+        """
+        student_id = str(student_id)
+        while True:
+            with self._lock:
+                flight = self._inflight.get(student_id)
+                owner = flight is None
+                if owner:
+                    flight = self._inflight[student_id] = (Future(), force, deliver)
+            future, forced, delivering = flight
+            if owner:
+                break
+            result = future.result()
+            if (force and not forced) or (deliver and not delivering):
+                continue
+            with self._lock:
+                self.coalesced += 1
+            metrics.inc('service_requests_total', result='coalesced')
+            return dict(result, coalesced=True)
+
+        try:
+            result = self._build(student_id, force, deliver)
+        except BaseException as e:
+            self._land(student_id)
+            future.set_exception(e)
+            raise
+        self._land(student_id)
+        future.set_result(result)
+        return dict(result, coalesced=False)
+
+    def _land(self, student_id):
+        # Cleared before waiters wake, so one that needs its own build starts a new one
+        with self._lock:
+            del self._inflight[student_id]
+
+    def _pin_transcriber(self):
+        with self._lock:
+            transcriber = self.processor.transcriber
+            if transcriber is not None:
+                self._transcriber_users[transcriber] = self._transcriber_users.get(transcriber, 0) + 1
+        return transcriber
+
+    def _unpin_transcriber(self, transcriber):
+        if transcriber is None:
+            return
+        with self._lock:
+            self._transcriber_users[transcriber] -= 1
+            if self._transcriber_users[transcriber] > 0:
+                return
+            del self._transcriber_users[transcriber]
+            if transcriber not in self._retired:
+                return
+            self._retired.discard(transcriber)
+        # Replaced by a refresh while this build was still quoting from it
+        transcriber.close()
+
+    def stored(self, student_id):
+        """(pdf_path, current) of the student's last built PDF, or None if none is on disk.
+
+        Nothing is generated; `current` is False when the student's inputs
+        changed since the PDF was built.
+        """
+        student_id = str(student_id)
+        self.refresh(force=False)
+        record = self.records.get(student_id)
+        if record is None:
+            raise KeyError(student_id)
+        entry = self.manifest.get(student_id)
+        if not entry or not entry['pdf_path'] or not os.path.exists(entry['pdf_path']):
+            return None
+        transcriber = self._pin_transcriber()
+        try:
+            job = next(self.stages.batches([record]))[0]
+        finally:
+            self._unpin_transcriber(transcriber)
+        return entry['pdf_path'], job.result['reused']
+
+    def _build(self, student_id, force, deliver):
+        self.refresh(force=False)
+        transcriber = self._pin_transcriber()
+        try:
+            return self._run_build(student_id, force, deliver)
+        finally:
+            self._unpin_transcriber(transcriber)
+
+    def _run_build(self, student_id, force, deliver):
+        start = time.perf_counter()
+        record = self.records.get(student_id)
+        if record is None:
+            raise KeyError(student_id)
+
+        jobs = next(self.stages.batches([record]))
+        job = jobs[0]
+        if force:
+            job.result['reused'] = False
+        try:
+            for item in self.stages.narrate(self.stages.analyze(jobs)):
+                self.stages.render(item)
+                if deliver:
+                    self.stages.deliver(item)
+        except Exception as e:
+            self.stages.fail(jobs, 'service', e)
+            logger.error(f"Report generation failed for {student_id}: {e}")
+
+        result = dict(job.result, pdf_path=job.pdf_path, seconds=round(time.perf_counter() - start, 3))
+        outcome = 'failed' if result['status'] != 'ok' else 'reused' if result['reused'] else 'generated'
+        with self._lock:
+            if outcome == 'failed':
+                self.failed += 1
+            elif outcome == 'reused':
+                self.reused += 1
+            else:
+                self.generated += 1
+        metrics.inc('service_requests_total', result=outcome)
+        metrics.observe('service_request_seconds', result['seconds'], result=outcome)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'students': len(self.records),
+                'data_age_seconds': round(time.time() - self.loaded_at, 1) if self.loaded_at else None,
+                'in_flight': len(self._inflight),
+                'generated': self.generated,
+                'reused': self.reused,
+                'coalesced': self.coalesced,
+                'failed': self.failed,
+                'refresh_failures': self.refresh_failures
+            }
+
+    def close(self):
+        with self._lock:
+            transcribers = self._retired | {self.processor.transcriber}
+            self._retired.clear()
+        for transcriber in transcribers:
+            if transcriber is not None:
+                transcriber.close()
+        self.report_gen.hedger.close()
+        self.pdf_engine.close()
+        self.manifest.close()
+        self.privacy.close()
+
+def create_app(service=None):
+    """Flask app exposing `service`; SERVICE_TOKEN, when set, is required as a bearer token"""
+    app = Flask(__name__)
+    service = service or ReportService()
+    app.config['REPORT_SERVICE'] = service
+    token = os.getenv('SERVICE_TOKEN')
+
+    def flag(name):
+        return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+    @app.before_request
+    def authorize():
+        if token and request.endpoint != 'health':
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            if not hmac.compare_digest(supplied, token):
+                return jsonify(error='unauthorized'), 401
+
+    @app.get('/health')
+    def health():
+        return jsonify(service.stats())
+
+    @app.get('/metrics')
+    def prometheus():
+        return Response(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    @app.post('/refresh')
+    def refresh():
+        service.refresh()
+        return jsonify(service.stats())
+
+    @app.post('/reports/<student_id>')
+    def regenerate(student_id):
+        """Regenerate (or confirm) a report; ?force=1 ignores the manifest, ?deliver=1 emails it"""
+        try:
+            result = service.report(student_id, force=flag('force'), deliver=flag('deliver'))
+        except KeyError:
+            return jsonify(error=f"Unknown student {student_id}"), 404
+        return jsonify(result), 200 if result['status'] == 'ok' else 500
+
+    @app.get('/reports/<student_id>')
+    def download(student_id):
+        """The student's last built PDF; never generates one (POST does)"""
+        try:
+            stored = service.stored(student_id)
+        except KeyError:
+            return jsonify(error=f"Unknown student {student_id}"), 404
+        if stored is None:
+            return jsonify(error=f"No report built for {student_id}; POST /reports/{student_id} builds it"), 404
+        pdf_path, current = stored
+        response = send_file(os.path.abspath(pdf_path), mimetype='application/pdf',
+                             download_name=f"{student_id}_report.pdf", max_age=0)
+        # stale: the student's inputs changed since it was built
+        response.headers['X-Report-Status'] = 'current' if current else 'stale'
+        return response
+
+    return app
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    service = ReportService()
+    service.warm()
+    app = create_app(service)
+    try:
+        app.run(host=os.getenv('SERVICE_HOST', '127.0.0.1'), port=int(os.getenv('SERVICE_PORT', '8080')),
+                threaded=True)
+    finally:
+        service.close()
@@ -0,0 +1,212 @@
+import os
+import csv
+import json
+import glob
+import hashlib
+import argparse
+import dataclasses
+from dotenv import load_dotenv
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Parent of the per-shard working directories; must be shared by every node
+SHARD_ROOT = os.getenv('SHARD_DIR', 'shards')
+
+def shard_of(student_id, count):
+    """0-based shard for a StudentID; the same on every host and Python process"""
+    digest = hashlib.blake2b(str(student_id).strip().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """Slice `index` (1-based) of `count` of the cohort, with its own working directory"""
+
+    index: int
+    count: int
+    root: str = SHARD_ROOT
+
+    @classmethod
+    def parse(cls, spec, root=None):
+        """'k/n' -> Shard(k, n)"""
+        try:
+            index, count = (int(part) for part in spec.split('/'))
+        except ValueError:
+            raise ValueError(f"Shard must look like k/n, got '{spec}'") from None
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"Shard {spec} is out of range (need 1 <= k <= n)")
+        return cls(index, count, root or SHARD_ROOT)
+
+    @property
+    def name(self):
+        return f"shard-{self.index}-of-{self.count}"
+
+    @property
+    def directory(self):
+        return os.path.join(self.root, self.name)
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def owns(self, student_id):
+        return shard_of(student_id, self.count) == self.index - 1
+
+    def select(self, df, column='StudentID'):
+        """Rows of the validated frame that belong to this shard"""
+        mask = [self.owns(student_id) for student_id in df[column].tolist()]
+        return df[mask]
+
+    def isolate(self):
+        """Point every per-run store at this shard's directory.
+
+        Shards share only their inputs (the sheet, teacher_audio/ and the
+        Gemini response cache, whose files are written atomically); SQLite
+        stores, metrics and profiles are kept per shard so nodes never
+        write to the same file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        os.environ.update({
+            'METRICS_DIR': self.path('metrics'),
+            'PROFILE_DIR': self.path('profiles'),
+            'BUILD_MANIFEST_PATH': self.path('manifest.db'),
+            'SHEET_SNAPSHOT_PATH': self.path('sheet_snapshot.db'),
+            'TRANSCRIPT_CACHE_PATH': self.path('transcripts.db'),
+            'RETENTION_INDEX_PATH': self.path('retention.db'),
+            'RETENTION_AUDIT_LOG': self.path('deletion.log'),
+        })
+
+def _merge_numbers(target, source):
+    for key, value in (source or {}).items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        target[key] = target.get(key, 0) + value
+    return target
+
+def merge_summaries(root=None, count=None):
+    """Combine every shard's run_summary.json (and token_report.csv) under `root`.
+
+    Counters, student totals, delivery and token figures are summed,
+    failed students are concatenated, and histogram counts/sums are added
+    (quantiles cannot be merged, so they are dropped). Writes
+    run_summary.json and token_report.csv into `root` and returns the
+    merged summary.
+    """
+    root = root or SHARD_ROOT
+    pattern = f"shard-*-of-{count}" if count else 'shard-*-of-*'
+    paths = sorted(glob.glob(os.path.join(root, pattern, 'metrics', 'run_summary.json')))
+    merged = {
+        'shards': [],
+        'missing_shards': [],
+        'started': None,
+        'duration_seconds': 0.0,
+        'students': {},
+        'failed_students': [],
+        'delivery': {},
+        'gemini_tokens': {},
+        'counters': [],
+        'histograms': [],
+    }
+    counters = {}
+    histograms = {}
+    counts = set()
+    for path in paths:
+        name = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        with open(path) as f:
+            summary = json.load(f)
+        merged['shards'].append(name)
+        shard = summary.get('shard') or {}
+        if shard.get('count'):
+            counts.add(shard['count'])
+        if summary.get('started') is not None:
+            merged['started'] = min(merged['started'] or summary['started'], summary['started'])
+        # Shards run side by side, so the slowest one is the run's wall time
+        merged['duration_seconds'] = max(merged['duration_seconds'], summary.get('duration_seconds') or 0)
+        _merge_numbers(merged['students'], summary.get('students'))
+        merged['failed_students'].extend(summary.get('failed_students') or [])
+        _merge_numbers(merged['delivery'], summary.get('delivery'))
+        for prompt, totals in (summary.get('gemini_tokens') or {}).items():
+            _merge_numbers(merged['gemini_tokens'].setdefault(prompt, {}), totals)
+        for counter in summary.get('counters', []):
+            key = (counter['name'], tuple(sorted(counter['labels'].items())))
+            counters[key] = counters.get(key, 0) + counter['value']
+        for h in summary.get('histograms', []):
+            key = (h['name'], tuple(sorted(h['labels'].items())))
+            entry = histograms.setdefault(key, {'count': 0, 'sum': 0.0, 'max': 0.0})
+            entry['count'] += h['count']
+            entry['sum'] += h['sum']
+            entry['max'] = max(entry['max'], h['max'])
+
+    if len(counts) > 1:
+        logger.warning(f"Shards under {root} come from runs with different counts: {sorted(counts)}")
+    expected = count or (counts.pop() if len(counts) == 1 else None)
+    if expected:
+        merged['missing_shards'] = [
+            f"shard-{k}-of-{expected}" for k in range(1, expected + 1)
+            if f"shard-{k}-of-{expected}" not in merged['shards']
+        ]
+    merged['counters'] = [
+        {'name': name, 'labels': dict(labels), 'value': value}
+        for (name, labels), value in sorted(counters.items())
+    ]
+    merged['histograms'] = [
+        {
+            'name': name,
+            'labels': dict(labels),
+            'count': entry['count'],
+            'sum': round(entry['sum'], 6),
+            'mean': round(entry['sum'] / entry['count'], 6) if entry['count'] else None,
+            'max': round(entry['max'], 6),
+        }
+        for (name, labels), entry in sorted(histograms.items())
+    ]
+
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'run_summary.json'), 'w') as f:
+        json.dump(merged, f, indent=2, default=str)
+    _merge_token_reports(root, pattern)
+
+    students = merged['students']
+    logger.info(
+        f"Merged {len(merged['shards'])} shards: {students.get('total', 0)} students, "
+        f"{students.get('failed', 0)} failed, {students.get('reused', 0)} up to date"
+    )
+    if merged['missing_shards']:
+        logger.warning(f"Missing shard summaries: {', '.join(merged['missing_shards'])}")
+    return merged
+
+def _merge_token_reports(root, pattern):
+    paths = sorted(glob.glob(os.path.join(root, pattern, 'metrics', 'token_report.csv')))
+    if not paths:
+        return None
+    out_path = os.path.join(root, 'token_report.csv')
+    with open(out_path, 'w', newline='', encoding='utf-8') as out:
+        writer = None
+        for path in paths:
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                if writer is None:
+                    writer = csv.writer(out)
+                    writer.writerow(header)
+                writer.writerows(reader)
+    return out_path
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Merge the results of a sharded report run")
+    parser.add_argument('--merge', action='store_true', help="Combine every shard's run summary")
+    parser.add_argument('--root', default=None, help=f"Shard directory (default: {SHARD_ROOT})")
+    parser.add_argument('--count', type=int, default=None, help="Expected number of shards")
+    args = parser.parse_args()
+
+    if args.merge:
+        summary = merge_summaries(args.root, args.count)
+        if summary['failed_students']:
+            print(f"Failed students: {', '.join(str(s) for s in summary['failed_students'])}")
+        raise SystemExit(1 if summary['missing_shards'] else 0)
+    parser.print_help()
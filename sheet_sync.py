@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+import logging
+from metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def _column_letter(n):
+    """1 -> A, 27 -> AA"""
+    letters = ''
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def _numericise(value):
+    """Match get_all_records: numeric strings become int/float, blanks stay ''"""
+    if not isinstance(value, str) or value == '':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def row_hash(record):
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class SheetSnapshot:
+    """SQLite copy of the last synced sheet: one row per StudentID with its content hash"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('SHEET_SNAPSHOT_PATH', 'cache/sheet_snapshot.db')
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "student_id TEXT PRIMARY KEY, row_hash TEXT NOT NULL, data TEXT NOT NULL, synced_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def hashes(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT student_id, row_hash FROM rows"))
+
+    def apply(self, changed, deleted):
+        """Persist changed records ({id: (hash, record)}) and drop deleted IDs in one transaction"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO rows (student_id, row_hash, data, synced_at) VALUES (?, ?, ?, ?)",
+                [(sid, h, json.dumps(record, ensure_ascii=False, default=str), now)
+                 for sid, (h, record) in changed.items()]
+            )
+            self._conn.executemany("DELETE FROM rows WHERE student_id = ?", [(sid,) for sid in deleted])
+
+    def records(self, student_ids):
+        """{id: (hash, record)} for the given IDs as of the last sync"""
+        ids = [str(sid) for sid in student_ids]
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT student_id, row_hash, data FROM rows WHERE student_id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall() if ids else []
+        return {sid: (h, json.loads(data)) for sid, h, data in rows}
+
+    def load_frame(self):
+        """The full cohort as of the last sync"""
+        with self._lock:
+            records = [json.loads(data) for (data,) in self._conn.execute("SELECT data FROM rows ORDER BY rowid")]
+        return pd.DataFrame(records)
+
+    def close(self):
+        self._conn.close()
+
+class SyncResult:
+    """Rows that are new or changed since the last snapshot.
+
+    The snapshot is only updated by `commit()`, so a run that dies before
+    finishing sees the same delta again next time.
+    """
+
+    def __init__(self, snapshot, changed, deleted, total, student_ids=None):
+        self.snapshot = snapshot
+        self.changed = changed
+        self.deleted = deleted
+        self.total = total
+        # Every StudentID on the sheet, changed or not
+        self.student_ids = student_ids if student_ids is not None else set(changed)
+
+    @property
+    def changed_ids(self):
+        return list(self.changed)
+
+    def frame(self):
+        return pd.DataFrame([record for _, record in self.changed.values()])
+
+    def include(self, student_ids):
+        """Also process these unchanged rows (say, for a new teacher recording); returns how many were added"""
+        wanted = [sid for sid in map(str, student_ids) if sid in self.student_ids and sid not in self.changed]
+        added = self.snapshot.records(wanted)
+        self.changed.update(added)
+        return len(added)
+
+    def commit(self, skip=()):
+        """Persist the delta, leaving `skip` IDs (e.g. failed students) pending"""
+        skip = {str(sid) for sid in skip}
+        changed = {sid: entry for sid, entry in self.changed.items() if sid not in skip}
+        self.snapshot.apply(changed, self.deleted)
+        logger.info(f"Snapshot updated: {len(changed)} changed, {len(self.deleted)} removed")
+
+class SheetSync:
+    """Fetch a worksheet in ranged batches and diff it against the snapshot.
+
+    `worksheet` only needs gspread's `row_count`, `row_values(1)` and
+    `get_values(range)`, so a fake can stand in for tests.
+    """
+
+    def __init__(self, worksheet, snapshot=None, batch_rows=None, id_column='StudentID'):
+        self.worksheet = worksheet
+        self.snapshot = snapshot or SheetSnapshot()
+        self.batch_rows = int(batch_rows or os.getenv('SHEETS_BATCH_ROWS', '1000'))
+        self.id_column = id_column
+
+    def iter_records(self):
+        header = self.worksheet.row_values(1)
+        if self.id_column not in header:
+            raise ValueError(f"Sheet has no {self.id_column} column")
+        last_col = _column_letter(len(header))
+
+        # Page over the whole grid: Sheets trims trailing blank rows from each
+        # range, so a short batch only means blanks, not the end of the data
+        row_count = self.worksheet.row_count
+        start = 2
+        while start <= row_count:
+            end = min(start + self.batch_rows - 1, row_count)
+            with metrics.timer('sheets_fetch_seconds'):
+                values = self.worksheet.get_values(f"A{start}:{last_col}{end}")
+            for row in values:
+                # Sheets trims trailing blank cells
+                row = list(row) + [''] * (len(header) - len(row))
+                record = {col: _numericise(value) for col, value in zip(header, row)}
+                if record[self.id_column] != '':
+                    yield record
+            start = end + 1
+
+    def sync(self):
+        previous = self.snapshot.hashes()
+        changed = {}
+        seen = set()
+        total = 0
+        for record in self.iter_records():
+            total += 1
+            sid = str(record[self.id_column])
+            seen.add(sid)
+            h = row_hash(record)
+            if previous.get(sid) != h:
+                changed[sid] = (h, record)
+        deleted = [sid for sid in previous if sid not in seen]
+        metrics.inc('rows_loaded_total', total, source='sheets_incremental')
+        metrics.inc('rows_changed_total', len(changed))
+        logger.info(f"Sheet sync: {total} rows, {len(changed)} new/changed, {len(deleted)} removed")
+        return SyncResult(self.snapshot, changed, deleted, total, student_ids=seen)
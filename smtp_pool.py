@@ -0,0 +1,220 @@
+import os
+import ssl
+import time
+import queue
+import smtplib
+import threading
+import logging
+import collections
+from metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Errors after which a session can't be trusted and must be replaced
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+class DeliveryResult:
+    __slots__ = ('recipient', 'ok', 'error', 'attempts')
+
+    def __init__(self, recipient, ok, error=None, attempts=1):
+        self.recipient = recipient
+        self.ok = ok
+        self.error = error
+        self.attempts = attempts
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f"failed: {self.error}"
+        return f"DeliveryResult({self.recipient!r}, {status})"
+
+class _Session:
+    __slots__ = ('server', 'sent')
+
+    def __init__(self, server):
+        self.server = server
+        self.sent = 0
+
+class SMTPPool:
+    """Small pool of authenticated SMTP sessions shared across deliveries.
+
+    Sessions are reused until they have sent SMTP_MAX_MESSAGES_PER_CONNECTION
+    messages, replaced transparently when the server drops them, and sends
+    are spaced to respect SMTP_MAX_MESSAGES_PER_SECOND across all threads.
+    Only counters and the most recent SMTP_MAX_FAILURES_KEPT failures are
+    kept, so a long-running pool doesn't grow with every message sent.
+    """
+
+    def __init__(self, host=None, port=None, user=None, password=None, use_ssl=None, starttls=None,
+                 size=None, max_messages_per_connection=None, max_messages_per_second=None, timeout=30,
+                 connection_factory=None, max_failures_kept=None):
+        self.host = host or os.getenv('SMTP_SERVER')
+        self.user = user if user is not None else os.getenv('SMTP_USER')
+        self.password = password if password is not None else os.getenv('SMTP_PASS')
+        self.use_ssl = use_ssl if use_ssl is not None else os.getenv('SMTP_USE_SSL', 'false').lower() == 'true'
+        self.starttls = starttls if starttls is not None else (
+            not self.use_ssl and os.getenv('SMTP_STARTTLS', 'true').lower() == 'true')
+        # Implicit TLS listens on 465, STARTTLS submission on 587
+        default_port = 465 if self.use_ssl else 587 if self.starttls else 25
+        self.port = int(port or os.getenv('SMTP_PORT') or default_port)
+        self.size = int(size or os.getenv('SMTP_POOL_SIZE', '2'))
+        self.max_messages_per_connection = int(
+            max_messages_per_connection or os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        self.max_messages_per_second = float(
+            max_messages_per_second if max_messages_per_second is not None
+            else os.getenv('SMTP_MAX_MESSAGES_PER_SECOND', '0'))
+        self.timeout = timeout
+        # Optional callable returning a connected smtplib-like server (for fakes)
+        self.connection_factory = connection_factory
+
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = queue.LifoQueue()
+        self._rate_lock = threading.Lock()
+        self._next_send = 0.0
+        self.max_failures_kept = int(max_failures_kept or os.getenv('SMTP_MAX_FAILURES_KEPT', '1000'))
+        self._results_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.failures = collections.OrderedDict()
+        self.connections_opened = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connect(self):
+        metrics.inc('smtp_connections_opened_total')
+        if self.connection_factory is not None:
+            session = _Session(self.connection_factory())
+            self._opened()
+            return session
+        context = ssl.create_default_context()
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=context)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                server.starttls(context=context)
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        self._opened()
+        logger.debug(f"Opened SMTP session to {self.host}:{self.port}")
+        return _Session(server)
+
+    def _opened(self):
+        with self._results_lock:
+            self.connections_opened += 1
+
+    def _acquire(self, fresh=False):
+        """Take an idle session, or open one; `fresh` always opens a new session"""
+        self._slots.acquire()
+        if not fresh:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, session, broken=False):
+        try:
+            if broken or session.sent >= self.max_messages_per_connection:
+                self._quit(session)
+            else:
+                self._idle.put(session)
+        finally:
+            self._slots.release()
+
+    def _quit(self, session):
+        try:
+            session.server.quit()
+        except Exception:
+            try:
+                session.server.close()
+            except Exception:
+                pass
+
+    def _throttle(self):
+        if self.max_messages_per_second <= 0:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_send - now
+            self._next_send = max(now, self._next_send) + 1.0 / self.max_messages_per_second
+        if wait > 0:
+            time.sleep(wait)
+
+    def send(self, msg, retries=1):
+        """Send one message, reconnecting on dropped sessions; returns a DeliveryResult"""
+        recipient = msg['To']
+        attempts = 0
+        error = None
+        fresh = False
+        while attempts <= retries:
+            attempts += 1
+            try:
+                session = self._acquire(fresh=fresh)
+            except Exception as e:
+                error = e
+                continue
+
+            self._throttle()
+            try:
+                session.server.send_message(msg)
+            except CONNECTION_ERRORS as e:
+                # Stale or dropped session: replace it and try again on a new
+                # one, since the other idle sessions are likely just as stale
+                metrics.inc('smtp_reconnects_total')
+                self._release(session, broken=True)
+                error = e
+                fresh = True
+                continue
+            except smtplib.SMTPException as e:
+                # The server answered, so the session itself is still usable
+                self._release(session)
+                error = e
+                break
+            except Exception as e:
+                self._release(session, broken=True)
+                error = e
+                break
+
+            session.sent += 1
+            self._release(session)
+            return self._record(DeliveryResult(recipient, True, attempts=attempts))
+
+        return self._record(DeliveryResult(recipient, False, error=str(error), attempts=attempts))
+
+    def _record(self, result):
+        with self._results_lock:
+            if result.ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.failures.pop(result.recipient, None)
+                self.failures[result.recipient] = result.error
+                while len(self.failures) > self.max_failures_kept:
+                    self.failures.popitem(last=False)
+        return result
+
+    def summary(self):
+        with self._results_lock:
+            return {
+                'sent': self.sent,
+                'failed': self.failed,
+                'failures': dict(self.failures),
+                'connections_opened': self.connections_opened
+            }
+
+    def close(self):
+        """Quit every idle session"""
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(session)
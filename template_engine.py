@@ -0,0 +1,143 @@
+import os
+import re
+import html
+import logging
+from functools import lru_cache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+_TOKEN = re.compile(r'({%.*?%}|{{.*?}})', re.S)
+_VARIABLE = re.compile(r"^([\w.]+)(?:\|default:(?:'([^']*)'|\"([^\"]*)\"))?$")
+_FOR = re.compile(r'^for\s+(\w+)\s+in\s+([\w.]+)$')
+_IF = re.compile(r'^if\s+([\w.]+)$')
+
+class TemplateError(ValueError):
+    pass
+
+def _lookup(context, path):
+    """Resolve a.b.c against dicts and objects; missing parts give None"""
+    value = context
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part)
+        else:
+            value = getattr(value, part, None)
+        if value is None:
+            return None
+    return value
+
+def _text(value):
+    return lambda context: value
+
+def _variable(expr):
+    match = _VARIABLE.match(expr)
+    if not match:
+        raise TemplateError(f"Unsupported expression: {{{{ {expr} }}}}")
+    path, single, double = match.groups()
+    default = single if single is not None else double
+
+    def render(context):
+        value = _lookup(context, path)
+        if value is None or value == '':
+            value = default if default is not None else ''
+        return html.escape(str(value))
+    return render
+
+def _if(path, body, orelse):
+    def render(context):
+        branch = body if _lookup(context, path) else orelse
+        return ''.join(part(context) for part in branch)
+    return render
+
+def _for(name, path, body):
+    def render(context):
+        out = []
+        for item in _lookup(context, path) or ():
+            scope = dict(context)
+            scope[name] = item
+            out.extend(part(scope) for part in body)
+        return ''.join(out)
+    return render
+
+def _compile(tokens, pos=0, closing=()):
+    """Turn tokens into a list of render functions, stopping at a closing tag"""
+    parts = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token.startswith('{{'):
+            parts.append(_variable(token[2:-2].strip()))
+        elif token.startswith('{%'):
+            tag = token[2:-2].strip()
+            if tag in closing:
+                return parts, pos, tag
+            match = _IF.match(tag)
+            if match:
+                body, pos, end = _compile(tokens, pos, ('else', 'endif'))
+                orelse = []
+                if end == 'else':
+                    orelse, pos, end = _compile(tokens, pos, ('endif',))
+                parts.append(_if(match.group(1), body, orelse))
+                continue
+            match = _FOR.match(tag)
+            if match:
+                body, pos, _ = _compile(tokens, pos, ('endfor',))
+                parts.append(_for(match.group(1), match.group(2), body))
+                continue
+            raise TemplateError(f"Unsupported tag: {token}")
+        elif token:
+            parts.append(_text(token))
+    if closing:
+        raise TemplateError(f"Missing {{% {closing[-1]} %}}")
+    return parts, pos, None
+
+class Template:
+    """Compiled subset of Django template syntax.
+
+    Supports `{% if x %}...{% else %}...{% endif %}`, `{% for a in b %}`
+    and `{{ a.b|default:'' }}`; values are HTML-escaped. The source is
+    parsed once into a tree of closures, so rendering a student is just
+    a walk over that tree.
+    """
+
+    def __init__(self, source):
+        self.parts, _, _ = _compile(_TOKEN.split(source))
+
+    def render(self, context):
+        return ''.join(part(context) for part in self.parts)
+
+@lru_cache(maxsize=16)
+def _load(path, mtime):
+    with open(path, encoding='utf-8') as f:
+        return Template(f.read())
+
+def get_template(name, directory=TEMPLATE_DIR):
+    """Compiled template from templates/, recompiled only when the file changes"""
+    path = os.path.join(directory, name)
+    return _load(path, os.path.getmtime(path))
+
+def parse_css(text):
+    """{selector: {property: value}} for simple rule sets (no nesting or @rules)"""
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    rules = {}
+    for selectors, body in re.findall(r'([^{}]+)\{([^{}]*)\}', text):
+        declarations = {}
+        for declaration in body.split(';'):
+            if ':' in declaration:
+                prop, value = declaration.split(':', 1)
+                declarations[prop.strip().lower()] = value.strip()
+        for selector in selectors.split(','):
+            rules.setdefault(' '.join(selector.split()), {}).update(declarations)
+    return rules
+
+@lru_cache(maxsize=16)
+def _load_css(path, mtime):
+    with open(path, encoding='utf-8') as f:
+        return parse_css(f.read())
+
+def get_stylesheet(name, directory=TEMPLATE_DIR):
+    path = os.path.join(directory, name)
+    return _load_css(path, os.path.getmtime(path))
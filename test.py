@@ -1,3 +1,3 @@
-import os
-api_key = os.getenv("GOOGLE_API_KEY")
-print(api_key)
+import os
+api_key = os.getenv("GOOGLE_API_KEY")
+print(api_key)
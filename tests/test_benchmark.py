@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+import benchmark
+
+def test_benchmark_runs_the_pipeline_and_reads_stage_timings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TRANSCRIBE', 'off')
+    monkeypatch.setenv('PDF_STORAGE', 'memory')
+    args = SimpleNamespace(seed=0, workers=2, analysis_mode='local', gemini_latency=0.0, gemini_failure_rate=0.0,
+                           gemini_spike_rate=0.0, gemini_spike_seconds=0.0, gemini_rpm=None, sheets_latency=0.0,
+                           smtp_latency=0.0, smtp_failure_rate=0.0, smtp_pool_size=2)
+
+    run = benchmark.run_benchmark(6, args)
+
+    assert run['failed'] == 0
+    assert run['emails_sent'] == 6
+    assert run['gemini_calls'] == 6
+    stages = run['stages']
+    assert set(stages) == set(benchmark.STAGES)
+    assert stages['load']['items'] == 1
+    assert stages['render']['items'] == 6 and stages['deliver']['items'] == 6
+    assert all(stages[stage]['seconds'] > 0 for stage in ('narrate', 'render', 'deliver'))
+    # Nothing is left behind in the working directory
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,165 @@
+import io
+import csv
+import time
+import zipfile
+from types import SimpleNamespace
+import pytest
+from pypdf import PdfReader, PdfWriter
+from data_processor import DataProcessor
+from fakes import FakeGeminiModel
+from manifest import BuildManifest
+from pdf_engine import ReportBundle
+from report_generator import ReportGenerator
+from report_stages import ReportStages
+from response_cache import ResponseCache
+from schema import StudentRecord
+
+def pdf(pages=1):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+def index(directory):
+    with zipfile.ZipFile(directory / 'bundle' / 'reports.zip') as bundle:
+        return list(csv.DictReader(io.StringIO(bundle.read('index.csv').decode('utf-8'))))
+
+def test_bundle_is_in_student_order(tmp_path):
+    bundle = ReportBundle(str(tmp_path))
+    for student_id, pages in ((3, 1), (10, 2), (1, 1)):
+        bundle.add(student_id, f'Student {student_id}', '7A', pdf(pages), f'fp{student_id}')
+    bundle.close()
+
+    rows = index(tmp_path)
+    assert [row['student_id'] for row in rows] == ['1', '3', '10']
+    assert [(row['first_page'], row['last_page']) for row in rows] == [('1', '1'), ('2', '2'), ('3', '4')]
+    assert len(PdfReader(str(tmp_path / 'bundle' / '7A.pdf')).pages) == 4
+
+def test_reports_not_rewritten_are_kept(tmp_path):
+    first = ReportBundle(str(tmp_path))
+    for student_id in (1, 2, 3):
+        first.add(student_id, f'Student {student_id}', '7A', pdf(), f'fp{student_id}')
+    first.close()
+
+    # Student 2 is rebuilt; 1 failed and 3 was not in this sync
+    second = ReportBundle(str(tmp_path))
+    second.add(2, 'Student 2', '7A', pdf(2), 'fp2-new')
+    second.close()
+
+    rows = index(tmp_path)
+    assert second.kept == 2
+    assert [(row['student_id'], row['fingerprint']) for row in rows] == [
+        ('1', 'fp1'), ('2', 'fp2-new'), ('3', 'fp3')]
+    assert len(PdfReader(str(tmp_path / 'bundle' / '7A.pdf')).pages) == 4
+    assert ReportBundle.extract(str(tmp_path), 3)
+
+def test_students_off_the_sheet_are_dropped(tmp_path):
+    first = ReportBundle(str(tmp_path))
+    for student_id in (1, 2, 3):
+        first.add(student_id, f'Student {student_id}', '7A', pdf(), f'fp{student_id}')
+    first.close()
+
+    # Student 3 was deleted from the sheet
+    second = ReportBundle(str(tmp_path))
+    second.close(cohort={'1', '2'})
+
+    assert [row['student_id'] for row in index(tmp_path)] == ['1', '2']
+    assert (second.kept, second.dropped) == (2, 1)
+    assert ReportBundle.extract(str(tmp_path), 3) is None
+
+def test_expired_reports_are_dropped(tmp_path):
+    now = time.time()
+    first = ReportBundle(str(tmp_path))
+    first.add(1, 'Student 1', '7A', pdf(), 'fp1', created_at=now - 25 * 3600)
+    first.add(2, 'Student 2', '7A', pdf(), 'fp2', created_at=now - 3600)
+    first.close()
+
+    second = ReportBundle(str(tmp_path), retention_hours=24)
+    assert not second.has(1, '7A', 'fp1')
+    assert second.has(2, '7A', 'fp2')
+    second.close()
+
+    assert [row['student_id'] for row in index(tmp_path)] == ['2']
+    assert second.dropped == 1
+    # The bundle expires with the oldest report it still holds
+    assert second.oldest == pytest.approx(now - 3600, abs=1)
+
+def test_carry_without_a_stored_pdf_returns_none(tmp_path):
+    bundle = ReportBundle(str(tmp_path))
+    assert bundle.carry(1, 'Student 1', '7A', 'fp1') is None
+    assert bundle.carry(1, 'Student 1', '7A', 'fp1', path=str(tmp_path / 'purged.pdf')) is None
+    bundle.close()
+
+    assert bundle.carried == 0
+    assert index(tmp_path) == []
+
+def test_has_requires_the_same_report(tmp_path):
+    first = ReportBundle(str(tmp_path))
+    first.add(1, 'Student 1', '7A', pdf(), 'fp1')
+    first.close()
+
+    second = ReportBundle(str(tmp_path))
+    assert second.has(1, '7A', 'fp1')
+    assert not second.has(1, '7A', 'fp1-new')
+    assert not second.has(1, '7B', 'fp1')
+    assert not second.has(2, '7A', 'fp1')
+    second.close()
+
+def test_report_from_a_disk_run_is_carried_into_a_new_bundle(tmp_path):
+    (tmp_path / 'reports').mkdir()
+    record = StudentRecord(101, 'Asha', 'en', 'standard', 'parent@example.com', 'Visual',
+                           {'Math': (80.0, 70.0, None)})
+    manifest = BuildManifest(str(tmp_path / 'manifest.db'))
+    generator = ReportGenerator(model=FakeGeminiModel(), cache=ResponseCache(mode='off'))
+    processor = SimpleNamespace(transcriber=None)
+
+    # PDF_STORAGE=disk left a PDF behind
+    disk = ReportStages(processor, generator, None, manifest=manifest, reports_dir=str(tmp_path / 'reports'))
+    job = next(disk.batches([record]))[0]
+    pdf_path = tmp_path / 'reports' / '101_report.pdf'
+    pdf_path.write_bytes(pdf())
+    manifest.record_render(record.student_id, job.fingerprint, str(pdf_path))
+
+    # Then PDF_STORAGE=bundle, with no bundle yet
+    bundle = ReportBundle(str(tmp_path / 'reports'))
+    stages = ReportStages(processor, generator, None, manifest=manifest, reports_dir=str(tmp_path / 'reports'),
+                          bundle=bundle)
+    job = next(stages.batches([record]))[0]
+    assert job.result['reused']
+    stages.render([job])
+    bundle.close()
+    manifest.close()
+
+    assert job.pdf_bytes == pdf_path.read_bytes()
+    assert bundle.carried == 1
+    assert [row['student_id'] for row in index(tmp_path / 'reports')] == ['101']
+
+def test_report_purged_before_render_is_rebuilt(tmp_path):
+    (tmp_path / 'reports').mkdir()
+    record = StudentRecord(101, 'Asha', 'en', 'standard', 'parent@example.com', 'Visual',
+                           {'Math': (80.0, 70.0, None)})
+    manifest = BuildManifest(str(tmp_path / 'manifest.db'))
+    generator = ReportGenerator(model=FakeGeminiModel(), cache=ResponseCache(mode='off'))
+    renderer = SimpleNamespace(render_pdf=lambda content, acc_pref, report_id: pdf())
+    bundle = ReportBundle(str(tmp_path / 'reports'))
+    stages = ReportStages(DataProcessor(offline=True), generator, None, renderer=renderer, manifest=manifest,
+                          storage='bundle', reports_dir=str(tmp_path / 'reports'), bundle=bundle)
+    job = next(stages.batches([record]))[0]
+    pdf_path = tmp_path / 'reports' / '101_report.pdf'
+    pdf_path.write_bytes(pdf())
+    manifest.record_render(record.student_id, job.fingerprint, str(pdf_path))
+
+    job = next(stages.batches([record]))[0]
+    assert job.result['reused']
+    # The retention sweeper deletes it before the render stage gets to it
+    pdf_path.unlink()
+    stages.render([job])
+    bundle.close()
+    manifest.close()
+
+    assert not job.result['reused']
+    assert job.pdf_bytes
+    assert bundle.written == 1 and bundle.carried == 0
+    assert [row['student_id'] for row in index(tmp_path / 'reports')] == ['101']
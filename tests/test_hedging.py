@@ -0,0 +1,122 @@
+import time
+import threading
+import pytest
+from hedging import DeadlineExceeded, HedgeBudget, Hedger, LatencyTracker
+
+def hedger(**kwargs):
+    """Hedger that hedges after 50ms (no latency history) with a 1-hedge budget"""
+    kwargs.setdefault('budget', HedgeBudget(ratio=0.0, burst=1))
+    return Hedger(workers=4, deadline=2, min_delay=0.05, enabled=True,
+                  tracker=LatencyTracker(min_samples=1000), **kwargs)
+
+class Attempts:
+    """fn for Hedger.call: attempt n sleeps delays[n] (cut short once cancelled) and returns n"""
+
+    def __init__(self, *delays):
+        self.delays = delays
+        self.started = []
+        self._lock = threading.Lock()
+
+    def __call__(self, deadline_at, cancelled):
+        with self._lock:
+            n = len(self.started)
+            self.started.append(cancelled)
+        if cancelled.wait(self.delays[n]):
+            raise RuntimeError(f"attempt {n} cancelled")
+        return n
+
+def test_hedge_wins_when_the_primary_is_slow():
+    calls = hedger()
+    attempts = Attempts(1.0, 0.0)
+
+    start = time.monotonic()
+    assert calls.call('narrative', attempts) == 1
+    assert time.monotonic() - start < 0.5
+    # The losing primary is told to give up
+    assert attempts.started[0].is_set()
+    assert calls.stats()['hedged'] == 1
+    assert calls.stats()['hedge_wins'] == 1
+    calls.close()
+
+def test_fast_calls_are_not_hedged():
+    calls = hedger()
+    attempts = Attempts(0.0)
+
+    assert calls.call('narrative', attempts) == 0
+    assert len(attempts.started) == 1
+    assert calls.stats()['hedged'] == 0
+    calls.close()
+
+def test_budget_caps_hedges():
+    calls = hedger(budget=HedgeBudget(ratio=0.0, burst=1))
+
+    assert calls.call('narrative', Attempts(0.2, 0.0)) == 1
+    second = Attempts(0.2, 0.0)
+    assert calls.call('narrative', second) == 0
+    assert len(second.started) == 1
+    stats = calls.stats()
+    assert stats['hedged'] == 1
+    assert stats['budget_denied'] == 1
+    calls.close()
+
+def test_budget_is_earned_per_call():
+    budget = HedgeBudget(ratio=0.25, burst=1)
+    budget.try_spend()
+    for _ in range(3):
+        budget.earn()
+    assert not budget.try_spend()
+    budget.earn()
+    assert budget.try_spend()
+
+def test_veto_skips_the_hedge():
+    calls = hedger()
+    attempts = Attempts(0.2, 0.0)
+
+    assert calls.call('narrative', attempts, can_hedge=lambda: False) == 0
+    assert len(attempts.started) == 1
+    assert calls.stats()['hedged'] == 0
+    calls.close()
+
+def test_deadline_is_reported_with_the_per_call_value():
+    calls = hedger(budget=HedgeBudget(ratio=0.0, burst=0))
+    attempts = Attempts(5.0)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded, match=r"within 0\.2s \(narrative\)"):
+        calls.call('narrative', attempts, deadline=0.2)
+    assert time.monotonic() - start < 1.0
+    assert attempts.started[0].is_set()
+    assert calls.stats()['deadline_exceeded'] == 1
+    calls.close()
+
+def test_errors_are_raised_when_no_attempt_succeeds():
+    calls = hedger()
+
+    def fail(deadline_at, cancelled):
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError, match="bad request"):
+        calls.call('narrative', fail)
+    calls.close()
+
+def test_hedge_delay_follows_recent_latency():
+    tracker = LatencyTracker(min_samples=5)
+    calls = Hedger(deadline=2, quantile=0.9, min_delay=0.01, tracker=tracker)
+    assert calls.delay('narrative') == 0.01
+
+    for seconds in (0.1, 0.2, 0.3, 0.4, 0.5):
+        tracker.observe('narrative', seconds)
+    assert calls.delay('narrative') == 0.5
+    assert calls.delay('analysis') == 0.01
+    calls.close()
+
+def test_hedging_is_off_by_default(monkeypatch):
+    monkeypatch.delenv('GEMINI_HEDGE', raising=False)
+    calls = Hedger(workers=2, deadline=2, min_delay=0.01, budget=HedgeBudget(ratio=0.0, burst=1))
+    assert not calls.enabled
+
+    attempts = Attempts(0.2, 0.0)
+    assert calls.call('narrative', attempts) == 0
+    assert len(attempts.started) == 1
+    assert calls.stats()['hedged'] == 0
+    calls.close()
@@ -0,0 +1,13 @@
+import main
+from data_processor import DataProcessor
+
+class BrokenSheet(DataProcessor):
+    def load_data(self):
+        raise RuntimeError("Sheets API unavailable")
+
+def test_load_failure_returns_an_empty_result_list(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TRANSCRIBE', 'off')
+    monkeypatch.setattr(main, 'DataProcessor', BrokenSheet)
+
+    assert main.generate_reports(dry_run=True) == []
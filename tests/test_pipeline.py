@@ -0,0 +1,75 @@
+import time
+import random
+import threading
+from pipeline import Pipeline, Stage, in_order
+
+def test_in_order_releases_items_as_soon_as_their_turn_comes():
+    arrivals = iter([1, 0, 2, 4, 3])
+    seen = []
+
+    def source():
+        for item in arrivals:
+            seen.append(item)
+            yield item
+
+    ordered = in_order(source(), key=lambda item: item)
+    assert next(ordered) == 0
+    assert seen == [1, 0]
+    assert next(ordered) == 1
+    assert next(ordered) == 2
+    assert seen == [1, 0, 2]
+    assert list(ordered) == [3, 4]
+
+def test_in_order_yields_items_after_a_gap_at_the_end():
+    assert list(in_order([3, 0, 2], key=lambda item: item)) == [0, 2, 3]
+
+def test_pipeline_output_can_be_restored_to_input_order():
+    rng = random.Random(0)
+    delays = [rng.uniform(0, 0.01) for _ in range(40)]
+
+    def work(index):
+        time.sleep(delays[index])
+        return index
+
+    pipeline = Pipeline([Stage('work', work, workers=4)], monitor_interval=0)
+    finished = list(pipeline.run(iter(range(40))))
+    assert sorted(finished) == list(range(40))
+    assert finished != list(range(40))
+
+    pipeline = Pipeline([Stage('work', work, workers=4)], monitor_interval=0)
+    assert list(in_order(pipeline.run(iter(range(40))), key=lambda item: item)) == list(range(40))
+
+def test_slow_stage_blocks_the_source_at_queue_size():
+    release = threading.Event()
+    pulled = []
+
+    def source():
+        for item in range(20):
+            pulled.append(item)
+            yield item
+
+    def slow(item):
+        release.wait(5)
+        return item
+
+    first, second = Stage('fast', lambda item: item), Stage('slow', slow)
+    pipeline = Pipeline([first, second], queue_size=2, monitor_interval=0)
+    finished = pipeline.run(source())
+    # run() is a generator, so the consumer thread starts the pipeline
+    results = []
+    consumer = threading.Thread(target=lambda: results.extend(finished))
+    consumer.start()
+
+    # 'slow' works on 0 with 1-2 queued, 'fast' is blocked handing on 3 with 4-5
+    # queued, and the feeder is blocked on 6: nothing more is read from the source
+    deadline = time.monotonic() + 5
+    while not (second.inbox is not None and second.inbox.full() and first.inbox.full()
+               and len(pulled) >= 7) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(pulled) == 7
+    assert second.inbox.full() and first.inbox.full()
+
+    release.set()
+    consumer.join(5)
+    assert sorted(results) == list(range(20))
+    assert pipeline.stats()['fast']['blocked_seconds'] > 0
@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import pytest
+from privacy_manager import PrivacyManager
+
+@pytest.fixture
+def privacy(tmp_path):
+    manager = PrivacyManager(index_path=str(tmp_path / 'retention.db'), retention_hours=24,
+                             audit_path=str(tmp_path / 'deletion.log'))
+    yield manager
+    manager.close()
+
+def touch(path, age_hours=0):
+    path.write_bytes(b'student data')
+    stamp = time.time() - age_hours * 3600
+    os.utime(path, (stamp, stamp))
+    return path
+
+def audit(tmp_path):
+    with open(tmp_path / 'deletion.log') as f:
+        return [json.loads(line) for line in f]
+
+def test_sweep_deletes_only_expired_files(tmp_path, privacy):
+    old = touch(tmp_path / 'old_report.pdf')
+    new = touch(tmp_path / 'new_report.pdf')
+    privacy.register(str(old), kind='report', student_id=101, created_at=time.time() - 25 * 3600)
+    privacy.register(str(new), kind='report', student_id=102)
+
+    assert privacy.sweep() == 1
+
+    assert not old.exists() and new.exists()
+    record, = audit(tmp_path)
+    assert record['path'] == os.path.normpath(str(old))
+    assert record['kind'] == 'report'
+    assert record['result'] == 'deleted'
+    # Only the masked ID is logged
+    assert record['student'] == privacy.mask_student_id(101)
+    assert privacy.stats()['tracked'] == 1
+
+def test_missing_files_are_audited_as_missing(tmp_path, privacy):
+    gone = tmp_path / 'gone.pdf'
+    privacy.register(str(gone), created_at=time.time() - 25 * 3600)
+
+    assert privacy.sweep() == 0
+
+    record, = audit(tmp_path)
+    assert record['result'] == 'missing'
+    assert privacy.stats()['tracked'] == 0
+
+def test_discovered_files_are_dated_when_first_indexed(tmp_path, privacy):
+    audio = tmp_path / 'teacher_audio'
+    audio.mkdir()
+    # Copied in with an mtime from last week
+    clip = touch(audio / '101.wav', age_hours=24 * 7)
+
+    assert privacy.discover({str(audio): 'audio'}) == 1
+    assert privacy.sweep() == 0
+    assert clip.exists()
+    assert privacy.sweep(now=time.time() + 25 * 3600) == 1
+    assert not clip.exists()
+
+def test_discover_skips_unchanged_folders_and_keeps_dates(tmp_path, privacy):
+    reports = tmp_path / 'reports'
+    reports.mkdir()
+    report = touch(reports / '101_report.pdf')
+    expires = time.time() + 3600
+    privacy.register(str(report), kind='report', created_at=expires - 24 * 3600)
+
+    # Already registered: its expiry is left alone
+    assert privacy.discover({str(reports): 'report'}) == 0
+    scanned = os.stat(reports).st_mtime
+
+    # A folder whose mtime has not changed is not listed again
+    touch(reports / '102_report.pdf')
+    os.utime(reports, (scanned, scanned))
+    assert privacy.discover({str(reports): 'report'}) == 0
+
+    os.utime(reports, (scanned + 10, scanned + 10))
+    assert privacy.discover({str(reports): 'report'}) == 1
+    assert privacy.sweep(now=expires + 1) == 1
+    assert not report.exists()
+    assert (reports / '102_report.pdf').exists()
@@ -0,0 +1,56 @@
+import shutil
+import pytest
+from fakes import FakeGeminiModel
+from prompt_registry import PROMPT_DIR, PromptRegistry, get_registry
+from report_generator import ReportGenerator
+from response_cache import ResponseCache
+
+@pytest.fixture
+def prompts(tmp_path, monkeypatch):
+    """Editable copy of prompts/ used by every new ReportGenerator"""
+    directory = tmp_path / 'prompts'
+    shutil.copytree(PROMPT_DIR, directory)
+    monkeypatch.setenv('PROMPT_DIR', str(directory))
+    get_registry.cache_clear()
+    yield directory
+    get_registry.cache_clear()
+
+def edit(path):
+    path.write_text(path.read_text(encoding='utf-8') + '\nBe concise.', encoding='utf-8')
+    get_registry.cache_clear()
+
+def prompt_version(**kwargs):
+    return ReportGenerator(model=FakeGeminiModel(), cache=ResponseCache(mode='off'), **kwargs).prompt_version
+
+def test_render_fills_fields_and_keeps_other_braces():
+    registry = PromptRegistry(PROMPT_DIR)
+    prompt = registry.render('analysis', subject_scores={'Math': [80, 70]})
+
+    assert '{"Math":[80,70]}' in prompt
+    with pytest.raises(ValueError):
+        registry.render('analysis')
+
+def test_unused_prompts_do_not_change_the_report_fingerprint(prompts, monkeypatch):
+    monkeypatch.setenv('GEMINI_BATCH_SIZE', '1')
+    before = prompt_version()
+
+    edit(prompts / 'whisper_prompt.txt')
+    edit(prompts / 'narrative_batch_prompt.txt')
+    edit(prompts / 'structured_prompt.txt')
+    edit(prompts / 'analysis_prompt.txt')
+    assert prompt_version() == before
+
+    edit(prompts / 'narrative_prompt.txt')
+    assert prompt_version() != before
+
+def test_fingerprint_follows_the_modes_in_use(prompts, monkeypatch):
+    monkeypatch.setenv('GEMINI_BATCH_SIZE', '4')
+    batched = prompt_version(analysis_mode='llm', narrative_format='structured')
+
+    edit(prompts / 'analysis_batch_prompt.txt')
+    assert prompt_version(analysis_mode='llm', narrative_format='structured') != batched
+    batched = prompt_version(analysis_mode='llm', narrative_format='structured')
+    edit(prompts / 'narrative_batch_prompt.txt')
+    assert prompt_version(analysis_mode='llm', narrative_format='structured') == batched
+    edit(prompts / 'structured_batch_prompt.txt')
+    assert prompt_version(analysis_mode='llm', narrative_format='structured') != batched
@@ -0,0 +1,127 @@
+import time
+import threading
+from fakes import FakeThrottle
+from rate_limiter import AdaptiveRateLimiter, is_throttle, retry_after
+
+class Clock:
+    """Manually advanced stand-in for time.monotonic"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def limiter(clock=None, max_concurrency=8):
+    return AdaptiveRateLimiter(rpm=1000000, tpm=1000000, max_concurrency=max_concurrency,
+                               clock=clock or Clock())
+
+def succeed(limiter, times):
+    for _ in range(times):
+        limiter.release(limiter.acquire(10), used=10)
+
+def test_throttle_halves_concurrency_and_pauses_every_caller():
+    clock = Clock()
+    gemini = limiter(clock)
+    assert gemini.limit == 4
+
+    gemini.release(gemini.acquire(10), outcome='throttled', delay=5)
+
+    assert gemini.limit == 2
+    assert gemini.paused
+    assert gemini.stats()['paused_for'] == 5
+    clock.now = 5.01
+    assert not gemini.paused
+
+def test_repeated_throttles_back_off_to_the_floor_with_growing_pauses():
+    clock = Clock()
+    gemini = limiter(clock)
+    pauses = []
+    for _ in range(4):
+        gemini.release(gemini.acquire(10), outcome='throttled')
+        pauses.append(gemini.stats()['paused_for'])
+        clock.now += pauses[-1] + 0.01
+
+    assert gemini.limit == 1
+    assert gemini.throttles == 4
+    # min(60, 2**n) seconds, jittered down by up to half
+    for n, pause in enumerate(pauses, start=1):
+        assert 2 ** n / 2 <= pause <= 2 ** n
+
+def test_successes_grow_concurrency_one_step_per_window():
+    clock = Clock()
+    gemini = limiter(clock)
+    gemini.release(gemini.acquire(10), outcome='throttled', delay=1)
+    clock.now = 1.0
+    assert gemini.limit == 2
+
+    # Additive increase: a full window of `limit` successes adds one slot
+    succeed(gemini, 1)
+    assert gemini.limit == 2
+    succeed(gemini, 1)
+    assert gemini.limit == 3
+    succeed(gemini, 3)
+    assert gemini.limit == 4
+
+    succeed(gemini, 4 + 5 + 6 + 7 + 50)
+    assert gemini.limit == 8
+    assert gemini.stats()['completed'] == 2 + 3 + 4 + 5 + 6 + 7 + 50
+
+def test_plain_errors_leave_the_limit_alone():
+    gemini = limiter()
+    gemini.release(gemini.acquire(10), outcome='error')
+
+    assert gemini.limit == 4
+    assert not gemini.paused
+
+def test_callers_queue_while_the_limit_is_in_flight():
+    gemini = AdaptiveRateLimiter(rpm=1000000, tpm=1000000, max_concurrency=2)
+    held = [gemini.acquire(1), gemini.acquire(1)]
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (gemini.acquire(1), acquired.set()))
+    waiter.start()
+
+    time.sleep(0.05)
+    assert not acquired.is_set()
+    assert gemini.stats()['queue_depth'] == 1
+
+    gemini.release(held.pop())
+    assert acquired.wait(1)
+    waiter.join(1)
+    assert gemini.in_flight == 2
+
+def test_token_budget_is_refunded_from_actual_usage():
+    gemini = AdaptiveRateLimiter(rpm=1000000, tpm=1000, clock=Clock())
+    reserved = gemini.acquire(800)
+    assert gemini.stats()['tokens_available'] == 200
+
+    gemini.release(reserved, used=300)
+    assert gemini.stats()['tokens_available'] == 700
+
+def test_fake_429_is_recognised_with_its_retry_after():
+    error = FakeThrottle(retry_after=3)
+
+    assert is_throttle(error)
+    assert retry_after(error) == 3
+    assert not is_throttle(ValueError("bad request"))
+    assert retry_after(ValueError("bad request")) is None
+
+def test_requests_are_uncapped_by_default(monkeypatch):
+    monkeypatch.delenv('GEMINI_RPM', raising=False)
+    clock = Clock()
+    gemini = AdaptiveRateLimiter(tpm=1000000, max_concurrency=1, clock=clock)
+    assert gemini.stats()['rpm_limit'] is None
+
+    # Far more than one request per second without the clock moving
+    succeed(gemini, 500)
+    assert gemini.completed == 500
+
+def test_rpm_cap_waits_for_the_bucket_to_refill():
+    clock = Clock()
+    gemini = AdaptiveRateLimiter(rpm=2, tpm=1000000, clock=clock)
+    succeed(gemini, 2)
+    assert gemini.stats()['requests_available'] == 0
+
+    clock.now = 30.0
+    assert gemini.stats()['requests_available'] == 1
+    succeed(gemini, 1)
@@ -0,0 +1,96 @@
+import time
+import pytest
+from fakes import FakeGeminiModel, FakeThrottle
+from hedging import DeadlineExceeded, Hedger
+from rate_limiter import AdaptiveRateLimiter
+from report_generator import ReportGenerator
+from response_cache import ResponseCache
+from schema import StudentRecord
+
+CONFIG = {"temperature": 0.0, "max_output_tokens": 100}
+
+class ThrottlingModel(FakeGeminiModel):
+    """Answers 429 (retry after 0s) to the first `throttles` calls"""
+
+    def __init__(self, throttles, **kwargs):
+        super().__init__(**kwargs)
+        self.throttles = throttles
+        self.attempts = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.attempts += 1
+        if self.attempts <= self.throttles:
+            raise FakeThrottle(retry_after=0.0)
+        return super().generate_content(prompt, **kwargs)
+
+def generator(model, deadline=2.0, max_attempts=3):
+    gen = ReportGenerator(
+        model=model,
+        cache=ResponseCache(mode='off'),
+        limiter=AdaptiveRateLimiter(rpm=1000000, max_concurrency=4),
+        hedger=Hedger(deadline=deadline, enabled=False)
+    )
+    gen.max_attempts = max_attempts
+    return gen
+
+def test_throttled_call_is_retried():
+    model = ThrottlingModel(throttles=2)
+    gen = generator(model)
+
+    response = gen._call_model('Write a report', CONFIG)
+
+    assert response.text
+    assert model.attempts == 3
+    assert gen.limiter.throttles == 2
+    # Halved on each 429 (4 -> 2 -> 1), then one success earns a slot back
+    assert gen.limiter.limit == 2
+    gen.hedger.close()
+
+def test_throttling_gives_up_after_max_attempts():
+    model = ThrottlingModel(throttles=10)
+    gen = generator(model, max_attempts=3)
+
+    with pytest.raises(FakeThrottle):
+        gen._call_model('Write a report', CONFIG)
+    assert model.attempts == 3
+    gen.hedger.close()
+
+def test_no_retry_once_the_deadline_has_passed():
+    # Each attempt takes 0.15s and is throttled; the second runs into the 0.2s deadline
+    model = FakeGeminiModel(latency=0.15, failure_rate=1.0, retry_after=0.0)
+    gen = generator(model, deadline=0.2, max_attempts=10)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        gen._call_model('Write a report', CONFIG)
+    assert time.monotonic() - start < 0.5
+    time.sleep(0.3)
+    assert model.calls == 2
+    gen.hedger.close()
+
+def test_deadline_falls_back_to_canned_narrative():
+    gen = generator(FakeGeminiModel(latency=1.0), deadline=0.1)
+    record = StudentRecord(101, 'Asha', 'en', 'standard', 'parent@example.com', 'Visual', {})
+
+    text = gen.generate_narrative(record, {"strengths": [], "improvements": [], "risks": []}, 'Visual', 'Well done')
+
+    assert 'Learning Style: Visual' in text
+    assert 'Well done' in text
+    assert gen.hedger.stats()['deadline_exceeded'] == 1
+    gen.hedger.close()
+
+def test_analysis_batches_use_the_analysis_output_budget(monkeypatch):
+    # 8192 output tokens: 54 structured narratives, but only 27 analyses, per request
+    monkeypatch.setenv('GEMINI_BATCH_SIZE', '100')
+    model = FakeGeminiModel()
+    gen = ReportGenerator(model=model, cache=ResponseCache(mode='off'), analysis_mode='llm',
+                          narrative_format='structured')
+    records = [StudentRecord(i, f'Student {i}', 'en', 'standard', '', 'Visual', {'Math': (80.0, 70.0, None)})
+               for i in range(gen.batch_limit())]
+    assert len(records) == 54
+
+    analyses = gen.analyze_scores_batch(records)
+
+    assert len(analyses) == 54 and all(analysis['strengths'] for analysis in analyses)
+    assert model.calls == 2
+    gen.hedger.close()
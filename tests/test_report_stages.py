@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from fakes import FakeGeminiModel
+from report_stages import ReportStages
+from manifest import BuildManifest
+from report_generator import ReportGenerator
+from response_cache import ResponseCache
+from schema import SchemaIndex, StudentRecord
+from transcription import Transcriber, TranscriptCache
+
+RECORD = StudentRecord(101, 'Asha', 'en', 'standard', 'parent@example.com', 'Visual', {'Math': (80.0, 70.0, None)})
+
+@pytest.fixture
+def workdir(tmp_path):
+    (tmp_path / 'teacher_audio').mkdir()
+    (tmp_path / 'reports').mkdir()
+    return tmp_path
+
+def transcriber(workdir):
+    t = Transcriber(backend='stub', workers=1, cache=TranscriptCache(str(workdir / 'transcripts.db')),
+                    directory=str(workdir / 'teacher_audio'))
+    t.start()
+    return t
+
+def plan(workdir, manifest, transcriber):
+    """The job ReportStages would queue for RECORD"""
+    stages = ReportStages(SimpleNamespace(transcriber=transcriber),
+                          ReportGenerator(model=FakeGeminiModel(), cache=ResponseCache(mode='off')),
+                          None, manifest=manifest, reports_dir=str(workdir / 'reports'))
+    jobs = next(stages.batches([RECORD]))
+    return jobs[0]
+
+def build(workdir, manifest, job):
+    pdf_path = workdir / 'reports' / '101_report.pdf'
+    pdf_path.write_bytes(b'%PDF-1.4')
+    manifest.record_render(RECORD.student_id, job.fingerprint, str(pdf_path), quote_key=job.quote_key)
+
+def test_recording_purged_by_retention_is_not_an_input_change(workdir):
+    clip = workdir / 'teacher_audio' / '101.wav'
+    clip.write_bytes(b'RIFF teacher feedback')
+    manifest = BuildManifest(str(workdir / 'manifest.db'))
+
+    first = transcriber(workdir)
+    job = plan(workdir, manifest, first)
+    quote = first.quote(RECORD.student_id)
+    first.close()
+    assert job.quote_key is not None and quote
+    build(workdir, manifest, job)
+
+    clip.unlink()
+    later = transcriber(workdir)
+    again = plan(workdir, manifest, later)
+
+    assert again.result['reused']
+    assert again.fingerprint == job.fingerprint
+    # A rebuild for any other reason still quotes the recording
+    assert later.quote(RECORD.student_id) == quote
+    later.close()
+    manifest.close()
+
+def test_new_recording_rebuilds_the_report(workdir):
+    clip = workdir / 'teacher_audio' / '101.wav'
+    clip.write_bytes(b'RIFF teacher feedback')
+    manifest = BuildManifest(str(workdir / 'manifest.db'))
+    first = transcriber(workdir)
+    job = plan(workdir, manifest, first)
+    first.close()
+    build(workdir, manifest, job)
+
+    clip.write_bytes(b'RIFF new teacher feedback')
+    later = transcriber(workdir)
+    again = plan(workdir, manifest, later)
+    later.close()
+
+    assert not again.result['reused']
+    assert again.quote_key != job.quote_key
+    manifest.close()
+
+def test_stream_builds_records_and_analyses_chunk_by_chunk():
+    df = pd.DataFrame({
+        'StudentID': list(range(1, 8)),
+        'StudentName': [f"Student {i}" for i in range(1, 8)],
+        'Math_P1': [50.0 + i for i in range(7)],
+        'Math_P2': [60.0] * 7,
+    })
+    report_gen = ReportGenerator(model=FakeGeminiModel(), cache=ResponseCache(mode='off'))
+    chunks = []
+    analyze_cohort = report_gen.analyze_cohort
+    report_gen.analyze_cohort = lambda chunk, schema: chunks.append(len(chunk)) or analyze_cohort(chunk, schema)
+    stages = ReportStages(SimpleNamespace(schema=SchemaIndex.from_columns(df.columns)), report_gen, None)
+
+    batches = stages.stream(df, chunk_rows=3)
+    assert chunks == []
+    first = next(batches)
+    assert chunks == [3]
+    jobs = first + [job for batch in batches for job in batch]
+
+    assert chunks == [3, 3, 1]
+    assert [job.index for job in jobs] == list(range(7))
+    assert [job.record.student_id for job in jobs] == list(range(1, 8))
+    assert [job.analysis for job in jobs] == [report_gen.analyze_scores(job.record) for job in jobs]
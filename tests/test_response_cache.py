@@ -0,0 +1,97 @@
+import os
+import time
+import json
+import threading
+import pytest
+from response_cache import ResponseCache
+
+def cache(tmp_path, **kwargs):
+    kwargs.setdefault('mode', 'on')
+    return ResponseCache(cache_dir=str(tmp_path / 'gemini'), **kwargs)
+
+def age(cache, key, seconds):
+    """Pretend the entry was written (and last read) `seconds` ago"""
+    stamp = time.time() - seconds
+    os.utime(cache._path(key), (stamp, stamp))
+
+def entries(tmp_path):
+    return sorted(name for _, _, files in os.walk(tmp_path / 'gemini') for name in files)
+
+def test_hit_and_miss(tmp_path):
+    responses = cache(tmp_path)
+    key = ResponseCache.make_key('gemini-1.5-flash', {'temperature': 0.2}, 'Write a report')
+
+    assert responses.get(key) is None
+    responses.set(key, 'A fine term')
+    assert responses.get(key) == 'A fine term'
+    # Any change to model, config or prompt is a different entry
+    assert responses.get(ResponseCache.make_key('gemini-1.5-flash', {'temperature': 0.3}, 'Write a report')) is None
+    assert responses.stats() == {'hits': 1, 'misses': 2, 'writes': 1, 'mode': 'on'}
+
+@pytest.mark.parametrize('written, hit', [(3599, True), (3601, False)])
+def test_entries_expire_after_the_ttl(tmp_path, written, hit):
+    responses = cache(tmp_path, ttl_seconds=3600)
+    responses.set('ab' * 32, 'text')
+    age(responses, 'ab' * 32, written)
+
+    assert (responses.get('ab' * 32) == 'text') is hit
+    assert bool(entries(tmp_path)) is hit
+
+def test_reads_do_not_extend_the_ttl(tmp_path, monkeypatch):
+    responses = cache(tmp_path, ttl_seconds=3600)
+    responses.set('ab' * 32, 'text')
+    age(responses, 'ab' * 32, 3000)
+    assert responses.get('ab' * 32) == 'text'
+
+    # Ten minutes later the entry is past its TTL for evict() just as for get()
+    later = time.time() + 600
+    monkeypatch.setattr(time, 'time', lambda: later)
+    responses.evict()
+    assert entries(tmp_path) == []
+
+def test_refresh_mode_ignores_but_replaces_entries(tmp_path):
+    cache(tmp_path).set('ab' * 32, 'old')
+    refreshing = cache(tmp_path, mode='refresh')
+
+    assert refreshing.get('ab' * 32) is None
+    refreshing.set('ab' * 32, 'new')
+    assert cache(tmp_path).get('ab' * 32) == 'new'
+
+def test_off_mode_neither_reads_nor_writes(tmp_path):
+    off = cache(tmp_path, mode='off')
+    off.set('ab' * 32, 'text')
+    assert off.get('ab' * 32) is None
+    assert entries(tmp_path) == []
+
+def test_eviction_drops_least_recently_read_down_to_max_size(tmp_path):
+    responses = cache(tmp_path, max_bytes=10 ** 6)
+    keys = [f'{i:02d}' * 32 for i in range(4)]
+    for i, key in enumerate(keys):
+        responses.set(key, 'x' * 1000)
+        age(responses, key, 400 - i * 100)
+    # The oldest write was read most recently
+    assert responses.get(keys[0]) == 'x' * 1000
+
+    responses.max_bytes = sum(os.path.getsize(responses._path(key)) for key in (keys[0], keys[3]))
+    assert responses.evict() == 2
+    assert entries(tmp_path) == sorted(f'{key}.json' for key in (keys[0], keys[3]))
+
+def test_concurrent_writes_of_one_key_leave_one_whole_entry(tmp_path):
+    responses = cache(tmp_path)
+    barrier = threading.Barrier(8)
+
+    def write(n):
+        barrier.wait()
+        for _ in range(20):
+            responses.set('ab' * 32, f'response {n} ' * 200)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert entries(tmp_path) == ['ab' * 32 + '.json']
+    with open(responses._path('ab' * 32), encoding='utf-8') as f:
+        text = json.load(f)['text']
+    assert text in {f'response {n} ' * 200 for n in range(8)}
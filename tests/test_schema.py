@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+from schema import SchemaIndex
+
+def frame(**columns):
+    return pd.DataFrame({'StudentID': [101, 102], **columns})
+
+def test_subject_names_may_contain_underscores():
+    schema = SchemaIndex.from_columns(['StudentID', 'Social_Studies_C', 'Social_Studies_P1', 'Math_C', 'Math_P2',
+                                       'Art_P1', 'Math_Notes', 'VARK_Q2', 'VARK_Q10', 'VARK_Q1'])
+
+    assert schema.subjects == {
+        'Social_Studies': {'C': 'Social_Studies_C', 'P1': 'Social_Studies_P1'},
+        'Math': {'C': 'Math_C', 'P2': 'Math_P2'},
+    }
+    # Art has no current score; Math_Notes is not a period column
+    assert schema.vark_columns == ['VARK_Q1', 'VARK_Q2', 'VARK_Q10']
+
+def test_blank_and_non_numeric_cells_are_missing_scores():
+    df = frame(Math_C=[85, ''], Math_P1=['72.5', 'absent'], Math_P2=[None, 60])
+    schema = SchemaIndex.from_columns(df.columns)
+
+    first, second = schema.records(df)
+
+    assert first.scores == {'Math': (85.0, 72.5, None)}
+    assert second.scores == {'Math': (None, None, 60.0)}
+    assert first.subject_scores == {'Math': [85.0, 72.5]}
+    assert second.subject_scores == {}
+
+def test_records_fill_text_defaults():
+    df = frame(StudentName=['Asha', None], LangPref=['hi', np.nan], ContactEmail=['a@example.com', ''])
+    first, second = SchemaIndex.from_columns(df.columns).records(df)
+
+    assert (first.name, first.lang, first.acc_pref, first.email) == ('Asha', 'hi', 'standard', 'a@example.com')
+    assert (second.name, second.lang, second.email) == ('Student', 'en', '')
+
+@pytest.mark.parametrize('answers, style', [
+    (['A', 'A', 'B', 'C'], 'Visual'),
+    (['d', ' D ', 'B', 'C'], 'Kinesthetic'),   # case and whitespace are ignored
+    (['B', 'C', 'C', 'B'], 'Aural'),           # tie: the earlier letter
+    (['D', 'C', 'B', 'A'], 'Visual'),
+    (['C', 'D', 'D', 'C'], 'Read/Write'),
+    (['X', '', None, 'nan'], 'Visual'),        # nothing valid: the default
+])
+def test_vark_profile_is_the_most_frequent_answer(answers, style):
+    df = pd.DataFrame([answers], columns=[f'VARK_Q{i}' for i in range(1, 5)])
+    assert SchemaIndex.from_columns(df.columns).vark_profiles(df).tolist() == [style]
+
+def test_no_vark_columns_gives_the_default_style():
+    df = frame(Math_C=[80, 90])
+    assert SchemaIndex.from_columns(df.columns).vark_profiles(df).tolist() == ['Visual', 'Visual']
+
+def test_compact_stores_float32_and_categories_but_records_stay_plain():
+    df = frame(Math_C=['72.3', ''], Math_P1=[68, 'absent'], LangPref=['hi', 'en'], AccPref=['dyslexic', 'standard'],
+               VARK_Q1=['A', 'B'], StudentName=['Asha', 'Ben'])
+    schema = SchemaIndex.from_columns(df.columns)
+
+    compact = schema.compact(df)
+
+    assert compact['Math_C'].dtype == np.float32
+    assert compact['LangPref'].dtype == 'category'
+    assert compact['VARK_Q1'].dtype == 'category'
+    # Free text is left alone
+    assert compact['StudentName'].dtype == object
+    first, second = schema.records(compact)
+    # float32 storage error is rounded away before any maths
+    assert first.scores == {'Math': (72.3, 68.0, None)}
+    assert second.scores == {'Math': (None, None, None)}
+    assert (first.lang, first.acc_pref) == ('hi', 'dyslexic')
+    assert type(first.lang) is str and type(second.acc_pref) is str
+    assert first.vark == 'Visual' and second.vark == 'Aural'
+
+def test_compact_does_not_change_the_caller_frame():
+    df = frame(Math_C=[80, 90], LangPref=['en', 'hi'])
+    SchemaIndex.from_columns(df.columns).compact(df)
+    assert df['Math_C'].dtype == np.int64
+    assert df['LangPref'].dtype == object
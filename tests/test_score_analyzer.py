@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+from score_analyzer import ScoreAnalyzer
+from schema import StudentRecord
+
+nan = np.nan
+
+def analyze(**subjects):
+    """Analysis of one student with {subject: (C, P1, P2)} scores"""
+    return ScoreAnalyzer().analyze_array(list(subjects), np.array([list(subjects.values())], dtype=float))[0]
+
+def trends(analysis):
+    return {item['subject']: item['trend'] for item in analysis['improvements']}
+
+def drops(analysis):
+    return {item['subject']: item['drop'] for item in analysis['risks']}
+
+@pytest.mark.parametrize('scores, trend', [
+    ((90, 80, 60), 50.0),     # against P2, the oldest
+    ((90, 60, nan), 50.0),    # P2 missing: against P1
+    ((90, nan, 60), 50.0),    # P1 missing: still against P2
+    ((66, 60, nan), 10.0),
+])
+def test_trend_is_against_the_oldest_score(scores, trend):
+    assert trends(analyze(Math=scores)) == {'Math': trend}
+
+@pytest.mark.parametrize('scores', [
+    (90, nan, nan),           # nothing to compare with
+    (nan, 80, 60),            # no current score
+])
+def test_no_analysis_without_a_comparison(scores):
+    assert analyze(Math=scores) == {'strengths': [], 'improvements': [], 'risks': []}
+
+def test_no_trend_from_a_zero_score():
+    analysis = analyze(Math=(90, 0, nan))
+    assert trends(analysis) == drops(analysis) == {}
+    assert analysis['strengths'][0]['subject'] == 'Math'
+
+@pytest.mark.parametrize('current, risk', [
+    (85, False),              # exactly -15%: not a risk
+    (84.9, True),
+    (86, False),
+])
+def test_risk_threshold_is_a_drop_of_more_than_15_percent(current, risk):
+    assert bool(drops(analyze(Math=(current, 100, nan)))) is risk
+
+@pytest.mark.parametrize('subjects, top', [
+    ({'Math': (80, 70, nan), 'Science': (90, 85, nan)}, 'Science'),
+    # Same mean (80): the steadier subject wins
+    ({'Math': (90, 70, nan), 'Science': (80, 80, nan)}, 'Science'),
+    ({'Science': (80, 80, nan), 'Math': (90, 70, nan)}, 'Science'),
+    # A higher mean beats a smaller spread
+    ({'Math': (95, 70, nan), 'Science': (80, 80, nan)}, 'Math'),
+    # Subjects without a comparison cannot be the strength
+    ({'Math': (100, nan, nan), 'Science': (60, 50, nan)}, 'Science'),
+])
+def test_top_strength_by_mean_then_spread(subjects, top):
+    strength, = analyze(**subjects)['strengths']
+    assert strength['subject'] == top
+
+def test_evidence_and_ordering():
+    analysis = analyze(Math=(60, 80, nan), Science=(40, 80, nan), Art=(60, 50, nan), Music=(90, 60, nan))
+
+    assert analysis['strengths'] == [{'subject': 'Music', 'evidence': 'Average score 75.0 across 2 assessments (latest 90)'}]
+    assert list(trends(analysis)) == ['Music', 'Art']
+    assert list(drops(analysis)) == ['Science', 'Math']
+
+def test_frame_with_blank_cells_and_missing_columns():
+    # No Science_P1/P2 columns, a blank and a non-numeric cell
+    df = pd.DataFrame({
+        'StudentID': [1, 2, 3],
+        'Math_C': [90, '', 'absent'],
+        'Math_P1': [60, 70, 70],
+        'Science_C': [80, 75, 70],
+    })
+
+    analyses = ScoreAnalyzer().analyze_frame(df)
+
+    assert trends(analyses[0]) == {'Math': 50.0}
+    assert analyses[1] == analyses[2] == {'strengths': [], 'improvements': [], 'risks': []}
+
+def test_record_matches_array():
+    record = StudentRecord(1, 'Asha', 'en', 'standard', '', 'Visual',
+                           {'Math': (90.0, 60.0, None), 'Science': (50.0, None, 80.0)})
+
+    assert ScoreAnalyzer().analyze_record(record) == analyze(Math=(90, 60, nan), Science=(50, nan, 80))
+    assert drops(ScoreAnalyzer(risk_threshold=40).analyze_record(record)) == {}
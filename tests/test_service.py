@@ -0,0 +1,177 @@
+import dataclasses
+import threading
+from concurrent.futures import Future
+import pytest
+import service as service_module
+from data_processor import DataProcessor
+from fakes import FakeGeminiModel, FakeSMTP
+from manifest import BuildManifest
+from pdf_engine import PDFEngine
+from privacy_manager import PrivacyManager
+from report_generator import ReportGenerator
+from response_cache import ResponseCache
+from service import ReportService, create_app
+from smtp_pool import SMTPPool
+
+class GatedGemini(FakeGeminiModel):
+    """Fake Gemini whose calls signal `entered` and then wait for `release`"""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate_content(self, *args, **kwargs):
+        self.entered.set()
+        self.release.wait(10)
+        return super().generate_content(*args, **kwargs)
+
+class WatchedFuture(Future):
+    """Future that counts the requests waiting on another request's build"""
+    waiting = None
+
+    def result(self, timeout=None):
+        WatchedFuture.waiting.release()
+        return super().result(timeout)
+
+@pytest.fixture
+def smtp():
+    return FakeSMTP()
+
+@pytest.fixture
+def service(tmp_path, monkeypatch, smtp):
+    """ReportService over the offline sample cohort with a gated fake Gemini"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TRANSCRIBE_BACKEND', 'stub')
+    monkeypatch.setenv('TRANSCRIPT_CACHE_PATH', str(tmp_path / 'transcripts.db'))
+    monkeypatch.setenv('SERVICE_REPORTS_DIR', str(tmp_path / 'reports'))
+    monkeypatch.setattr(service_module, 'Future', WatchedFuture)
+    monkeypatch.setattr(WatchedFuture, 'waiting', threading.Semaphore(0))
+    (tmp_path / 'teacher_audio').mkdir()
+    (tmp_path / 'teacher_audio' / '101.wav').write_bytes(b'RIFF teacher feedback')
+    svc = ReportService(
+        processor=DataProcessor(offline=True),
+        report_gen=ReportGenerator(model=GatedGemini(), cache=ResponseCache(mode='off')),
+        pdf_engine=PDFEngine(smtp_pool=SMTPPool(connection_factory=lambda: smtp, size=1)),
+        manifest=BuildManifest(str(tmp_path / 'manifest.db')),
+        privacy=PrivacyManager(index_path=str(tmp_path / 'retention.db'), audit_path=str(tmp_path / 'deletion.log'))
+    )
+    svc.refresh()
+    yield svc
+    svc.close()
+
+def while_building(service, first, *others):
+    """Run `first`, then `others` once it is inside Gemini; `first` finishes only after all of them wait on it"""
+    model = service.report_gen.model
+    model.release.clear()
+    results = [None] * (1 + len(others))
+
+    def run(i, call):
+        results[i] = call()
+
+    threads = [threading.Thread(target=run, args=(0, first))]
+    threads[0].start()
+    assert model.entered.wait(10)
+    for i, call in enumerate(others, 1):
+        threads.append(threading.Thread(target=run, args=(i, call)))
+        threads[-1].start()
+    for _ in others:
+        assert WatchedFuture.waiting.acquire(timeout=10)
+    model.release.set()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def test_concurrent_requests_share_one_build(service):
+    results = while_building(service, *[lambda: service.report('101')] * 6)
+
+    assert all(result['status'] == 'ok' for result in results)
+    assert sum(not result['coalesced'] for result in results) == 1
+    assert service.report_gen.model.calls == 1
+    assert service.stats()['coalesced'] == 5
+
+def test_deliver_request_is_not_swallowed_by_a_plain_build(service, smtp):
+    plain, delivering = while_building(service, lambda: service.report('101'),
+                                       lambda: service.report('101', deliver=True))
+
+    assert not plain['delivered']
+    assert delivering['delivered'] and not delivering['coalesced']
+    # The delivering request reused the report the plain one had just built
+    assert delivering['reused']
+    assert service.report_gen.model.calls == 1
+    assert len(smtp.sent) == 1
+
+def test_forced_request_rebuilds_after_a_plain_build(service):
+    plain, forced = while_building(service, lambda: service.report('101'),
+                                   lambda: service.report('101', force=True))
+
+    assert not plain['reused']
+    assert not forced['reused'] and not forced['coalesced']
+    assert service.report_gen.model.calls == 2
+
+def test_refresh_closes_the_old_transcriber_after_builds_using_it(service, monkeypatch):
+    old = service.processor.transcriber
+    closed = threading.Event()
+    close = old.close
+    monkeypatch.setattr(old, 'close', lambda: (close(), closed.set()))
+    model = service.report_gen.model
+    model.release.clear()
+
+    building = threading.Thread(target=service.report, args=('101',))
+    building.start()
+    assert model.entered.wait(10)
+    service.refresh()
+    assert service.processor.transcriber is not old
+    assert not closed.is_set()
+
+    model.release.set()
+    building.join(10)
+    assert closed.is_set()
+
+def test_failed_reload_keeps_the_previous_cohort(service, monkeypatch):
+    before = dict(service.records)
+
+    def broken(fallback=True):
+        assert not fallback
+        raise ConnectionError("Sheets API unavailable")
+    monkeypatch.setattr(service.processor, 'load_data', broken)
+
+    assert service.refresh() is False
+    assert service.records == before
+    assert service.stats()['refresh_failures'] == 1
+    assert service.report('101')['status'] == 'ok'
+
+def test_failed_sheet_load_raises_instead_of_using_sample_rows(monkeypatch):
+    class BrokenClient:
+        def open_by_key(self, key):
+            raise ConnectionError("Sheets API unavailable")
+
+    monkeypatch.setenv('GOOGLE_SHEETS_ID', 'sheet')
+    processor = DataProcessor(client=BrokenClient(), sync_mode='full')
+    assert len(processor.load_data()) == 2
+    with pytest.raises(ConnectionError):
+        processor.load_data(fallback=False)
+
+def test_get_serves_only_an_existing_pdf(service):
+    client = create_app(service).test_client()
+
+    missing = client.get('/reports/101')
+    assert missing.status_code == 404
+    assert service.report_gen.model.calls == 0
+    assert client.get('/reports/999').status_code == 404
+
+    assert client.post('/reports/101').status_code == 200
+    calls = service.report_gen.model.calls
+    response = client.get('/reports/101')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.headers['X-Report-Status'] == 'current'
+    assert service.report_gen.model.calls == calls
+
+    # The sheet changed since: the old PDF is still served, marked stale, and nothing is rebuilt
+    service.records['101'] = dataclasses.replace(service.records['101'], name='Johnny Doe')
+    response = client.get('/reports/101')
+    assert response.status_code == 200
+    assert response.headers['X-Report-Status'] == 'stale'
+    assert service.report_gen.model.calls == calls
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import subprocess
+import pandas as pd
+import pytest
+from shard import Shard, shard_of, merge_summaries
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IDS = list(range(100000, 102000)) + ['A-17', ' 42 ']
+
+def test_every_student_lands_in_exactly_one_shard():
+    shards = [Shard(k, 4) for k in range(1, 5)]
+    df = pd.DataFrame({'StudentID': IDS})
+
+    selected = [shard.select(df)['StudentID'].tolist() for shard in shards]
+
+    assert sorted(map(str, sum(selected, []))) == sorted(map(str, IDS))
+    # blake2b spreads the cohort roughly evenly
+    assert all(400 < len(ids) < 620 for ids in selected)
+
+def test_shard_of_is_stable_across_processes():
+    code = f"import shard; print([shard.shard_of(s, 7) for s in {IDS[:200]!r}])"
+    runs = {
+        subprocess.run([sys.executable, '-c', code], cwd=REPO, capture_output=True, text=True, check=True,
+                       env=dict(os.environ, PYTHONHASHSEED=seed)).stdout
+        for seed in ('1', '2')
+    }
+    assert runs == {f"{[shard_of(s, 7) for s in IDS[:200]]}\n"}
+    # The ID's type and padding do not matter
+    assert shard_of(42, 7) == shard_of('42', 7) == shard_of(' 42 ', 7)
+
+@pytest.mark.parametrize('spec', ['0/4', '5/4', '1/0', '-1/4', '2', 'a/b', '1/2/3'])
+def test_parse_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        Shard.parse(spec)
+
+def test_parse(tmp_path):
+    shard = Shard.parse('2/4', root=str(tmp_path))
+    assert (shard.index, shard.count) == (2, 4)
+    assert shard.path('reports') == os.path.join(str(tmp_path), 'shard-2-of-4', 'reports')
+
+def write_shard(root, index, count, students, failed, tokens):
+    metrics_dir = root / f'shard-{index}-of-{count}' / 'metrics'
+    metrics_dir.mkdir(parents=True)
+    summary = {
+        'started': f'2026-10-0{index}T08:00:00',
+        'duration_seconds': 10.0 * index,
+        'students': {'total': students, 'failed': len(failed), 'reused': 1},
+        'failed_students': failed,
+        'delivery': {'sent': students - len(failed), 'failed': 0, 'connections_opened': 1},
+        'gemini_tokens': {'narrative': {'version': 'abc', 'calls': students, 'input_tokens': 100 * students}},
+        'counters': [{'name': 'students_total', 'labels': {'status': 'ok'}, 'value': students}],
+        'histograms': [{'name': 'pipeline_run_seconds', 'labels': {}, 'count': 1, 'sum': 10.0 * index,
+                        'max': 10.0 * index}],
+        'shard': {'index': index, 'count': count},
+    }
+    (metrics_dir / 'run_summary.json').write_text(json.dumps(summary))
+    (metrics_dir / 'token_report.csv').write_text(
+        'prompt,calls\n' + ''.join(f'{name},{calls}\n' for name, calls in tokens))
+
+def test_merge_sums_counters_and_concatenates_token_reports(tmp_path):
+    write_shard(tmp_path, 1, 2, 5, ['101'], [('narrative', 5)])
+    write_shard(tmp_path, 2, 2, 7, ['202', '203'], [('narrative', 7), ('analysis', 1)])
+
+    merged = merge_summaries(str(tmp_path))
+
+    assert merged['shards'] == ['shard-1-of-2', 'shard-2-of-2']
+    assert merged['missing_shards'] == []
+    assert merged['students'] == {'total': 12, 'failed': 3, 'reused': 2}
+    assert merged['failed_students'] == ['101', '202', '203']
+    assert merged['delivery']['sent'] == 9
+    assert merged['gemini_tokens']['narrative'] == {'calls': 12, 'input_tokens': 1200}
+    assert merged['counters'] == [{'name': 'students_total', 'labels': {'status': 'ok'}, 'value': 12}]
+    histogram, = merged['histograms']
+    assert (histogram['count'], histogram['sum'], histogram['max']) == (2, 30.0, 20.0)
+    assert merged['duration_seconds'] == 20.0
+    assert merged['started'] == '2026-10-01T08:00:00'
+    assert (tmp_path / 'token_report.csv').read_text().splitlines() == [
+        'prompt,calls', 'narrative,5', 'narrative,7', 'analysis,1']
+
+def merge_cli(root, *args):
+    return subprocess.run([sys.executable, os.path.join(REPO, 'shard.py'), '--merge', '--root', str(root), *args],
+                          cwd=str(root), capture_output=True, text=True)
+
+def test_merge_cli_fails_when_a_shard_is_missing(tmp_path):
+    write_shard(tmp_path, 1, 3, 5, [], [('narrative', 5)])
+    write_shard(tmp_path, 3, 3, 4, ['301'], [('narrative', 4)])
+
+    missing = merge_cli(tmp_path)
+
+    assert missing.returncode == 1
+    assert 'shard-2-of-3' in missing.stderr
+    assert 'Failed students: 301' in missing.stdout
+    assert json.loads((tmp_path / 'run_summary.json').read_text())['missing_shards'] == ['shard-2-of-3']
+
+    write_shard(tmp_path, 2, 3, 6, [], [('narrative', 6)])
+    assert merge_cli(tmp_path, '--count', '3').returncode == 0
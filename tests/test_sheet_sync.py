@@ -0,0 +1,65 @@
+import pandas as pd
+from fakes import FakeWorksheet
+from sheet_sync import SheetSnapshot, SheetSync
+
+HEADER = ['StudentID', 'StudentName', 'Math_C']
+
+def worksheet(rows):
+    """FakeWorksheet over `rows`; None is an entirely blank sheet row"""
+    return FakeWorksheet(pd.DataFrame(
+        [row if row is not None else ['', '', ''] for row in rows], columns=HEADER, dtype=object
+    ))
+
+def cohort(ids):
+    return [[str(i), f"Student {i}", '80'] for i in ids]
+
+def sync(sheet, snapshot, batch_rows=3):
+    return SheetSync(sheet, snapshot=snapshot, batch_rows=batch_rows).sync()
+
+def test_blank_run_at_batch_boundary_does_not_end_the_scan():
+    # With 3-row batches, sheet rows 5-7 are one whole blank batch and
+    # rows 8-10 start with blanks; the trimmed reads come back short or empty
+    sheet = worksheet(cohort([1, 2, 3]) + [None] * 4 + cohort(range(10, 14)))
+    snapshot = SheetSnapshot(':memory:')
+
+    result = sync(sheet, snapshot)
+
+    assert result.changed_ids == ['1', '2', '3', '10', '11', '12', '13']
+    assert result.total == 7
+    assert result.deleted == []
+
+def test_rows_after_blanks_are_not_marked_deleted():
+    rows = cohort([1, 2, 3]) + [None] * 3 + cohort(range(10, 14))
+    snapshot = SheetSnapshot(':memory:')
+    sync(worksheet(rows), snapshot).commit()
+
+    rows[-1] = ['13', 'Student 13', '95']
+    result = sync(worksheet(rows), snapshot)
+
+    assert result.changed_ids == ['13']
+    assert result.deleted == []
+    assert len(snapshot.load_frame()) == 7
+
+def test_trailing_blank_rows_and_cells():
+    rows = cohort([1, 2]) + [['3', 'Student 3', '']] + [None] * 5
+    sheet = worksheet(rows)
+
+    records = list(SheetSync(sheet, snapshot=SheetSnapshot(':memory:'), batch_rows=2).iter_records())
+
+    assert [record['StudentID'] for record in records] == [1, 2, 3]
+    assert records[2]['Math_C'] == ''
+    assert records[0]['Math_C'] == 80
+
+def test_unchanged_rows_can_be_included():
+    rows = cohort([1, 2, 3])
+    snapshot = SheetSnapshot(':memory:')
+    sync(worksheet(rows), snapshot).commit()
+
+    rows[0] = ['1', 'Student 1', '95']
+    result = sync(worksheet(rows), snapshot)
+    # 3 has a new teacher recording; 1 is already changed and 9 is not on the sheet
+    assert result.include(['3', '1', '9']) == 1
+
+    assert result.changed_ids == ['1', '3']
+    assert result.frame()['StudentID'].tolist() == [1, 3]
+    assert result.student_ids == {'1', '2', '3'}
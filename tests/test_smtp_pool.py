@@ -0,0 +1,164 @@
+import socket
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+import pytest
+from fakes import FakeSMTP
+from smtp_pool import SMTPPool
+
+def message(recipient):
+    msg = EmailMessage()
+    msg['From'] = 'school@example.com'
+    msg['To'] = recipient
+    msg['Subject'] = 'Progress report'
+    msg.set_content('Report attached')
+    return msg
+
+class DroppingSMTP(FakeSMTP):
+    """Closes the session after `limit` messages, like a server idle timeout"""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def send_message(self, msg):
+        if len(self.sent) >= self.limit:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        super().send_message(msg)
+
+class Servers:
+    """connection_factory that remembers every session it opened"""
+
+    def __init__(self, make=FakeSMTP):
+        self.make = make
+        self.opened = []
+
+    def __call__(self):
+        self.opened.append(self.make())
+        return self.opened[-1]
+
+    @property
+    def sent(self):
+        return [recipient for server in self.opened for recipient in server.sent]
+
+def test_sequential_sends_reuse_one_session():
+    servers = Servers()
+    with SMTPPool(connection_factory=servers, size=2) as pool:
+        results = [pool.send(message(f"parent{i}@example.com")) for i in range(10)]
+
+    assert all(result.ok for result in results)
+    assert len(servers.opened) == 1
+    assert pool.connections_opened == 1
+    assert servers.sent == [f"parent{i}@example.com" for i in range(10)]
+
+def test_session_is_replaced_after_max_messages():
+    servers = Servers()
+    with SMTPPool(connection_factory=servers, size=1, max_messages_per_connection=3) as pool:
+        for i in range(10):
+            pool.send(message(f"parent{i}@example.com"))
+
+    assert [len(server.sent) for server in servers.opened] == [3, 3, 3, 1]
+    assert pool.summary()['sent'] == 10
+
+def test_reconnects_after_server_disconnect():
+    servers = Servers(lambda: DroppingSMTP(limit=2))
+    with SMTPPool(connection_factory=servers, size=1) as pool:
+        results = [pool.send(message(f"parent{i}@example.com")) for i in range(5)]
+
+    assert all(result.ok for result in results)
+    # The 3rd and 5th messages found their session dropped and were resent on a new one
+    assert [result.attempts for result in results] == [1, 1, 2, 1, 2]
+    assert len(servers.opened) == 3
+    assert len(servers.sent) == 5
+    assert pool.summary() == {'sent': 5, 'failed': 0, 'failures': {}, 'connections_opened': 3}
+
+def test_gives_up_when_every_session_drops():
+    servers = Servers(lambda: DroppingSMTP(limit=0))
+    with SMTPPool(connection_factory=servers, size=1) as pool:
+        result = pool.send(message('parent@example.com'), retries=1)
+
+    assert not result.ok
+    assert result.attempts == 2
+    assert 'closed' in result.error
+    summary = pool.summary()
+    assert summary['sent'] == 0
+    assert summary['failures'] == {'parent@example.com': result.error}
+
+def test_retry_opens_a_new_session_when_idle_ones_are_stale():
+    servers = Servers(lambda: DroppingSMTP(limit=100))
+    with SMTPPool(connection_factory=servers, size=2) as pool:
+        # Two sessions sit idle until the server times both of them out
+        sessions = [pool._acquire(), pool._acquire()]
+        for session in sessions:
+            pool._release(session)
+        for server in servers.opened:
+            server.limit = 0
+
+        result = pool.send(message('parent@example.com'), retries=1)
+
+    assert result.ok
+    assert result.attempts == 2
+    assert len(servers.opened) == 3
+    assert servers.opened[-1].sent == ['parent@example.com']
+
+def test_summary_keeps_counts_but_bounds_failures():
+    servers = Servers(lambda: DroppingSMTP(limit=0))
+    with SMTPPool(connection_factory=servers, size=1, max_failures_kept=3) as pool:
+        for i in range(5):
+            pool.send(message(f"parent{i}@example.com"), retries=0)
+
+    summary = pool.summary()
+    assert summary['failed'] == 5
+    assert list(summary['failures']) == [f"parent{i}@example.com" for i in (2, 3, 4)]
+
+def test_concurrent_sends_never_exceed_pool_size():
+    servers = Servers(lambda: FakeSMTP(latency=0.005))
+    with SMTPPool(connection_factory=servers, size=2) as pool:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(pool.send, [message(f"parent{i}@example.com") for i in range(40)]))
+
+    assert all(result.ok for result in results)
+    assert len(servers.opened) <= 2
+    assert sorted(servers.sent) == sorted(f"parent{i}@example.com" for i in range(40))
+    assert pool.summary()['sent'] == 40
+    assert pool.connections_opened == len(servers.opened)
+
+def test_default_port_follows_tls_mode(monkeypatch):
+    for name in ('SMTP_PORT', 'SMTP_USE_SSL', 'SMTP_STARTTLS'):
+        monkeypatch.delenv(name, raising=False)
+
+    assert SMTPPool().port == 587
+    assert SMTPPool(use_ssl=True).port == 465
+    assert SMTPPool(starttls=False).port == 25
+    monkeypatch.setenv('SMTP_PORT', '2525')
+    assert SMTPPool(use_ssl=True).port == 2525
+
+def test_local_server_receives_every_message():
+    controller_module = pytest.importorskip('aiosmtpd.controller')
+
+    class Handler:
+        def __init__(self):
+            self.recipients = []
+            self.sessions = set()
+
+        async def handle_DATA(self, server, session, envelope):
+            self.recipients.extend(envelope.rcpt_tos)
+            self.sessions.add(id(session))
+            return '250 OK'
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    handler = Handler()
+    controller = controller_module.Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        with SMTPPool(host='127.0.0.1', port=port, user='', password='', starttls=False, size=1) as pool:
+            results = [pool.send(message(f"parent{i}@example.com")) for i in range(5)]
+    finally:
+        controller.stop()
+
+    assert all(result.ok for result in results)
+    assert handler.recipients == [f"parent{i}@example.com" for i in range(5)]
+    assert len(handler.sessions) == 1
+    assert pool.connections_opened == 1
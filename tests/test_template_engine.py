@@ -0,0 +1,89 @@
+import io
+import pytest
+from pypdf import PdfReader
+from pdf_engine import PDFEngine
+from report_generator import ReportGenerator
+from schema import StudentRecord
+from template_engine import Template, TemplateError, get_stylesheet, get_template, parse_css
+
+@pytest.mark.parametrize('source, context, expected', [
+    ("Hi {{ name }}!", {'name': 'Asha'}, "Hi Asha!"),
+    ("{{ student.name }}", {'student': {'name': 'Asha'}}, "Asha"),
+    ("{{ missing.deep|default:'n/a' }}", {}, "n/a"),
+    ('{{ blank|default:"-" }}', {'blank': ''}, "-"),
+    ("{{ zero|default:'-' }}", {'zero': 0}, "0"),
+    ("{{ quote }}", {'quote': '<b>"Tom & Jerry"</b>'}, "&lt;b&gt;&quot;Tom &amp; Jerry&quot;&lt;/b&gt;"),
+    ("{% if items %}yes{% else %}no{% endif %}", {'items': []}, "no"),
+    ("{% if items %}yes{% else %}no{% endif %}", {'items': [1]}, "yes"),
+    ("{% if a.b %}yes{% endif %}", {'a': {}}, ""),
+    ("{% for x in xs %}[{{ x }}]{% endfor %}", {'xs': ['a', '<b>']}, "[a][&lt;b&gt;]"),
+    ("{% for x in missing %}[{{ x }}]{% endfor %}", {}, ""),
+    ("{% for row in rows %}{% for x in row %}{{ x }}{% endfor %};{% endfor %}", {'rows': [[1, 2], [3]]}, "12;3;"),
+    ("{% for x in xs %}{% if x.ok %}{{ x.name }}{% else %}-{% endif %}{% endfor %}",
+     {'xs': [{'ok': True, 'name': 'A'}, {'ok': False, 'name': 'B'}]}, "A-"),
+])
+def test_render(source, context, expected):
+    assert Template(source).render(context) == expected
+
+def test_loop_variable_does_not_leak():
+    assert Template("{% for x in xs %}{% endfor %}{{ x|default:'none' }}").render({'xs': [1], 'x': None}) == 'none'
+
+@pytest.mark.parametrize('source', [
+    "{% if x %}never closed",
+    "{% for x in xs %}never closed",
+    "{% while x %}{% endwhile %}",
+    "{{ x|upper }}",
+    "{{ x + 1 }}",
+])
+def test_unsupported_syntax_is_rejected(source):
+    with pytest.raises(TemplateError):
+        Template(source)
+
+def test_parse_css():
+    rules = parse_css("""
+        /* comment { ignored } */
+        .report { color: #333333; LINE-HEIGHT: 1.8 }
+        .report h1,
+        .report   h2 { font-weight: bold; margin-bottom: 1.5rem; }
+        .report h2 { color: #000000; margin-bottom: 2rem }
+        .empty {}
+    """)
+
+    assert rules['.report'] == {'color': '#333333', 'line-height': '1.8'}
+    assert rules['.report h1'] == {'font-weight': 'bold', 'margin-bottom': '1.5rem'}
+    # Later rules for the same selector add to and override earlier ones
+    assert rules['.report h2'] == {'font-weight': 'bold', 'margin-bottom': '2rem', 'color': '#000000'}
+    assert rules['.empty'] == {}
+
+def test_dyslexia_stylesheet_parses():
+    rules = get_stylesheet('dyslexia_template.css')
+    assert rules['.dyslexic-report']['background-color'] == '#FFFFEB'
+    assert rules['.dyslexic-report h2']['font-weight'] == 'bold'
+
+def structured_report():
+    record = StudentRecord(101, 'Asha', 'en', 'standard', '', 'Visual', {})
+    analysis = {
+        'strengths': [{'subject': 'Science', 'evidence': 'Average score 88.5 across 3 assessments'}],
+        'improvements': [{'subject': 'Math', 'trend': 12.5}],
+        'risks': [{'subject': 'Art', 'drop': 20.0}],
+    }
+    fields = {'trend_highlight': 'Math is up 12.5% - great progress!',
+              'study_tips': ['Draw mind maps', 'Colour-code notes']}
+    return ReportGenerator.report_context(record, analysis, 'Visual', 'Asks sharp questions & helps others', fields)
+
+@pytest.mark.parametrize('acc_pref', ['standard', 'dyslexic'])
+def test_structured_report_pdf_text(acc_pref):
+    data = PDFEngine().render_pdf(structured_report(), acc_pref, 'S1234')
+
+    text = ' '.join(' '.join(page.extract_text().split()) for page in PdfReader(io.BytesIO(data)).pages)
+    for expected in ('Scoreazy Learning Report', 'Math is up 12.5% - great progress!', 'Top Strengths',
+                     'Science: Average score 88.5 across 3 assessments', 'Math: 12.5% improvement',
+                     'Art: 20.0% drop detected', 'Learning Style: Visual', 'Draw mind maps', 'Colour-code notes',
+                     '"Asks sharp questions & helps others"'):
+        assert expected in text
+
+def test_empty_sections_are_skipped():
+    html = get_template('base_report.html').render({'vark_type': 'Aural', 'study_tips': []})
+    assert 'Top Strengths' not in html and 'Attention Areas' not in html
+    assert 'Learning Style: Aural' in html
+    assert '<li>' not in html
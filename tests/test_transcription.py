@@ -0,0 +1,24 @@
+from transcription import Transcriber, TranscriptCache
+
+def transcriber(tmp_path):
+    return Transcriber(backend='stub', workers=1, cache=TranscriptCache(str(tmp_path / 'transcripts.db')),
+                       directory=str(tmp_path / 'teacher_audio'))
+
+def test_new_and_replaced_recordings_are_changes(tmp_path):
+    audio = tmp_path / 'teacher_audio'
+    audio.mkdir()
+    for student_id in ('101', '102', '103'):
+        (audio / f'{student_id}.wav').write_bytes(f'RIFF feedback for {student_id}'.encode())
+    first = transcriber(tmp_path)
+    first.start()
+    built = {student_id: first.audio_key(student_id) for student_id in ('101', '102', '103')}
+    first.close()
+
+    (audio / '104.wav').write_bytes(b'RIFF new recording')
+    # 103's old clip was transcribed by an earlier run, but its report never used it
+    built['103'] = 'stub:an-older-clip'
+    later = transcriber(tmp_path)
+
+    assert sorted(later.changed_recordings(built=built.get)) == ['103', '104']
+    assert later.changed_recordings(skip=['104']) == []
+    later.close()
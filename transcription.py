@@ -0,0 +1,308 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from metrics import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+AUDIO_DIR = 'teacher_audio'
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.ogg', '.flac', '.webm')
+
+# Spoken fillers dropped from transcripts (see prompts/whisper_prompt.txt)
+_FILLERS = re.compile(r'\b(?:um+|uh+|ah+|er+|erm+|hmm+)\b[,.]?\s*', re.I)
+
+def clean_transcript(text):
+    text = _FILLERS.sub('', text or '')
+    return ' '.join(text.split())
+
+def audio_hash(path):
+    """sha256 of the clip's bytes: the transcript cache key"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def discover_audio(directory=AUDIO_DIR):
+    """{student_id: path} for teacher_audio/<StudentID>.<ext>; the newest clip wins"""
+    clips = {}
+    if not os.path.isdir(directory):
+        return clips
+    with os.scandir(directory) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() not in AUDIO_EXTENSIONS or not entry.is_file():
+                continue
+            mtime = entry.stat().st_mtime
+            if stem not in clips or mtime > clips[stem][1]:
+                clips[stem] = (entry.path, mtime)
+    return {student_id: path for student_id, (path, _) in clips.items()}
+
+class WhisperBackend:
+    """whisper-timestamped on CPU; the model is loaded once per worker process.
+
+    A job's clips are decoded one after another: batching saves the
+    per-job overhead (process hand-off, model already warm), not decode
+    time, since whisper-timestamped has no batched decode.
+    """
+
+    def __init__(self, model_name=None, language=None):
+        self.model_name = model_name or os.getenv('WHISPER_MODEL', 'base')
+        self.language = language or os.getenv('WHISPER_LANGUAGE') or None
+        self.name = f"whisper-{self.model_name}"
+        self._model = None
+
+    def transcribe(self, paths, prompt=None):
+        import whisper_timestamped as whisper
+        if self._model is None:
+            self._model = whisper.load_model(self.model_name, device='cpu')
+        texts = []
+        for path in paths:
+            audio = whisper.load_audio(path)
+            result = whisper.transcribe(self._model, audio, language=self.language, initial_prompt=prompt)
+            texts.append(result.get('text', ''))
+        return texts
+
+class StubBackend:
+    """Canned transcripts for tests and dry runs; never touches the audio"""
+
+    name = 'stub'
+
+    def transcribe(self, paths, prompt=None):
+        return [f"Recorded feedback: great effort this term ({os.path.basename(path)})" for path in paths]
+
+BACKENDS = {'whisper': WhisperBackend, 'stub': StubBackend}
+
+def get_backend(name=None):
+    name = (name or os.getenv('TRANSCRIBE_BACKEND', 'whisper')).lower()
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown TRANSCRIBE_BACKEND '{name}' (expected one of {', '.join(BACKENDS)})") from None
+
+# Per-worker backend, built once by the pool initializer
+_backend = None
+
+def _init_worker(backend_name):
+    global _backend
+    _backend = get_backend(backend_name)
+
+def _transcribe_batch(paths, prompt):
+    start = time.perf_counter()
+    texts = _backend.transcribe(paths, prompt)
+    return texts, time.perf_counter() - start
+
+class TranscriptCache:
+    """Transcripts in SQLite keyed by backend and audio content hash"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('TRANSCRIPT_CACHE_PATH', 'cache/transcripts.db')
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcripts ("
+            "key TEXT PRIMARY KEY, "
+            "text TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._conn.execute("SELECT text FROM transcripts WHERE key = ?", (key,)).fetchone()
+        return entry[0] if entry else None
+
+    def set(self, key, text):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transcripts (key, text, created_at) VALUES (?, ?, ?)",
+                (key, text, time.time())
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class Transcriber:
+    """Teacher-audio transcription that runs ahead of the report pipeline.
+
+    start() finds teacher_audio/<StudentID>.* clips, serves the ones whose
+    content hash is already cached and sends the rest, TRANSCRIBE_BATCH_SIZE
+    clips per job, to a pool of TRANSCRIBE_WORKERS processes that each load
+    the backend model once. quote() only blocks if a student's clip is
+    still being transcribed when the narrative stage asks for it.
+    """
+
+    def __init__(self, backend=None, workers=None, batch_size=None, cache=None, directory=None):
+        self.backend_name = (backend or os.getenv('TRANSCRIBE_BACKEND', 'whisper')).lower()
+        self.backend = get_backend(self.backend_name)
+        self.workers = int(workers or os.getenv('TRANSCRIBE_WORKERS') or max(1, (os.cpu_count() or 2) // 2))
+        self.batch_size = max(1, int(batch_size or os.getenv('TRANSCRIBE_BATCH_SIZE', '4')))
+        self.directory = directory or AUDIO_DIR
+        self.cache = cache or TranscriptCache()
+        self._executor = None
+        self._lock = threading.Lock()
+        self.clips = {}
+        self.keys = {}
+        # path -> (mtime, size, key), so a clip is hashed once per run
+        self._hashes = {}
+        self._ready = {}
+        self._pending = {}
+        self.cached = 0
+        self.transcribed = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def start(self, student_ids=None):
+        """Index clips and queue every uncached one; returns the number queued.
+
+        With `student_ids`, clips of other students (e.g. in another shard
+        or unchanged since the last sync) are left alone.
+        """
+        self.clips = discover_audio(self.directory)
+        if student_ids is not None:
+            wanted = {str(student_id) for student_id in student_ids}
+            self.clips = {s: path for s, path in self.clips.items() if s in wanted}
+        todo = []
+        for student_id, path in self.clips.items():
+            try:
+                key = self._key(path)
+            except OSError as e:
+                logger.error(f"Could not read teacher audio {path}: {e}")
+                continue
+            self.keys[student_id] = key
+            text = self.cache.get(key)
+            if text is not None:
+                self._ready[student_id] = text
+                self.cached += 1
+            else:
+                todo.append(student_id)
+        metrics.inc('transcripts_total', self.cached, result='cached')
+
+        if todo:
+            from prompt_registry import get_registry
+            prompt = get_registry().render('whisper')
+            self._executor = ProcessPoolExecutor(
+                max_workers=min(self.workers, -(-len(todo) // self.batch_size)),
+                initializer=_init_worker,
+                initargs=(self.backend_name,)
+            )
+            for i in range(0, len(todo), self.batch_size):
+                batch = todo[i:i + self.batch_size]
+                future = self._executor.submit(_transcribe_batch, [self.clips[s] for s in batch], prompt)
+                for student_id in batch:
+                    self._pending[student_id] = (future, batch.index(student_id))
+        logger.info(
+            f"Teacher audio: {len(self.clips)} clips, {self.cached} cached, "
+            f"{len(todo)} queued for {self.backend.name}"
+        )
+        return len(todo)
+
+    def _key(self, path):
+        stat = os.stat(path)
+        hashed = self._hashes.get(path)
+        if hashed is None or hashed[:2] != (stat.st_mtime, stat.st_size):
+            hashed = (stat.st_mtime, stat.st_size, f"{self.backend.name}:{audio_hash(path)}")
+            self._hashes[path] = hashed
+        return hashed[2]
+
+    def changed_recordings(self, skip=(), built=None):
+        """StudentIDs whose recording is not yet in their report.
+
+        That is a clip whose transcript is not cached, or, with `built`
+        (StudentID -> transcript key of the last report, e.g.
+        BuildManifest.quote_key), one other than the report was built with.
+        An incremental sync adds these students although their sheet rows
+        did not change. Students in `skip` are already being rebuilt.
+        """
+        skip = {str(student_id) for student_id in skip}
+        changed = []
+        for student_id, path in discover_audio(self.directory).items():
+            if student_id in skip:
+                continue
+            try:
+                key = self._key(path)
+            except OSError as e:
+                logger.error(f"Could not read teacher audio {path}: {e}")
+                continue
+            previous = built(student_id) if built is not None else None
+            if self.cache.get(key) is None or (previous is not None and previous != key):
+                changed.append(student_id)
+        return changed
+
+    def audio_key(self, student_id):
+        """Transcript cache key of the student's clip (None without audio)"""
+        return self.keys.get(str(student_id))
+
+    def adopt(self, student_id, key):
+        """Serve the cached transcript for `key` although the clip is gone (e.g. purged by retention).
+
+        Returns the transcript, or None if it is no longer cached.
+        """
+        text = self.cache.get(key)
+        if text is not None:
+            with self._lock:
+                self.keys.setdefault(str(student_id), key)
+                self._ready.setdefault(str(student_id), text)
+        return text
+
+    def quote(self, student_id, timeout=None):
+        """Transcript for the student, waiting for it if needed; None without audio"""
+        student_id = str(student_id)
+        with self._lock:
+            if student_id in self._ready:
+                return self._ready[student_id]
+            pending = self._pending.get(student_id)
+        if pending is None:
+            return None
+
+        future, position = pending
+        try:
+            texts, seconds = future.result(timeout=timeout)
+            text = clean_transcript(texts[position])
+        except Exception as e:
+            logger.error(f"Transcription failed for student {student_id}: {e}")
+            with self._lock:
+                if self._pending.pop(student_id, None) is not None:
+                    self.failed += 1
+                    metrics.inc('transcripts_total', result='failed')
+            return None
+
+        with self._lock:
+            if self._pending.pop(student_id, None) is not None:
+                self._ready[student_id] = text
+                self.transcribed += 1
+                self.seconds += seconds / len(texts)
+                metrics.inc('transcripts_total', result='transcribed')
+                self.cache.set(self.keys[student_id], text)
+        return text
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.backend.name,
+                'clips': len(self.clips),
+                'cached': self.cached,
+                'transcribed': self.transcribed,
+                'failed': self.failed,
+                'transcribe_seconds': round(self.seconds, 3)
+            }
+
+    def close(self):
+        # Finish (and cache) clips whose reports were never built this run
+        for student_id in list(self._pending):
+            self.quote(student_id)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.cache.close()